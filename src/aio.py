@@ -0,0 +1,132 @@
+import asyncio
+import codecs
+import threading
+from concurrent.futures import CancelledError
+
+from parser import FeedParser, Parser, TreeBuilder
+
+async def chunks(source, chunk_size = 1 << 16):
+    """Yields the chunks of an input source, which is an
+    asyncio.StreamReader, or another object with an async read method, or
+    an async iterable of str or bytes chunks."""
+
+    if hasattr(source, "read"):
+
+        while True:
+
+            chunk = await source.read(chunk_size)
+
+            if not chunk:
+                break
+
+            yield chunk
+
+    else:
+
+        async for chunk in source:
+            yield chunk
+
+
+async def read(source, chunk_size = 1 << 16):
+    """Reads the whole of an input source and returns it as a str or bytes.
+
+    The source is as for chunks, or a str or bytes object, which is returned
+    as it is."""
+
+    if isinstance(source, (str, bytes)):
+        return source
+
+    parts = [chunk async for chunk in chunks(source, chunk_size)]
+
+    if not parts:
+        return b""
+
+    return parts[0][:0].join(parts)
+
+
+async def run(steps):
+    """Runs a generator of parse steps, giving other tasks a turn at each
+    pause, and returns its return value."""
+
+    while True:
+
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+        await asyncio.sleep(0)
+
+
+async def parse(source, builder = None, interval = 250, offload = False, executor = None, parser = None):
+    """Reads an input source and parses it without blocking the event loop,
+    returning the builder's result as Parser.parse does.
+
+    The source is as for read, and a Parser may be given to choose its
+    options.  By default the parse runs on the event loop, and gives other
+    tasks a turn after every interval tokens of element content, so the
+    loop is never held for more than the time taken by that many tokens.
+
+    If the source is a stream and neither a builder nor a parser is given,
+    the chunks are passed to a FeedParser as they arrive, so each top-level
+    element is parsed while the rest is still being read.  Chunks of bytes
+    are decoded as UTF-8, so offsets are then in characters.  Otherwise the
+    whole input is read before parsing starts.
+
+    If offload is True, the whole input is read and parsed in a thread pool
+    executor instead, which is the loop's default one unless another is
+    given.  If the awaiting task is cancelled, the parse stops at its next
+    interval, so that the worker thread is freed as well."""
+
+    if builder is None and parser is None and not (offload or isinstance(source, (str, bytes))):
+        return await parse_stream(source, interval)
+
+    input = await read(source)
+
+    if builder is None:
+        builder = TreeBuilder()
+
+    if parser is None:
+        parser = Parser()
+
+    if not offload:
+        await run(parser.steps(input, builder, interval))
+        return builder.close()
+
+    cancelled = threading.Event()
+
+    def work():
+
+        for _ in parser.steps(input, builder, interval):
+
+            if cancelled.is_set():
+                raise CancelledError()
+
+        return builder.close()
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, work)
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+
+
+async def parse_stream(source, interval = 250):
+    """Parses the chunks of a stream with a FeedParser as they arrive, and
+    returns the AST of the whole input."""
+
+    feeder = FeedParser()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    nodes = []
+
+    async for chunk in chunks(source):
+
+        if not isinstance(chunk, str):
+            chunk = decoder.decode(chunk)
+
+        nodes.extend(await run(feeder.feed_steps(chunk, interval)))
+
+    nodes.extend(await run(feeder.feed_steps(decoder.decode(b"", True), interval)))
+    nodes.extend(await run(feeder.close_steps(interval)))
+
+    return feeder.root(nodes)
@@ -0,0 +1,104 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import document
+import serialize
+from parser import ParseError
+
+def parse_many(inputs, workers = None, ordered = True, chunksize = None, limits = None):
+    """Parses many documents in a pool of worker processes.
+
+    Each input is either an os.PathLike naming a UTF-8 file, or a str or
+    bytes holding DML text.  Inputs are sent to the workers in chunks, and
+    documents come back in the compact form used by serialize, which is
+    much cheaper to transfer than pickled trees.
+
+    Returns an iterator over the results in input order.  If ordered is
+    False, (index, result) pairs are produced as soon as each chunk is
+    done instead.  A result is a document.Element, or a ParseError for an
+    input which failed; for files its filename is set.  A file which could
+    not be read or input which is not valid UTF-8 is reported as a
+    ParseError too, at line and column 0.  A failed input does not stop the
+    others.  Limits are as for document.parse, and a LimitError is returned
+    like any other ParseError.  With one worker, inputs are parsed in the
+    current process."""
+
+    items = []
+
+    for index, input in enumerate(inputs):
+
+        if isinstance(input, os.PathLike):
+            items.append((index, os.fspath(input), True))
+        else:
+            items.append((index, input, False))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if chunksize is None:
+        chunksize = max(1, len(items) // (workers * 4))
+
+    chunks = [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+    parse = partial(parse_chunk, limits = limits)
+
+    if workers <= 1:
+        return results(map(parse, chunks), ordered)
+
+    return pool_results(parse, chunks, workers, ordered)
+
+
+def pool_results(parse, chunks, workers, ordered):
+
+    with ProcessPoolExecutor(workers) as executor:
+
+        futures = [executor.submit(parse, chunk) for chunk in chunks]
+        done = futures if ordered else as_completed(futures)
+
+        yield from results((future.result() for future in done), ordered)
+
+
+def results(chunks, ordered):
+    """Decodes the results of parse_chunk."""
+
+    for chunk in chunks:
+
+        for index, ok, data in chunk:
+
+            result = serialize.load_document(data) if ok else data
+            yield result if ordered else (index, result)
+
+
+def parse_chunk(items, limits = None):
+    """Parses a chunk of (index, input, is_file) items in a worker.
+
+    Returns (index, True, serialized document) for each input which parses,
+    and (index, False, ParseError) for each one which does not."""
+
+    out = []
+
+    for index, input, is_file in items:
+
+        try:
+
+            if is_file:
+                doc = document.parse_file(input, limits)
+            else:
+                doc = document.parse(input, limits = limits)
+
+        except ParseError as raised:
+            error = raised
+        except OSError as raised:
+            error = ParseError(raised.strerror or str(raised), 0, 0)
+        except UnicodeDecodeError as raised:
+            error = ParseError("Input is not valid UTF-8: " + raised.reason, 0, 0)
+        else:
+            out.append((index, True, serialize.dump_document(doc)))
+            continue
+
+        if is_file:
+            error.filename = input
+
+        out.append((index, False, error))
+
+    return out
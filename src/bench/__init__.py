@@ -0,0 +1,286 @@
+import io
+import time
+import tracemalloc
+import document
+import render
+import serialize
+from parser import Parser
+from scanner import Scanner, TYPE
+from bench.corpus import generate
+
+SAMPLE = """
+body {
+
+    div#main.content {
+
+        [lang=en]
+
+        here's some text with a few words in it, and a { [href=`http://example.com`] link }
+
+        p {
+
+            A paragraph with some ``backticks`` and non-ASCII text: naïve café, 日本語の文章。
+        }
+
+        ```
+        raw block contents { not parsed }
+        ```
+    }
+}
+"""
+
+
+def scan_all(input, reference = False):
+    """Tokenizes the input in the default context and returns the token count."""
+
+    scanner = Scanner(input, reference)
+    count = 0
+
+    while scanner.scan(None)[TYPE] != "eof":
+        count += 1
+
+    return count
+
+
+def bench_scanner(size = 1 << 20):
+    """Compares the pattern-based scanner on str and UTF-8 bytes input with
+    the reference scanner."""
+
+    input = SAMPLE * (size // len(SAMPLE) + 1)
+    modes = [
+        ("pattern", input, False),
+        ("bytes", input.encode("utf-8"), False),
+        ("reference", input, True),
+    ]
+
+    for name, data, reference in modes:
+
+        start = time.perf_counter()
+        count = scan_all(data, reference)
+        elapsed = time.perf_counter() - start
+
+        print("%-10s %8d tokens %8.3fs %8.2f MB/s" % (
+            name,
+            count,
+            elapsed,
+            len(data) / elapsed / 1e6))
+
+
+# Replacements for the lowercase ASCII letters in each script
+SCRIPTS = {
+    "ascii": "abcdefghijklmnopqrstuvwxyz",
+    "latin": "àbçdéfğhïjķłmñöþqřšťüvŵxÿž",
+    "greek": "αβγδεζηθικλμνξοπρστυφχψωάέ",
+    "cjk": "日本語文章中国한국어문장テキスト漢字かなカナ東西南北",
+}
+
+
+def bench_unicode(size = 1 << 20):
+    """Compares scanning prose written in ASCII with the same prose written
+    in other scripts, so that each input has the same characters and tokens
+    apart from the letters."""
+
+    input = generate("prose", size)
+
+    for script, letters in SCRIPTS.items():
+
+        text = input.translate(str.maketrans(SCRIPTS["ascii"], letters))
+        modes = [
+            ("pattern", text, False),
+            ("bytes", text.encode("utf-8"), False),
+            ("reference", text, True),
+        ]
+
+        for name, data, reference in modes:
+
+            start = time.perf_counter()
+            scan_all(data, reference)
+            elapsed = time.perf_counter() - start
+
+            print("%-6s %-10s %8.3fs %8.2f Mchars/s" % (
+                script,
+                name,
+                elapsed,
+                len(text) / elapsed / 1e6))
+
+
+def bench_nesting(depth = 10000):
+    """Times parsing and document building for deeply nested input."""
+
+    input = "div { " * depth + "text" + " }" * depth
+
+    start = time.perf_counter()
+    tree = Parser().parse(input)
+    parsed = time.perf_counter()
+    document.from_ast(tree)
+    built = time.perf_counter()
+
+    print("nesting    %8d levels %8.3fs parse %8.3fs from_ast" % (
+        depth,
+        parsed - start,
+        built - parsed))
+
+
+def bench_document(size = 1 << 20):
+    """Compares building a document from an AST with the fused builder."""
+
+    input = SAMPLE * (size // len(SAMPLE) + 1)
+    modes = [
+        ("from_ast", lambda: document.from_ast(Parser().parse(input))),
+        ("fused", lambda: document.parse(input)),
+    ]
+
+    for name, run in modes:
+
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+
+        print("%-10s %8.3fs %8.2f MB/s" % (name, elapsed, len(input) / elapsed / 1e6))
+
+
+def count_nodes(root):
+    """Returns the number of nodes in a document, including the root."""
+
+    count = 0
+    stack = [root]
+
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.iter_children())
+
+    return count
+
+
+def bench_memory(size = 1 << 20):
+    """Reports the memory held by a parsed document, in total and per node,
+    for each corpus kind, as built by the parser, with coalesced text runs,
+    and as loaded from its serialized form, where equal text values are
+    shared."""
+
+    for kind in ("wide", "prose", "selectors", "mixed"):
+
+        input = generate(kind, size)
+        modes = [
+            ("parse", lambda: document.parse(input)),
+            ("runs", lambda: document.parse(input, coalesce = True)),
+            ("load", lambda: serialize.load_document(serialize.dump_document(document.parse(input)))),
+        ]
+
+        for name, run in modes:
+
+            tracemalloc.start()
+
+            try:
+                doc = run()
+                used = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+
+            nodes = count_nodes(doc)
+            print("%-10s %-6s %8d nodes %8.1f MB %8.1f bytes/node" % (kind, name, nodes, used / 1e6, used / nodes))
+
+
+def bench_serialize(size = 1 << 20):
+    """Compares loading documents and ASTs from their serialized form with
+    parsing them again from the source."""
+
+    for kind in ("wide", "prose", "selectors", "mixed"):
+
+        input = generate(kind, size)
+        doc = document.parse(input)
+        tree = Parser().parse(input)
+        modes = [
+            ("document", lambda: document.parse(input), serialize.dump_document(doc), serialize.load_document),
+            ("ast", lambda: Parser().parse(input), serialize.dump_ast(tree), serialize.load_ast),
+        ]
+
+        for name, parse, data, load in modes:
+
+            start = time.perf_counter()
+            parse()
+            parsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            load(data)
+            loaded = time.perf_counter() - start
+
+            print("%-10s %-8s %8d bytes %8.3fs parse %8.3fs load %6.1fx" % (
+                kind, name, len(data), parsed, loaded, parsed / loaded))
+
+
+def naive_escape(value):
+
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+def naive_html(node):
+    """Renders an element's children as render does, but by recursive string
+    concatenation."""
+
+    out = ""
+
+    for i, child in enumerate(node.iter_children()):
+
+        if i > 0 and child not in node.joined:
+            out += " "
+
+        if isinstance(child, document.Text):
+            out += child.value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            continue
+
+        name = child.name or "div"
+
+        if child.namespace:
+            name = child.namespace + ":" + name
+
+        out += "<" + name
+
+        if child.id:
+            out += ' id="' + naive_escape(child.id) + '"'
+
+        if child.has_classes():
+            out += ' class="' + naive_escape(" ".join(sorted(child.iter_classes()))) + '"'
+
+        for key, value in child.iter_attributes():
+            out += " " + key if value is None else " " + key + '="' + naive_escape(value) + '"'
+
+        if child.has_children():
+            out += ">" + naive_html(child) + "</" + name + ">"
+        elif name in render.VOID_ELEMENTS:
+            out += ">"
+        else:
+            out += "></" + name + ">"
+
+    return out
+
+
+def bench_render(size = 1 << 20):
+    """Compares the streaming renderer with naive string concatenation, which
+    makes the same markup, for the sample document and each corpus kind."""
+
+    inputs = [("sample", SAMPLE * (size // len(SAMPLE) + 1))]
+    inputs += [(kind, generate(kind, size)) for kind in ("wide", "prose", "selectors", "mixed")]
+
+    for kind, input in inputs:
+
+        doc = document.parse(input)
+        modes = [
+            ("naive", lambda: naive_html(doc)),
+            ("render", lambda: render.render_string(doc)),
+        ]
+        outputs = []
+        times = []
+
+        for name, run in modes:
+
+            start = time.perf_counter()
+            outputs.append(run())
+            elapsed = time.perf_counter() - start
+            times.append(elapsed)
+
+            print("%-10s %-8s %8.3fs %6.1fx" % (kind, name, elapsed, times[0] / elapsed))
+
+        if outputs[1] != outputs[0]:
+            raise AssertionError("render and naive_html made different markup for " + kind)
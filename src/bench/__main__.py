@@ -0,0 +1,46 @@
+import argparse
+import json
+
+import bench
+from bench import suite
+from bench.corpus import KINDS
+
+arguments = argparse.ArgumentParser(prog = "python -m bench", description = "Runs the DML benchmarks.")
+arguments.add_argument("--kind", action = "append", choices = list(KINDS), help = "corpus kind to run (default: all)")
+arguments.add_argument("--stage", action = "append", choices = list(suite.STAGES), help = "stage to time (default: all)")
+arguments.add_argument("--size", type = int, default = 1 << 20, help = "approximate size of each document in characters")
+arguments.add_argument("--seed", type = int, default = 0)
+arguments.add_argument("--repeat", type = int, default = 3, help = "timed runs per measurement; the best is reported")
+arguments.add_argument("--output", help = "save the results as JSON to this file")
+arguments.add_argument("--compare", help = "compare throughput with results saved by --output")
+arguments.add_argument("--micro", action = "store_true", help = "run the older micro-benchmarks instead")
+
+args = arguments.parse_args()
+
+if args.micro:
+
+    bench.bench_scanner()
+    bench.bench_unicode()
+    bench.bench_nesting()
+    bench.bench_document()
+    bench.bench_memory()
+    bench.bench_serialize()
+    bench.bench_render()
+
+else:
+
+    report = suite.run(args.kind, args.stage, args.size, args.seed, args.repeat,
+        lambda result: print(suite.format_result(result)))
+
+    if args.output:
+        suite.save(report, args.output)
+
+    if args.compare:
+
+        with open(args.compare) as file:
+            old = json.load(file)
+
+        print()
+
+        for line in suite.compare(old, report):
+            print(line)
@@ -0,0 +1,179 @@
+import random
+
+WORDS = (
+    "the quick brown fox jumps over lazy dog and then some more words "
+    "appear in this sentence which is long enough to look like prose"
+).split()
+
+UNICODE_WORDS = (
+    "naïve café déjà vu Ærøskøbing Straße Ελληνικά русский текст "
+    "日本語の文章 中文文本 한국어 문장 עברית العربية हिन्दी 🙂 ☃"
+).split()
+
+# Non-ASCII spaces and line breaks which the scanner recognizes
+UNICODE_SPACES = ("\u00A0", "\u2003", "\u202F", "\u3000", "\uFEFF")
+UNICODE_NEWLINES = ("\u2028", "\u2029")
+
+
+def words(rng, count, vocabulary = WORDS):
+
+    return " ".join(rng.choice(vocabulary) for _ in range(count))
+
+
+def wide(rng, size):
+    """A single body with a great many small sibling elements."""
+
+    parts = ["list {\n"]
+    length = len(parts[0])
+
+    while length < size:
+
+        part = "    item { %s }\n" % words(rng, rng.randint(1, 4))
+        parts.append(part)
+        length += len(part)
+
+    parts.append("}\n")
+
+    return "".join(parts)
+
+
+def deep(rng, size):
+    """Elements nested as deeply as the size allows."""
+
+    depth = max(1, size // 12)
+
+    return "div { " * depth + words(rng, 3) + " }" * depth
+
+
+def prose(rng, size):
+    """Paragraphs of plain text with few elements."""
+
+    parts = []
+    length = 0
+
+    while length < size:
+
+        lines = [words(rng, rng.randint(8, 16)) for _ in range(rng.randint(3, 8))]
+        part = "p {\n\n    " + "\n    ".join(lines) + "\n}\n\n"
+        parts.append(part)
+        length += len(part)
+
+    return "".join(parts)
+
+
+def selectors(rng, size):
+    """Elements with long selector lists and many attributes."""
+
+    parts = []
+    length = 0
+    n = 0
+
+    while length < size:
+
+        n += 1
+        classes = "".join(".c%d" % rng.randint(0, 99) for _ in range(rng.randint(1, 6)))
+        attributes = " ".join(
+            "[k%d=v%d]" % (i, rng.randint(0, 999)) if i % 3 else "[flag%d]" % i
+            for i in range(rng.randint(1, 8)))
+
+        part = "ns:div#id%d%s { %s [href=`http://example.com/%d`] %s }\n" % (
+            n, classes, attributes, n, words(rng, 2))
+
+        parts.append(part)
+        length += len(part)
+
+    return "".join(parts)
+
+
+def inline_raw(rng, size):
+    """Text with long inline raw strings, including escaped backticks."""
+
+    parts = []
+    length = 0
+
+    while length < size:
+
+        raw = " ``quoted`` ".join(words(rng, 20) for _ in range(rng.randint(1, 10)))
+        part = "code { `%s` %s }\n" % (raw, words(rng, 3))
+        parts.append(part)
+        length += len(part)
+
+    return "".join(parts)
+
+
+def raw_blocks(rng, size):
+    """Large raw blocks of code-like lines."""
+
+    parts = []
+    length = 0
+
+    while length < size:
+
+        lines = ["    %s { %s } `x`" % (rng.choice(WORDS), words(rng, 6)) for _ in range(rng.randint(50, 200))]
+        part = "pre {\n```\n" + "\n".join(lines) + "\n```\n}\n"
+        parts.append(part)
+        length += len(part)
+
+    return "".join(parts)
+
+
+def crlf(rng, size):
+    """A mixed document with CRLF line endings."""
+
+    return mixed(rng, size).replace("\n", "\r\n")
+
+
+def unicode(rng, size):
+    """Non-ASCII text separated by Unicode spaces and line breaks."""
+
+    parts = []
+    length = 0
+
+    while length < size:
+
+        text = "".join(
+            rng.choice(UNICODE_WORDS) + rng.choice(UNICODE_SPACES + (" ",))
+            for _ in range(rng.randint(5, 20)))
+
+        part = "σ.ü#名前 { [lang=ja] %s%s}\n" % (text, rng.choice(UNICODE_NEWLINES))
+        parts.append(part)
+        length += len(part)
+
+    return "".join(parts)
+
+
+def mixed(rng, size):
+    """Sections of wide, prose, selector and raw content, with prose the
+    most common."""
+
+    makers = (wide, prose, prose, selectors, inline_raw, raw_blocks)
+    parts = []
+    length = 0
+
+    while length < size:
+
+        part = "section {\n%s}\n" % rng.choice(makers)(rng, min(size - length, 4096))
+        parts.append(part)
+        length += len(part)
+
+    return "".join(parts)
+
+
+KINDS = {
+    "wide": wide,
+    "deep": deep,
+    "prose": prose,
+    "selectors": selectors,
+    "inline_raw": inline_raw,
+    "raw_blocks": raw_blocks,
+    "crlf": crlf,
+    "unicode": unicode,
+    "mixed": mixed,
+}
+
+
+def generate(kind, size = 1 << 20, seed = 0):
+    """Returns a DML document of about size characters.  The same kind,
+    size and seed always produce the same document."""
+
+    return KINDS[kind](random.Random("%s:%d" % (kind, seed)), size)
@@ -0,0 +1,123 @@
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import document
+from parser import Parser
+from bench import scan_all
+from bench.corpus import KINDS, generate
+
+STAGES = {
+    "scanner": scan_all,
+    "parser": lambda input: Parser().parse(input),
+    "document": document.parse,
+}
+
+
+def measure(run, input, repeat):
+    """Returns the best time of several runs and the peak memory allocated
+    during a separate traced run."""
+
+    best = None
+
+    for _ in range(repeat):
+
+        start = time.perf_counter()
+        run(input)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    tracemalloc.start()
+
+    try:
+        run(input)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return best, peak
+
+
+def run(kinds = None, stages = None, size = 1 << 20, seed = 0, repeat = 3, log = None):
+    """Runs each stage on a generated document of each kind.
+
+    Returns a dict holding the settings and a list of results, each with
+    the corpus kind, stage, input size in bytes of UTF-8, token count, best
+    time in seconds, MB/s, tokens/s and peak traced memory.  If log is given,
+    it is called with each result as it is produced."""
+
+    results = []
+
+    for kind in kinds or KINDS:
+
+        input = generate(kind, size, seed)
+        length = len(input.encode("utf-8"))
+        tokens = scan_all(input)
+
+        for stage in stages or STAGES:
+
+            elapsed, peak = measure(STAGES[stage], input, repeat)
+
+            result = {
+                "kind": kind,
+                "stage": stage,
+                "bytes": length,
+                "tokens": tokens,
+                "seconds": elapsed,
+                "mb_per_second": length / elapsed / 1e6,
+                "tokens_per_second": tokens / elapsed,
+                "peak_memory": peak,
+            }
+
+            results.append(result)
+
+            if log is not None:
+                log(result)
+
+    return {
+        "python": sys.version,
+        "platform": platform.platform(),
+        "size": size,
+        "seed": seed,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def format_result(result):
+
+    return "%-10s %-9s %8.2f MB/s %10.0f tokens/s %8.1f MB peak" % (
+        result["kind"],
+        result["stage"],
+        result["mb_per_second"],
+        result["tokens_per_second"],
+        result["peak_memory"] / 1e6)
+
+
+def save(report, path):
+
+    with open(path, "w") as file:
+        json.dump(report, file, indent = 2)
+
+
+def compare(old, new):
+    """Returns lines comparing the throughput of two saved reports."""
+
+    before = { (r["kind"], r["stage"]): r for r in old["results"] }
+    lines = []
+
+    for result in new["results"]:
+
+        previous = before.get((result["kind"], result["stage"]))
+
+        if previous is not None:
+            lines.append("%-10s %-9s %+7.1f%%" % (
+                result["kind"],
+                result["stage"],
+                (result["mb_per_second"] / previous["mb_per_second"] - 1) * 100))
+
+    return lines
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import tempfile
+import zlib
+from collections import OrderedDict
+
+import document
+import serialize
+
+MAGIC = b"DMLC"
+DIGEST_SIZE = 16
+
+class CacheStats:
+    """Counters for a ParseCache."""
+
+    __slots__ = ("hits", "misses", "disk_hits", "disk_writes", "disk_errors", "evictions")
+
+    def __init__(self):
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.disk_writes = 0
+        self.disk_errors = 0
+        self.evictions = 0
+
+    def __repr__(self):
+
+        return "CacheStats(%s)" % ", ".join("%s=%d" % (name, getattr(self, name)) for name in self.__slots__)
+
+
+class ParseCache:
+    """A cache of parsed documents, keyed by a hash of the input.
+
+    Entries are kept in serialized form in a bounded in-memory LRU, and
+    optionally in a directory on disk.  Every lookup returns a new document
+    tree, so callers may modify the result.  Disk entries record the format
+    version, the input hash and a checksum, and are ignored if any of them
+    do not match."""
+
+    def __init__(self, max_entries = 1024, max_bytes = 64 << 20, directory = None):
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.size = 0
+        self.stats = CacheStats()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok = True)
+
+
+    def __len__(self):
+
+        return len(self.entries)
+
+
+    def key(self, input, coalesce = False):
+        """Returns the cache key of an input string or UTF-8 buffer.  Inputs
+        parsed with coalesced text runs have different keys."""
+
+        if isinstance(input, str):
+            input = input.encode("utf-8", "surrogatepass")
+
+        person = b"runs" if coalesce else b""
+
+        return hashlib.blake2b(input, digest_size = DIGEST_SIZE, person = person).digest()
+
+
+    def parse(self, input, coalesce = False, limits = None):
+        """Returns the document for the input, parsing it only if it is not
+        in the cache.  Limits are as for document.parse."""
+
+        if limits is not None and limits.max_size is not None and len(input) > limits.max_size:
+            # Reject oversized input before hashing it; this raises LimitError
+            return document.parse(input, coalesce = coalesce, limits = limits)
+
+        key = self.key(input, coalesce)
+        data = self.entries.get(key)
+
+        if data is not None:
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+            return serialize.load_document(data)
+
+        data = self.read(key)
+
+        if data is not None:
+            self.stats.disk_hits += 1
+            self.store(key, data)
+            return serialize.load_document(data)
+
+        self.stats.misses += 1
+        doc = document.parse(input, coalesce = coalesce, limits = limits)
+        data = serialize.dump_document(doc)
+
+        self.store(key, data)
+        self.write(key, data)
+
+        return doc
+
+
+    def clear(self):
+        """Removes all entries from memory.  Disk entries are kept."""
+
+        self.entries.clear()
+        self.size = 0
+
+
+    def store(self, key, data):
+
+        if len(data) > self.max_bytes:
+            return
+
+        self.entries[key] = data
+        self.size += len(data)
+
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last = False)
+            self.size -= len(evicted)
+            self.stats.evictions += 1
+
+
+    def path(self, key):
+
+        return os.path.join(self.directory, key.hex() + ".dmlc")
+
+
+    def read(self, key):
+        """Returns the serialized document for a key from disk, or None."""
+
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self.path(key), "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+
+        header = len(MAGIC) + 1 + DIGEST_SIZE + 4
+        payload = data[header:]
+
+        if (len(data) < header or
+            data[:len(MAGIC)] != MAGIC or
+            data[len(MAGIC)] != serialize.VERSION or
+            data[len(MAGIC) + 1:header - 4] != key or
+            int.from_bytes(data[header - 4:header], "little") != zlib.crc32(payload)):
+
+            self.stats.disk_errors += 1
+            return None
+
+        return payload
+
+
+    def write(self, key, data):
+        """Writes a serialized document to disk, replacing any existing entry."""
+
+        if self.directory is None:
+            return
+
+        header = MAGIC + bytes([serialize.VERSION]) + key + zlib.crc32(data).to_bytes(4, "little")
+        fd, temp = tempfile.mkstemp(dir = self.directory)
+
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(header)
+                file.write(data)
+            os.replace(temp, self.path(key))
+        except OSError:
+
+            self.stats.disk_errors += 1
+
+            if os.path.exists(temp):
+                os.unlink(temp)
+
+            return
+
+        self.stats.disk_writes += 1
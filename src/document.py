@@ -1,80 +1,556 @@
+import functools
+import mmap
+import os
+import serialize
+from sys import intern
+from types import MappingProxyType
+from syntax import Visitor
 from parser import Parser
+from scanner import span_value
+
+# Shared immutable containers for elements without attributes, classes or
+# children
+EMPTY_ATTRIBUTES = MappingProxyType({})
+EMPTY_CLASSES = frozenset()
+EMPTY_CHILDREN = ()
+EMPTY_JOINED = frozenset()
 
 class Element:
+    """An element of a document.
+    
+    The attributes dict, classes set and children list of an element are
+    only created when they are first used.  Until then the element shares
+    the immutable EMPTY_ATTRIBUTES, EMPTY_CLASSES and EMPTY_CHILDREN
+    containers, which the attributes, classes and children properties
+    replace by a new dict, set or list when they are read, so they can be
+    changed in place as before.  Code which only reads an element, such as
+    a walk over a whole document, uses the has_ and iter_ methods instead,
+    which do not create empty containers.  Names, ids and classes are
+    interned by the document builders, so repeated ones are stored once.
+    
+    joined is the set of children which follow their previous sibling with
+    no whitespace between them in the source, such as the "," of "a {b},".
+    It is the shared EMPTY_JOINED set if there are none, as for most
+    elements."""
 
+    __slots__ = ("namespace", "name", "id", "_attributes", "_classes", "_children", "joined", "index")
+    
     def __init__(self):
     
         self.namespace = ""
         self.name = ""
         self.id = ""
-        self.attributes = dict()
-        self.classes = set()
-        self.children = list()
+        self._attributes = EMPTY_ATTRIBUTES
+        self._classes = EMPTY_CLASSES
+        self._children = EMPTY_CHILDREN
+        self.joined = EMPTY_JOINED
+        self.index = None
+    
+    
+    @property
+    def attributes(self):
+    
+        if self._attributes is EMPTY_ATTRIBUTES:
+            self._attributes = {}
+        
+        return self._attributes
+    
+    @attributes.setter
+    def attributes(self, attributes):
+    
+        self._attributes = attributes
+    
+    
+    @property
+    def classes(self):
+    
+        if self._classes is EMPTY_CLASSES:
+            self._classes = set()
+        
+        return self._classes
+    
+    @classes.setter
+    def classes(self, classes):
+    
+        self._classes = classes
+    
+    
+    @property
+    def children(self):
+    
+        if self._children is EMPTY_CHILDREN:
+            self._children = []
+        
+        return self._children
+    
+    @children.setter
+    def children(self, children):
+    
+        self._children = children
+    
+    
+    def has_attributes(self):
+        """Returns True if the element has any attributes."""
+        
+        return bool(self._attributes)
+    
+    
+    def has_classes(self):
+        """Returns True if the element has any classes."""
+        
+        return bool(self._classes)
+    
+    
+    def has_children(self):
+        """Returns True if the element has any children."""
+        
+        return bool(self._children)
+    
+    
+    def iter_attributes(self):
+        """Returns an iterator over the (key, value) pairs of the
+        attributes."""
+        
+        return iter(self._attributes.items())
+    
+    
+    def iter_classes(self):
+        """Returns an iterator over the class names."""
+        
+        return iter(self._classes)
+    
+    
+    def iter_children(self):
+        """Returns an iterator over the child elements and text nodes."""
+        
+        return iter(self._children)
+    
+    
+    def set_attribute(self, key, value):
+        """Sets an attribute.  A value of None makes a boolean attribute."""
+        
+        self.attributes[key] = value
+    
+    
+    def add_class(self, name):
+        """Adds a class name."""
+        
+        self.classes.add(name)
+    
+    
+    def append(self, node, joined = False):
+        """Adds a child element or text node after the others.  If joined is
+        True, the node directly follows the previous one; see joined."""
+        
+        if self._children is EMPTY_CHILDREN:
+            self._children = [node]
+        else:
+            self._children.append(node)
+        
+        if joined:
+        
+            if self.joined is EMPTY_JOINED:
+                self.joined = {node}
+            else:
+                self.joined.add(node)
+    
+    
+    def __reduce__(self):
+    
+        # Pickle in the compact form of the serialize module, which does not
+        # recurse, so that deep trees can be pickled
+        return serialize.load_document, (serialize.dump_document(self),)
+    
+    
+    def query(self, selector):
+        """Returns the elements below this one which match a selector such
+        as "ns:div#main.content", in document order.  A selector which is
+        empty or not valid raises ParseError.
+        
+        The first query builds an Index of the elements below this one, which
+        is reused by later queries.  Call reindex after changing the tree."""
+        
+        if self.index is None:
+            self.index = Index(self)
+        
+        return self.index.query(selector)
+    
+    
+    def reindex(self):
+        """Discards the index used by query."""
+        
+        self.index = None
 
 
 class Text:
+    """A text node of a document.
+    
+    Text has no children, but can be walked like an element: children is
+    the shared empty tuple, and has_children and iter_children are as for
+    an element."""
 
+    __slots__ = ("value",)
+    
+    children = EMPTY_CHILDREN
+    
     def __init__(self, value):
         
         self.value = value
-        self.children = []
-
-
-def parse(input):
-
-    return from_ast(Parser().parse(input))
     
+    
+    def has_children(self):
+        
+        return False
+    
+    
+    def iter_children(self):
+        
+        return iter(EMPTY_CHILDREN)
 
-def from_ast(ast):
 
-    def visit(node, element):
+class Index:
+    """Maps ids, classes and names to the elements below a root element.
+    
+    Each map lists elements in document order, and a name maps by
+    (namespace, name).  Ids are not required to be unique, so an id maps to
+    every element which has it.  A query starts from the shortest of the
+    lists for its selectors and checks the others on each element, so it
+    takes time in proportion to the number of candidates rather than the
+    size of the tree."""
+    
+    def __init__(self, root):
+    
+        self.elements = []
+        self.ids = {}
+        self.classes = {}
+        self.names = {}
+        
+        # The iterators over the children of each open element
+        stack = [root.iter_children()]
         
-        t = node.type
-        e = None
+        while stack:
         
-        if t == "Element":
+            node = next(stack[-1], None)
+            
+            if node is None:
+                stack.pop()
+                continue
+            
+            if node.__class__ is Text:
+                continue
+            
+            self.elements.append(node)
+            
+            if node.id:
+                self.ids.setdefault(node.id, []).append(node)
             
-            e = Element()
-            element.children.append(e)
+            for name in node.iter_classes():
+                self.classes.setdefault(name, []).append(node)
             
-            for child in node:
-                visit(child, e)
+            self.names.setdefault((node.namespace, node.name), []).append(node)
+            
+            if node.has_children():
+                stack.append(node.iter_children())
+    
+    
+    def query(self, selector):
+        """Returns the elements which match a selector, in document order."""
         
-        elif t == "ElementBody":
+        namespace, name, id, classes = parse_selector(selector)
+        candidates = self.elements
         
-            for child in node:
-                visit(child, element)
+        if id is not None:
+            candidates = self.ids.get(id, [])
+        
+        if name is not None:
+        
+            elements = self.names.get((namespace, name), [])
             
-        elif t == "NameSelector":
+            if len(elements) < len(candidates):
+                candidates = elements
+        
+        for class_name in classes:
         
-            if node.namespace != None:
-                element.namespace = node.namespace.value
+            elements = self.classes.get(class_name, [])
             
-            element.name = node.name.value
+            if len(elements) < len(candidates):
+                candidates = elements
+        
+        return [e for e in candidates if
+            (id is None or e.id == id) and
+            (name is None or (e.name == name and e.namespace == namespace)) and
+            (not classes or classes.issubset(e.iter_classes()))]
+
+
+@functools.lru_cache(maxsize = 256)
+def parse_selector(selector):
+    """Returns the namespace, name, id and set of classes in a selector.
+    The name and id are None if the selector does not have them."""
+    
+    namespace = name = id = None
+    classes = set()
+    
+    for part in Parser().parse_selectors(selector, DocumentBuilder()):
+    
+        kind = part[0]
+        
+        if kind == DocumentBuilder.NAME:
+        
+            namespace = part[1] or ""
+            name = part[2]
+        
+        elif kind == DocumentBuilder.ID:
+        
+            id = part[1]
+        
+        else:
+        
+            classes.add(part[1])
+    
+    return namespace, name, id, frozenset(classes)
+
+
+class DocumentBuilder:
+    """Builds a document directly from the parser's callbacks, without
+    creating AST nodes.  The result is the same as from_ast."""
+
+    NAME = 0
+    ID = 1
+    CLASS = 2
+    
+    def __init__(self):
+    
+        # The open elements, and the children of the innermost one and those
+        # of them which are joined to their previous sibling
+        self.stack = []
+        self.children = None
+        self.joined = None
+        self.root = None
         
-        elif t == "IdSelector":
+        # The end of the last child of the innermost element, if it has
+        # any, and the span of the last text node made
+        self.last = None
+        self.start = None
+        self.end = None
+    
+    
+    # Identifiers hold the names, ids, classes and attribute keys which
+    # repeat throughout a document
+    @staticmethod
+    def Identifier(value, start, end):
+        return intern(value)
+    
+    @staticmethod
+    def NameSelector(namespace, name, start, end):
+        return (DocumentBuilder.NAME, namespace, name)
+    
+    @staticmethod
+    def IdSelector(id, start, end):
+        return (DocumentBuilder.ID, id)
+    
+    @staticmethod
+    def ClassSelector(name, start, end):
+        return (DocumentBuilder.CLASS, name)
+    
+    @staticmethod
+    def Attribute(key, value, start, end):
+        return (key, value if value is None or value.__class__ is str else value.value)
+    
+    def Text(self, value, newlines, start, end, source = None, spans = None):
+    
+        self.start = start
+        self.end = end
+        return Text(span_value(source, spans) if value is None else value)
+    
+    RawString = Text
+    RawBlock = Text
+    
+    # A document has no node for invalid input, which a parser in recovering
+    # mode reports in its errors list instead
+    @staticmethod
+    def Error(message, start, end):
+        return None
+    
+    
+    def start_element(self, selectors, attributes, start, body_start):
+    
+        e = Element()
+        
+        for selector in selectors:
+        
+            kind = selector[0]
+            
+            if kind == DocumentBuilder.NAME:
             
-            element.id = node.id.value
+                if selector[1] != None:
+                    e.namespace = selector[1]
+                
+                e.name = selector[2]
+            
+            elif kind == DocumentBuilder.ID:
+            
+                e.id = selector[1]
+            
+            else:
+            
+                e.add_class(selector[1])
         
-        elif t == "ClassSelector":
+        if attributes:
+            e._attributes = dict(attributes)
         
-            element.classes.add(node.name.value)
+        if self.children is None:
+            self.root = e
+        else:
         
-        elif t == "Attribute":
+            if start == self.last:
+                self.join(e)
+            
+            self.children.append(e)
         
-            element.attributes[node.key.value] = node.value.value if node.value else None
+        self.stack.append((e, self.children, self.joined))
+        self.children = []
+        self.joined = None
+        self.last = None
+    
+    
+    def end_element(self, end):
+    
+        e, parent, joined = self.stack.pop()
         
-        elif t == "Text" or t == "RawString" or t == "RawBlock":
+        if self.children:
+            e._children = self.children
+        
+        if self.joined:
+            e.joined = self.joined
+        
+        self.children = parent
+        self.joined = joined
+        self.last = end
+    
+    
+    def join(self, node):
+    
+        if self.joined is None:
+            self.joined = {node}
+        else:
+            self.joined.add(node)
+    
+    
+    def add(self, node):
+    
+        if node is not None:
         
-            element.children.append(Text(node.value))
+            if self.start == self.last:
+                self.join(node)
             
+            self.children.append(node)
+            self.last = self.end
+    
+    
+    def close(self):
+    
+        return self.root
+
+
+def parse(input, cache = None, coalesce = False, limits = None):
+    """Parses the input and returns the root element of the document.
+    
+    If a cache.ParseCache is given, the document is taken from the cache
+    when the same input has been parsed before.  If coalesce is True, each
+    run of words is a single Text node; see Parser.  If a parser.Limits is
+    given, the parse raises LimitError when it exceeds them; a document
+    taken from the cache was parsed before, and is not checked again."""
+
+    if cache is not None:
+        return cache.parse(input, coalesce, limits)
+    
+    return Parser(coalesce = coalesce, limits = limits).parse(input, DocumentBuilder())
+
+
+def parse_file(path, limits = None):
+    """Parses a UTF-8 encoded file.  Limits are as for parse.
+    
+    The file is memory-mapped and scanned as bytes, so it is never decoded
+    or copied as a whole, and parsing starts before all of it has been read."""
+
+    with open(path, "rb") as file:
+    
+        if os.fstat(file.fileno()).st_size == 0:
+            return parse(b"", limits = limits)
         
-    doc = Element()
+        with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as buffer:
+            return parse(buffer, limits = limits)
     
-    for node in ast.selectors:
-        visit(node, doc)
+
+class DocumentVisitor(Visitor):
+    """Builds a document from the nodes of an AST."""
+
+    def __init__(self, root):
     
-    visit(ast.body, doc)
+        self.element = root
+        self.stack = []
+        
+        # The end of the last child of the element, if it has any
+        self.last = None
     
-    return doc
+    
+    def visit_Element(self, node):
+    
+        e = Element()
+        self.element.append(e, node.start == self.last)
+        self.stack.append(self.element)
+        self.element = e
+        self.last = None
+    
+    
+    def leave_Element(self, node):
+    
+        self.element = self.stack.pop()
+        self.last = node.end
+    
+    
+    def visit_NameSelector(self, node):
+    
+        if node.namespace != None:
+            self.element.namespace = intern(node.namespace.value)
+        
+        self.element.name = intern(node.name.value)
+        return Visitor.SKIP
+    
+    
+    def visit_IdSelector(self, node):
+    
+        self.element.id = intern(node.id.value)
+        return Visitor.SKIP
+    
+    
+    def visit_ClassSelector(self, node):
+    
+        self.element.add_class(intern(node.name.value))
+        return Visitor.SKIP
+    
+    
+    def visit_Attribute(self, node):
+    
+        self.element.set_attribute(intern(node.key.value), node.value.value if node.value else None)
+        return Visitor.SKIP
+    
+    
+    def visit_Text(self, node):
+    
+        self.element.append(Text(node.value), node.start == self.last)
+        self.last = node.end
+    
+    visit_RawString = visit_Text
+    visit_RawBlock = visit_Text
+
 
+def from_ast(ast):
+
+    doc = Element()
+    visitor = DocumentVisitor(doc)
+    
+    for node in ast:
+        visitor.visit(node)
+    
+    return doc
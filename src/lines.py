@@ -0,0 +1,91 @@
+import re
+from array import array
+from bisect import bisect_left
+
+newline = re.compile(r"\r\n?|[\n\u2028\u2029]")
+byte_newline = re.compile(rb"\r\n?|\n|\xE2\x80[\xA8\xA9]")
+
+class LineIndex:
+    """Maps input offsets to line and column numbers.
+
+    Line breaks are found the first time a position is requested, and only
+    up to that position, so building an index costs nothing until it is
+    used, and finding a position near the start of a large input does not
+    scan the rest of it.  Lines and columns are numbered from one.  For
+    bytes input holding UTF-8 text, columns count bytes."""
+
+    def __init__(self, input):
+
+        self.input = input
+        self.breaks = None
+
+        # The offset up to which line breaks have been found
+        self.end = 0
+
+
+    def build(self, end = None):
+        """Returns the sorted line break offsets, finding them if necessary
+        up to end, or in the whole input if end is None.
+
+        A CRLF pair is recorded at its LF.  The first entry is a sentinel line
+        break before the start of the input.  Breaks after end may already
+        have been found."""
+
+        if self.breaks is None:
+            self.breaks = array("q", [-1])
+
+        length = len(self.input)
+        end = length if end is None else min(end, length)
+
+        if end > self.end:
+
+            pattern = newline if isinstance(self.input, str) else byte_newline
+            breaks = self.breaks
+            last = end
+
+            # Look one past end, so that a CR at end - 1 is matched with the
+            # LF of its CRLF pair
+            for match in pattern.finditer(self.input, self.end, min(end + 1, length)):
+
+                if match.start() >= end:
+                    break
+
+                last = match.end()
+                breaks.append(last - 1)
+
+            self.end = max(end, last)
+
+        return self.breaks
+
+
+    def line_count(self):
+        """Returns the number of lines in the input."""
+
+        return len(self.build())
+
+
+    def line_number(self, offset):
+        """Returns the line number of the specified input offset.  A line break
+        belongs to the line that it ends."""
+
+        return bisect_left(self.build(offset), offset)
+
+
+    def line_offset(self, line):
+        """Returns the input offset of the first character of the specified line."""
+
+        breaks = self.build()
+
+        if line < 1 or line > len(breaks):
+            raise IndexError("line number out of range")
+
+        return breaks[line - 1] + 1
+
+
+    def position(self, offset):
+        """Returns a (line, column) tuple for the specified input offset."""
+
+        breaks = self.build(offset)
+        line = bisect_left(breaks, offset)
+
+        return line, offset - breaks[line - 1]
@@ -1,10 +1,16 @@
-import ast
-from scanner import Scanner
+import re
+import syntax
+import time
+from bisect import bisect_right
+from lines import LineIndex, newline
+from scanner import Scanner, TokenBuffer, span_value, TYPE, START, END, SPANS, NEWLINES, ERROR
 
 class ParseError(Exception):
 
     def __init__(self, msg, line, column, filename = ""):
     
+        super().__init__(msg, line, column, filename)
+        
         self.message = msg
         self.line = line
         self.column = column
@@ -16,141 +22,868 @@ class ParseError(Exception):
     #       occurred (perhaps with a wavy line underneath).
     
 
-class Parser:
+class LimitError(ParseError):
+    """Raised when a parse exceeds one of its Limits.  The position is
+    where the parse had reached."""
+
+
+class Limits:
+    """Bounds on the work done by a parse, for untrusted input.
+    
+    max_size is the length of the input, in characters or, for bytes input,
+    bytes.  max_depth is the nesting depth of elements, and max_nodes the
+    number of elements, child nodes, selectors and attributes, not counting
+    the root.
+    max_raw_block is the length of a raw block, including its fences.
+    max_tokens is the number of tokens scanned, including any scanned again
+    after a rewind, and timeout is the wall time of the parse in seconds.
+    None means no limit.  The token count and the time are only checked
+    every CHECK_INTERVAL tokens."""
+    
+    __slots__ = ("max_size", "max_depth", "max_nodes", "max_raw_block", "max_tokens", "timeout")
+    
+    CHECK_INTERVAL = 1024
+    
+    def __init__(self, max_size = None, max_depth = None, max_nodes = None, max_raw_block = None, max_tokens = None, timeout = None):
+    
+        self.max_size = max_size
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.max_raw_block = max_raw_block
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+
+
+def limit_error(lines, msg, offset):
+
+    # A LineIndex only finds line breaks up to the offset, so the cost is
+    # bounded by the work already done
+    line, column = lines.position(offset)
+    return LimitError(msg, line, column)
+
 
+class LimitScanner(Scanner):
+    """A scanner which enforces the input size, raw block, token count and
+    time limits of a parse."""
+
+    def __init__(self, input, limits):
+    
+        size = limits.max_size
+        
+        if size is not None and len(input) > size:
+            raise limit_error(LineIndex(input), "Input is longer than %d" % size, size)
+        
+        super().__init__(input)
+        self.limits = limits
+        self.max_raw_block = limits.max_raw_block
+        self.count = 0
+        self.next_check = 0
+        self.deadline = None if limits.timeout is None else time.monotonic() + limits.timeout
+        
+        self.schedule()
+    
+    
+    def raw_block_too_long(self, start):
+    
+        raise limit_error(self.lines(), "Raw block is longer than %d" % self.max_raw_block, start)
+    
+    
+    def scan(self, context):
+    
+        tok = Scanner.scan(self, context)
+        self.count += 1
+        
+        if self.count >= self.next_check:
+            self.check(tok[END])
+        
+        return tok
+    
+    
+    def check(self, offset):
+    
+        limits = self.limits
+        
+        if limits.max_tokens is not None and self.count > limits.max_tokens:
+            raise limit_error(self.lines(), "More than %d tokens" % limits.max_tokens, offset)
+        
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise limit_error(self.lines(), "Parse took longer than %g seconds" % limits.timeout, offset)
+        
+        self.schedule()
+    
+    
+    def schedule(self):
+        """Sets the token count at which the limits are next checked."""
+    
+        self.next_check = self.count + Limits.CHECK_INTERVAL
+        
+        if self.limits.max_tokens is not None:
+            self.next_check = min(self.next_check, self.limits.max_tokens + 1)
+
+
+class LimitBuilder:
+    """Wraps a builder, enforcing the depth and node count limits of a
+    parse.  The node factories are the wrapped builder's own."""
+
+    def __init__(self, builder, limits, scanner):
+    
+        self.builder = builder
+        self.scanner = scanner
+        self.max_depth = limits.max_depth
+        self.max_nodes = limits.max_nodes
+        
+        # The root element is not counted
+        self.depth = -1
+        self.nodes = -1
+    
+    
+    def __getattr__(self, name):
+    
+        return getattr(self.builder, name)
+    
+    
+    def start_element(self, selectors, attributes, start, body_start):
+    
+        self.depth += 1
+        
+        if self.max_depth is not None and self.depth > self.max_depth:
+            raise limit_error(self.scanner.lines(), "Elements are nested deeper than %d" % self.max_depth, start)
+        
+        self.count()
+        self.builder.start_element(selectors, attributes, start, body_start)
+    
+    
+    def end_element(self, end):
+    
+        self.depth -= 1
+        self.builder.end_element(end)
+    
+    
+    # Selectors and attributes are counted as they are made, so that an
+    # element with very many of them is stopped before it is started
+    def NameSelector(self, *args):
+    
+        self.count()
+        return self.builder.NameSelector(*args)
+    
+    
+    def IdSelector(self, *args):
+    
+        self.count()
+        return self.builder.IdSelector(*args)
+    
+    
+    def ClassSelector(self, *args):
+    
+        self.count()
+        return self.builder.ClassSelector(*args)
+    
+    
+    def Attribute(self, *args):
+    
+        self.count()
+        return self.builder.Attribute(*args)
+    
+    
+    def add(self, node):
+    
+        self.count()
+        self.builder.add(node)
+    
+    
+    def close(self):
+    
+        return self.builder.close()
+    
+    
+    def count(self):
+    
+        self.nodes += 1
+        
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise limit_error(self.scanner.lines(), "More than %d nodes" % self.max_nodes, self.scanner.offset)
+
+
+def shared_source(cls):
+    """Makes a TreeBuilder factory for a text node class, which holds the
+    source text of the node in the builder's syntax.Source."""
+
+    def factory(self, value, newlines, start, end, source = None, spans = None):
+    
+        if source is not None:
+        
+            holder = self.source
+            
+            if holder is None or holder.text is not source:
+                holder = self.source = syntax.Source(source)
+            
+            source = holder
+        
+        return cls(value, newlines, start, end, source, spans)
+    
+    return factory
+
+
+class TreeBuilder:
+    """Builds an AST from the parser's callbacks.
+    
+    Open elements are kept on an explicit stack, so the depth of the tree
+    is limited only by memory.  The node factories are the AST classes,
+    except that the text nodes made from the same input share a
+    syntax.Source, which may be given."""
+
+    Identifier = syntax.Identifier
+    NameSelector = syntax.NameSelector
+    IdSelector = syntax.IdSelector
+    ClassSelector = syntax.ClassSelector
+    Attribute = syntax.Attribute
+    RawString = shared_source(syntax.RawString)
+    RawBlock = shared_source(syntax.RawBlock)
+    Text = shared_source(syntax.Text)
+    Error = syntax.Error
+    
+    def __init__(self, source = None):
+    
+        self.stack = []
+        self.children = None
+        self.root = None
+        self.source = source
+    
+    
+    def start_element(self, selectors, attributes, start, body_start):
+    
+        self.stack.append((selectors, attributes, start, body_start, self.children))
+        self.children = []
+    
+    
+    def end_element(self, end):
+    
+        selectors, attributes, start, body_start, parent = self.stack.pop()
+        body = syntax.ElementBody(attributes, self.children, body_start, end)
+        node = syntax.Element(selectors, body, start, end)
+        
+        if parent is None:
+            self.root = node
+        else:
+            parent.append(node)
+        
+        self.children = parent
+    
+    
+    def add(self, node):
+    
+        self.children.append(node)
+    
+    
+    def close(self):
+    
+        return self.root
+
+
+class StartElement:
+    """The data of a start_element event."""
+
+    __slots__ = ("selectors", "attributes", "start", "body_start")
+    
+    def __init__(self, selectors, attributes, start, body_start):
+    
+        self.selectors = selectors
+        self.attributes = attributes
+        self.start = start
+        self.body_start = body_start
+
+
+class EndElement:
+    """The data of an end_element event."""
+
+    __slots__ = ("start", "end")
+    
+    def __init__(self, start, end):
+    
+        self.start = start
+        self.end = end
+
+
+class EventBuilder:
+    """Collects the parser's callbacks as (event, data) pairs instead of
+    building a tree.
+    
+    The events are start_element and end_element, whose data are
+    StartElement and EndElement records, and text, raw_string and raw_block,
+    whose data are the AST text nodes.  A parser in recovering mode also
+    produces error events, whose data are syntax.Error nodes.  Only the start
+    offsets of open elements are kept between events."""
+
+    Identifier = syntax.Identifier
+    NameSelector = syntax.NameSelector
+    IdSelector = syntax.IdSelector
+    ClassSelector = syntax.ClassSelector
+    Attribute = syntax.Attribute
+    RawString = syntax.RawString
+    RawBlock = syntax.RawBlock
+    Text = syntax.Text
+    Error = syntax.Error
+    
+    names = { "Text": "text", "RawString": "raw_string", "RawBlock": "raw_block", "Error": "error" }
+    
     def __init__(self):
     
+        self.events = []
+        self.starts = []
+    
+    
+    def start_element(self, selectors, attributes, start, body_start):
+    
+        self.starts.append(start)
+        self.events.append(("start_element", StartElement(selectors, attributes, start, body_start)))
+    
+    
+    def end_element(self, end):
+    
+        self.events.append(("end_element", EndElement(self.starts.pop(), end)))
+    
+    
+    def add(self, node):
+    
+        self.events.append((self.names[node.type], node))
+    
+    
+    def close(self):
+    
+        return None
+
+
+def parse_tolerant(input, builder = None):
+    """Parses the input in recovering mode and returns a (result, errors)
+    tuple, where errors lists a ParseError for each syntax error in the
+    input, in order.  The result holds Error nodes in place of the invalid
+    input; see Parser."""
+
+    parser = Parser(True)
+    result = parser.parse(input, builder)
+
+    return result, parser.errors
+
+
+def iterparse(input):
+    """Parses the input and yields (event, data) pairs as described by
+    EventBuilder, without building a tree.
+    
+    The root element produces the first and last events."""
+
+    builder = EventBuilder()
+    
+    for _ in Parser().steps(input, builder, 1):
+    
+        if builder.events:
+            events = builder.events
+            builder.events = []
+            yield from events
+    
+    yield from builder.events
+
+
+class Parser:
+    """Parses DML into a tree.
+    
+    By default, the first syntax error raises ParseError.  If recover is
+    True, each error is instead appended to the errors list and the parser
+    resynchronizes: an invalid selector list is skipped up to the "{" of its
+    element, an invalid attribute up to the next "]", "{" or "}" or the end
+    of the line, and a stray "}" or unterminated raw string or block on its
+    own.  The skipped input is added to the tree as an Error node, and
+    elements which are still open at the end of the input are closed, so
+    that one pass reports every error along with a partial tree.  Builders
+    used in recovering mode need an Error factory.
+    
+    By default, each word of text is a separate Text node.  If coalesce is
+    True, each run of consecutive text tokens is made into a single Text
+    node instead, whose value is the source of the run, including the
+    whitespace and newlines between its words.  Text before a "{" on the
+    same line is still the selector of an element, and ends the run.
+    
+    If limits is given, the parse raises LimitError when it exceeds any of
+    the bounds it sets; see Limits.  Limit errors are never recovered."""
+
+    def __init__(self, recover = False, coalesce = False, limits = None):
+    
         self.scanner = None
-        self.peeking = False
+        self.tokens = None
+        self.builder = None
         self.end_offset = 0
+        self.recover = recover
+        self.coalesce = coalesce
+        self.limits = limits
+        self.errors = []
     
     
-    def parse(self, input):
+    def parse(self, input, builder = None):
+        """Parses the input and returns the builder's result, which is an AST
+        unless another builder is given.
+        
+        A builder provides node factories named after the AST classes, and
+        start_element, end_element, add and close methods; see TreeBuilder."""
     
-        self.scanner = Scanner(input)
-        self.peeking = False
-        self.end_offset = 0
+        if builder is None:
+            builder = TreeBuilder()
+        
+        for _ in self.steps(input, builder):
+            pass
         
-        return self.Start()
+        return builder.close()
     
     
-    def peek_start(self, context = None):
+    def steps(self, input, builder, interval = 0, head = True):
+        """Parses the input, passing the results to the builder.
+        
+        This is a generator which pauses after every interval tokens of
+        element content, or only at the end if interval is zero.  If head is
+        False, attributes are not allowed at the start of the input."""
     
-        return self.peek_token(context).start
+        self.reset(input, builder)
+        
+        yield from self.Start(interval, head)
     
     
-    def peek_token(self, context = None):
+    def reset(self, input, builder, offset = 0):
     
-        if not self.peeking:
-            self.scanner.next(context)
-            self.peeking = True
+        self.scanner = self.make_scanner(input)
         
+        if self.limits is not None:
+            builder = LimitBuilder(builder, self.limits, self.scanner)
         
-        return self.scanner
+        self.tokens = TokenBuffer(self.scanner, offset)
+        self.builder = builder
+        self.end_offset = offset
+        self.errors = []
+    
+    
+    def make_scanner(self, input):
+        """Returns the scanner for an input, which enforces the parser's
+        limits if it has any."""
+    
+        if self.limits is None:
+            return Scanner(input)
+        
+        return LimitScanner(input, self.limits)
+    
+    
+    def parse_body(self, input, offset, builder = None):
+        """Parses the element body whose "{" is at the specified offset and
+        returns it as a syntax.ElementBody."""
+    
+        if builder is None:
+            builder = TreeBuilder()
+        
+        self.reset(input, builder, offset)
+        
+        start = self.peek_start("head")
+        errors = []
+        
+        self.read("{")
+        
+        attributes = self.Attributes(errors)
+        self.builder.start_element([], attributes, start, start)
+        
+        for node in errors:
+            self.builder.add(node)
+        
+        for _ in self.Contents(0, 1):
+            pass
+        
+        return builder.close().body
+
+
+    def parse_selectors(self, input, builder = None):
+        """Parses a selector list such as "ns:div#main.content" on its own and
+        returns the list of selectors made by the builder's factories.  An
+        input without selectors is an error."""
+
+        if builder is None:
+            builder = TreeBuilder()
+
+        self.reset(input, builder)
+
+        list = self.SelectorList()
+
+        if not list or self.peek("selector") != "eof":
+            self.unexpected()
+
+        return list
+
+
+    def reparse(self, old_tree, old_text, edit):
+        """Updates a tree after an edit to its source text.
+        
+        The edit is an (offset, removed_len, inserted_text) tuple.  Only the
+        smallest element body whose braces enclose the edit is parsed again;
+        all other nodes are reused, and nodes after the edit have their
+        offsets shifted.  The old tree is modified and returned.  If the edit
+        changes the extent of that body, its ancestors are tried in turn,
+        and finally the whole text is parsed.
+        
+        Only the elements which follow the edit at each level are shifted
+        at once; their descendants are shifted when they are first read.
+        Text nodes which shared the old text are given the new text, so the
+        old text is not kept alive by the tree."""
+    
+        offset, removed, inserted = edit
+        text = old_text[:offset] + inserted + old_text[offset + removed:]
+        delta = len(inserted) - removed
+        limit = offset + removed
+        
+        # Find the path of bodies which enclose the edit
+        path = [old_tree.body]
+        
+        while True:
+        
+            children = path[-1].children
+            index = bisect_right(children, offset, key = lambda node: node.start) - 1
+            
+            if index < 0:
+                break
+            
+            node = children[index]
+            
+            if node.type != "Element" or not (node.body.start < offset and limit < node.body.end):
+                break
+            
+            path.append(node.body)
+        
+        # The text nodes which are kept and those which are made share the
+        # new text, if the old nodes shared the old text
+        source = syntax.find_source(old_tree)
+        
+        if source is None or not (source.text is old_text or source.text == old_text):
+            source = syntax.Source(text)
+        
+        source.text = text
+        
+        # Parse the innermost body which keeps its extent after the edit
+        for depth in range(len(path) - 1, 0, -1):
+        
+            body = path[depth]
+            
+            try:
+                new_body = self.parse_body(text, body.start, TreeBuilder(source))
+            except ParseError:
+                continue
+            
+            if new_body.end == body.end + delta:
+                break
+            
+        else:
+        
+            source.text = old_text
+            return self.parse(text)
+        
+        body.attributes = new_body.attributes
+        body.children = new_body.children
+        body.end = new_body.end
+        
+        # Shift the ancestors and everything after the edit
+        old_tree.end += delta
+        
+        for parent in path[:depth]:
+        
+            parent.end += delta
+            index = bisect_right(parent.children, offset, key = lambda node: node.start) - 1
+            children = parent.children
+            children[index].end += delta
+            
+            for index in range(index + 1, len(children)):
+                syntax.defer_shift(children[index], delta, source)
+        
+        return old_tree
+    
+    
+    def peek_start(self, context = None):
+    
+        tokens = self.tokens
+        return (tokens.peeked or tokens.peek(context))[START]
+    
+    
+    def peek_token(self, context = None, ahead = 0):
+        """Returns the record of the next token, or of a token further ahead,
+        without reading it.  Fields are indexed by the constants in scanner."""
+    
+        if ahead == 0:
+            return self.tokens.peeked or self.tokens.peek(context)
+        
+        return self.tokens.peek(context, ahead)
     
     
     def peek(self, context = None):
     
-        return self.peek_token(context).type
+        tokens = self.tokens
+        return (tokens.peeked or tokens.peek(context))[TYPE]
     
     
     def read(self, type, context = None):
     
-        tok = self.peek_token(context)
+        tokens = self.tokens
+        tok = tokens.peeked or tokens.peek(context)
         
-        if type and tok.type != type:
+        if type and tok[TYPE] != type:
             self.unexpected()
         
-        self.peeking = False
-        self.end_offset = tok.end
+        tokens.next(context)
+        self.end_offset = tok[END]
         
         return tok
     
     
+    def mark(self):
+    
+        return self.tokens.mark()
+    
+    
     def rewind(self, offset):
+        """Moves back to an offset between tokens, usually one returned by
+        mark.  Tokens which had been peeked beyond it are replayed rather
+        than scanned again, where their context allows."""
     
-        self.scanner.offset = offset
+        self.tokens.reset(offset)
         self.end_offset = offset
-        self.peeking = False
     
     
     def fail(self, msg):
     
-        pos = self.scanner.position(self.scanner.offset)
+        tok = self.tokens.peeked
+        pos = self.scanner.position(self.tokens.offset if tok is None else tok[END])
         raise ParseError(msg, pos["line"], pos["column"])
     
     def unexpected(self):
+        """Reports the next token as unexpected.  An illegal token is
+        reported with the scanner's message, such as "Unterminated raw
+        string"."""
+    
+        tok = self.peek_token()
+        
+        if tok[TYPE] == "eof":
+            self.fail("Unexpected end of input")
+        
+        self.fail(tok[ERROR] or "Unexpected token " + tok[TYPE])
+    
+    
+    def invalid(self):
+        """Reports the next token as unexpected.  In recovering mode, the
+        error is recorded and the token is read and added as an Error node."""
     
-        type = self.peek()
+        try:
+            self.unexpected()
+        except ParseError as error:
         
-        self.fail("Unexpected end of input" if type == "eof" else "Unexpected token " + type)
+            if not self.recover or isinstance(error, LimitError):
+                raise
+            
+            self.errors.append(error)
+            tok = self.read(None)
+            self.builder.add(self.builder.Error(error.message, tok[START], tok[END]))
     
     
-    def Start(self):
+    def skip(self, error, stop, context, last = None):
+        """Records an error in recovering mode, or raises it otherwise, and
+        reads tokens up to the next one whose type is in stop, or which
+        starts a new line if stop has None.  A token of type last is read
+        and ends the skipped input."""
     
-        start = self.peek_start("head")
-        return ast.Element([], self.ElementBody(True), start, self.end_offset)
+        if not self.recover or isinstance(error, LimitError):
+            raise error
+        
+        self.errors.append(error)
+        
+        while True:
+        
+            tok = self.peek_token(context)
+            
+            if tok[TYPE] in stop or tok[TYPE] == "eof" or tok[NEWLINES] and None in stop:
+                break
+            
+            self.read(None, context)
+            
+            if tok[TYPE] == last:
+                break
+        
+        # Put back the token which was peeked, so that it can be scanned
+        # again in the next context
+        self.rewind(self.mark())
+    
+    
+    def Start(self, interval, head = True):
     
+        start = self.peek_start("head" if head else None)
+        errors = []
+        attributes = self.Attributes(errors) if head else []
+        
+        self.builder.start_element([], attributes, start, start)
+        
+        for node in errors:
+            self.builder.add(node)
+        
+        yield from self.Contents(interval)
+        self.builder.end_element(self.end_offset)
     
-    def Element(self):
+    
+    def StartElement(self):
     
         start = self.peek_start("selector")
-        selectors = [] if self.peek("selector") == "{" else self.SelectorList()
+        errors = []
+        
+        try:
+        
+            selectors = [] if self.peek("selector") == "{" else self.SelectorList()
+            
+            if self.peek("head") != "{":
+                self.unexpected()
+        
+        except ParseError as error:
+        
+            # The "{" is on the same line, so the selectors end before it
+            self.skip(error, ("{",), "selector")
+            errors.append(self.builder.Error(error.message, start, max(start, self.end_offset)))
+            selectors = []
+        
+        body_start = self.peek_start("head")
+        
+        self.read("{")
+        
+        attributes = self.Attributes(errors)
+        self.builder.start_element(selectors, attributes, start, body_start)
         
-        return ast.Element(selectors, self.ElementBody(), start, self.end_offset)
+        for node in errors:
+            self.builder.add(node)
     
     
-    def ElementBody(self, root = False):
+    def Contents(self, interval, depth = 0):
+        """Parses the children of the root element and all nested elements.
+        
+        Nested elements are tracked with a depth count instead of recursion,
+        and the builder keeps the stack of open elements.  This is a generator
+        which pauses after every interval tokens, if interval is not zero.
+        
+        If depth is given, the contents of that many open elements are parsed
+        and the generator returns after the last one is closed."""
     
-        start = self.peek_start("head")
-        attributes = []
-        children = []
-        node = None
+        builder = self.builder
+        tokens = self.tokens
+        input = self.scanner.input
+        coalesce = self.coalesce
+        nested = depth > 0
+        countdown = interval
         
-        if not root:
-            self.read("{")
+        factories = {
+            "text": builder.Text,
+            "raw-string": builder.RawString,
+            "raw-block": builder.RawBlock,
+        }
         
-        while self.peek("head") == "[":
-            attributes.append(self.Attribute())
+        # A text token is not made into a node until the next token is
+        # known, because a "{" on the same line turns it into the selector
+        # of an element.  Only the text is then scanned again; the "{" is
+        # replayed from the token buffer.
+        pending = None
+        pending_mark = 0
         
-        while True:
+        # When coalescing, the first token of the current run of text, which
+        # has the pending token as its last, and the end of the token before
+        run = None
+        run_end = 0
         
-            tok = self.peek_token()
-            t = tok.type
+        while True:
         
-            if t == "eof":
-                if not root: self.unexpected()
-                break
+            if countdown:
+            
+                countdown -= 1
                 
-            elif t == "}":
-                if root: self.unexpected()
-                break
+                if countdown == 0:
+                    countdown = interval
+                    yield
+            
+            tok = tokens.peeked or tokens.peek()
+            t = tok[TYPE]
             
-            elif t == "{":
-                if tok.newlines == 0 and node != None and node.type != "Element":
-                    self.rewind(children.pop().start)
+            if t == "{":
+            
+                if pending is not None:
+                
+                    if tok[NEWLINES] == 0:
+                    
+                        self.rewind(pending_mark)
+                        
+                        if run is not None:
+                            builder.add(self.TextRun(run, run_end))
+                    
+                    elif run is not None:
+                        builder.add(self.TextRun(run, pending[END]))
+                    else:
+                        builder.add(self.TextNode(pending))
+                    
+                    pending = None
+                    run = None
+                
+                self.StartElement()
+                depth += 1
+                continue
+            
+            if pending is not None:
+            
+                if not coalesce:
+                    builder.add(factories[pending[TYPE]](None, pending[NEWLINES], pending[START], pending[END], input, pending[SPANS]))
+                
+                elif t == "text" and pending[TYPE] == "text":
                 
-                node = self.Element()
+                    # Keep the run going until a token which is not text
+                    if run is None:
+                        run = pending
+                    
+                    run_end = pending[END]
+                
+                elif run is not None:
+                    builder.add(self.TextRun(run, pending[END]))
+                    run = None
+                
+                else:
+                    builder.add(self.TextNode(pending))
+                
+                pending = None
             
-            elif t == "raw-string":
-                node = self.RawString()
+            if t in factories:
+                pending_mark = tokens.mark()
+                pending = tokens.next()
+                self.end_offset = pending[END]
             
-            elif t == "raw-block":
-                node = self.RawBlock()
+            elif t == "}":
+                
+                if depth == 0:
+                    self.invalid()
+                    continue
+                
+                self.read("}")
+                builder.end_element(self.end_offset)
+                depth -= 1
+                
+                if depth == 0 and nested:
+                    return
             
-            elif t == "text":
-                node = self.Text()
+            elif t == "eof":
+                
+                if depth > 0:
+                
+                    try:
+                        self.unexpected()
+                    except ParseError as error:
+                        self.skip(error, (), None)
+                    
+                    # Close the elements which are still open
+                    while depth > 0:
+                        builder.end_element(self.end_offset)
+                        depth -= 1
+                
+                break
             
             else:
-                self.unexpected()
-            
-            children.append(node)
-        
-        
-        if not root:
-            self.read("}")
-        
-        return ast.ElementBody(attributes, children, start, self.end_offset)
+                self.invalid()
     
     
     def SelectorList(self):
@@ -188,21 +921,42 @@ class Parser:
             name = self.Identifier()
         
         
-        return ast.NameSelector(namespace, name, start, self.end_offset)
+        return self.builder.NameSelector(namespace, name, start, self.end_offset)
     
     
     def IdSelector(self):
     
         start = self.peek_start("selector")
         self.read("#", "selector")
-        return ast.IdSelector(self.Identifier(), start, self.end_offset)
+        return self.builder.IdSelector(self.Identifier(), start, self.end_offset)
     
     
     def ClassSelector(self):
     
         start = self.peek_start("selector")
         self.read(".", "selector")
-        return ast.ClassSelector(self.Identifier(), start, self.end_offset)
+        return self.builder.ClassSelector(self.Identifier(), start, self.end_offset)
+    
+    
+    def Attributes(self, errors):
+        """Parses the attributes at the start of an element body.  In
+        recovering mode, Error nodes for invalid attributes are appended to
+        errors."""
+    
+        attributes = []
+        
+        while self.peek("head") == "[":
+        
+            start = self.peek_start("head")
+            
+            try:
+                attributes.append(self.Attribute())
+            except ParseError as error:
+            
+                self.skip(error, ("{", "}", None), "selector", "]")
+                errors.append(self.builder.Error(error.message, start, self.end_offset))
+        
+        return attributes
     
     
     def Attribute(self):
@@ -230,29 +984,327 @@ class Parser:
             
         self.read("]", "selector")
         
-        return ast.Attribute(key, value, start, self.end_offset)
+        return self.builder.Attribute(key, value, start, self.end_offset)
     
     
     def Identifier(self):
     
         tok = self.read("identifier", "selector")
-        return ast.Identifier(tok.value, tok.start, tok.end)
+        return self.builder.Identifier(span_value(self.scanner.input, tok[SPANS]), tok[START], tok[END])
+    
+    
+    def TextNode(self, tok):
+        """Makes the node for a text, raw string or raw block token which has
+        already been read."""
+    
+        if tok[TYPE] == "text":
+            factory = self.builder.Text
+        elif tok[TYPE] == "raw-string":
+            factory = self.builder.RawString
+        else:
+            factory = self.builder.RawBlock
+        
+        return factory(None, tok[NEWLINES], tok[START], tok[END], self.scanner.input, tok[SPANS])
+    
+    
+    def TextRun(self, first, end):
+        """Makes a text node for a run of text tokens, from the start of the
+        first token to the end offset."""
+    
+        start = first[START]
+        
+        return self.builder.Text(None, first[NEWLINES], start, end, self.scanner.input, (start, end))
     
     
     def Text(self):
     
-        tok = self.read("text")
-        return ast.Text(tok.value, tok.newlines, tok.start, tok.end)
+        return self.TextNode(self.read("text"))
     
     
     def RawString(self):
     
-        tok = self.read("raw-string")
-        return ast.RawString(tok.value, tok.newlines, tok.start, tok.end)
+        return self.TextNode(self.read("raw-string"))
     
     
     def RawBlock(self):
     
-        tok = self.read("raw-block")
-        return ast.RawBlock(tok.value, tok.newlines, tok.start, tok.end)
+        return self.TextNode(self.read("raw-block"))
+
+
+class FeedParser:
+    """Parses input which arrives in chunks.
+    
+    Chunks are passed to feed as they arrive, and close is called at the end
+    of the input.  Both return the top-level nodes which have been completed
+    so far, with offsets relative to the start of the whole input.  The
+    attributes of the root element are available from the attributes
+    property once they have been parsed.
+    
+    Each chunk is first scanned for the braces and backticks which decide
+    where top-level elements end, keeping just enough state to handle
+    backtick runs and raw strings which cross chunk boundaries.  Input up to
+    the "}" which closes the last complete top-level element is then parsed,
+    and only the remainder is kept."""
+
+    def __init__(self):
+    
+        self.chunks = []
+        self.size = 0
+        self.base = 0
+        self.line = 0
+        self.column = 0
+        self.attributes = None
+        
+        # The offsets of the first and the end of the last token
+        self.start = 0
+        self.end = 0
+        
+        # Scanning state: the brace depth, what is being scanned (NORMAL,
+        # OPENING, INLINE or BLOCK), the length of an unfinished backtick run
+        # and the number of backticks which close the current raw block
+        self.depth = 0
+        self.mode = FeedParser.NORMAL
+        self.run = 0
+        self.fence = 0
+    
+    NORMAL = 0
+    OPENING = 1
+    INLINE = 2
+    BLOCK = 3
+    
+    
+    def feed(self, chunk):
+        """Adds a chunk of input and returns a list of the top-level nodes
+        which it completes."""
+    
+        return finish(self.feed_steps(chunk))
+    
+    
+    def feed_steps(self, chunk, interval = 0):
+        """Adds a chunk of input like feed.  This is a generator which
+        pauses after every interval tokens while parsing, as Parser.steps
+        does, and returns the list of completed top-level nodes."""
+    
+        boundary = self.scan(chunk)
+        
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        
+        if boundary < 0:
+            return []
+        
+        input = "".join(self.chunks)
+        end = self.size - len(chunk) + boundary
+        rest = input[end:]
+        
+        self.chunks = [rest] if rest else []
+        self.size = len(rest)
+        
+        return (yield from self.parse_steps(input[:end], interval))
+    
+    
+    def close(self):
+        """Ends the input and returns a list of the remaining top-level nodes.
+        
+        Raises ParseError if the input is incomplete."""
+    
+        return finish(self.close_steps())
+    
+    
+    def close_steps(self, interval = 0):
+        """Ends the input like close, as a generator like feed_steps."""
+    
+        input = "".join(self.chunks)
+        
+        self.chunks = []
+        self.size = 0
+        
+        if input == "" and self.attributes is not None:
+            return []
+        
+        return (yield from self.parse_steps(input, interval))
+    
+    
+    def root(self, children):
+        """Returns a root element holding the top-level nodes, with the
+        attributes and offsets which Parser.parse gives it.  This is called
+        after close, with all of the nodes returned by feed and close."""
+    
+        body = syntax.ElementBody(self.attributes or [], children, self.start, self.end)
+        
+        return syntax.Element([], body, self.start, self.end)
+    
+    
+    def parse(self, input):
+        """Parses a segment of the input which ends at a top-level boundary."""
+    
+        return finish(self.parse_steps(input))
+    
+    
+    def parse_steps(self, input, interval = 0):
+    
+        head = self.attributes is None
+        builder = TreeBuilder()
+        
+        try:
+            yield from Parser().steps(input, builder, interval, head)
+        
+        except ParseError as error:
+        
+            if error.line == 1:
+                error.column += self.column
+            
+            error.line += self.line
+            raise
+        
+        root = builder.close()
+        
+        if head:
+            self.attributes = root.body.attributes
+            self.start = root.start
+        
+        # A segment without tokens leaves the end where it was
+        if root.end > 0:
+            self.end = root.end + self.base
+        
+        for node in root.body.children:
+            syntax.shift(node, self.base)
+        
+        # Track the line and column where the next segment starts
+        last = None
+        
+        for last in newline.finditer(input):
+            self.line += 1
+        
+        if last is None:
+            self.column += len(input)
+        else:
+            self.column = len(input) - last.end()
+        
+        self.base += len(input)
+        
+        return root.body.children
+    
+    
+    def scan(self, chunk):
+        """Updates the scanning state with a new chunk, and returns the offset
+        in the chunk just after the last "}" which closes a top-level element,
+        or -1 if there is none."""
+    
+        boundary = -1
+        pos = 0
+        length = len(chunk)
+        
+        while pos < length:
+        
+            mode = self.mode
+            
+            if mode == FeedParser.NORMAL:
+            
+                match = feed_chars.search(chunk, pos)
+                
+                if match is None:
+                    break
+                
+                pos = match.end()
+                c = match.group()
+                
+                if c == "{":
+                    self.depth += 1
+                
+                elif c == "}":
+                
+                    if self.depth > 0:
+                        self.depth -= 1
+                    
+                    # An unmatched "}" ends a segment so that the parser reports it
+                    if self.depth == 0:
+                        boundary = pos
+                
+                else:
+                    self.mode = FeedParser.OPENING
+                    self.run = 1
+            
+            elif mode == FeedParser.OPENING:
+            
+                end = backticks.match(chunk, pos).end()
+                self.run += end - pos
+                pos = end
+                
+                if pos < length:
+                
+                    if self.run == 1:
+                        self.mode = FeedParser.INLINE
+                    elif self.run == 2:
+                        self.mode = FeedParser.NORMAL
+                    else:
+                        self.mode = FeedParser.BLOCK
+                        self.fence = self.run
+                    
+                    self.run = 0
+            
+            elif mode == FeedParser.INLINE:
+            
+                if self.run:
+                
+                    # The previous chunk ended with a backtick, which is either
+                    # half of a literal backtick or the end of the raw string
+                    self.run = 0
+                    
+                    if chunk[pos] == "`":
+                        pos += 1
+                    else:
+                        self.mode = FeedParser.NORMAL
+                    
+                    continue
+                
+                index = chunk.find("`", pos)
+                
+                if index < 0:
+                    break
+                
+                pos = index + 1
+                
+                if pos == length:
+                    self.run = 1
+                elif chunk[pos] == "`":
+                    pos += 1
+                else:
+                    self.mode = FeedParser.NORMAL
+            
+            else:
+            
+                if self.run:
+                    index = pos
+                else:
+                    index = chunk.find("`", pos)
+                
+                if index < 0:
+                    break
+                
+                end = backticks.match(chunk, index).end()
+                run = self.run + end - index
+                
+                if run >= self.fence:
+                    pos = end - (run - self.fence)
+                    self.mode = FeedParser.NORMAL
+                    self.run = 0
+                else:
+                    pos = end
+                    self.run = run if end == length else 0
+        
+        return boundary
+
+
+def finish(steps):
+    """Runs a generator to the end and returns its return value."""
+
+    try:
+        while True:
+            next(steps)
+    except StopIteration as stop:
+        return stop.value
+
 
+feed_chars = re.compile(r"[{}`]")
+backticks = re.compile(r"`*")
\ No newline at end of file
@@ -0,0 +1,266 @@
+import io
+from document import Text
+
+# Elements which never have content in HTML
+VOID_ELEMENTS = frozenset((
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+))
+
+# The most words of text which are joined and escaped at once
+RUN_LENGTH = 4096
+
+def escape_text(value):
+
+    if "&" in value or "<" in value or ">" in value:
+        return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+    return value
+
+
+def escape_attribute(value):
+
+    if "&" in value or "<" in value or ">" in value or '"' in value:
+        return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+    return value
+
+
+def start_tag(element, xml, default_name):
+    """Returns the tag name and start tag markup for an element."""
+
+    name = element.name or default_name
+
+    if element.namespace:
+        name = element.namespace + ":" + name
+
+    if not (element.id or element.has_classes() or element.has_attributes()):
+        return name, "<" + name
+
+    # The values are written as they are, and only escaped if the tag has
+    # a special character other than its "<" and the quotes around them
+    parts = ["<", name]
+    quoted = 0
+
+    if element.id:
+        parts += (' id="', element.id, '"')
+        quoted += 1
+
+    if element.has_classes():
+        parts += (' class="', " ".join(sorted(element.iter_classes())), '"')
+        quoted += 1
+
+    for key, value in element.iter_attributes():
+
+        if value is not None:
+            parts += (" ", key, '="', value, '"')
+            quoted += 1
+        elif xml:
+            parts += (" ", key, '="', key, '"')
+            quoted += 1
+        else:
+            parts += (" ", key)
+
+    tag = "".join(parts)
+
+    if "&" in tag or ">" in tag or tag.count("<") != 1 or tag.count('"') != 2 * quoted:
+        return name, escaped_start_tag(element, xml, name)
+
+    return name, tag
+
+
+def escaped_start_tag(element, xml, name):
+
+    parts = ["<", name]
+
+    if element.id:
+        parts.append(' id="%s"' % escape_attribute(element.id))
+
+    if element.has_classes():
+        parts.append(' class="%s"' % escape_attribute(" ".join(sorted(element.iter_classes()))))
+
+    for key, value in element.iter_attributes():
+
+        if value is None:
+            parts.append(' %s="%s"' % (key, key) if xml else " " + key)
+        else:
+            parts.append(' %s="%s"' % (key, escape_attribute(value)))
+
+    return "".join(parts)
+
+
+def render(root, file, xml = False, default_name = "div", buffer_size = 1 << 16):
+    """Writes a document as HTML, or XML if xml is True, to a file-like object.
+
+    The children of the root are written as the document.  Element names
+    are written as namespace:name, ids and classes as id and class
+    attributes, and attributes without a value as boolean attributes (or
+    key="key" in XML).  Elements without a name are given default_name.
+    Adjacent siblings are separated by a space, since the parser splits text
+    into words, unless the later one is joined to the earlier; see
+    document.Element.
+
+    The tree is walked without recursion, runs of text are escaped
+    together, and output is collected into chunks of about buffer_size
+    characters before it is written, so memory use does not depend on the
+    size of the output."""
+
+    parts = []
+    append = parts.append
+    size = 0
+
+    # The start and end tags of elements without an id, classes or
+    # attributes, by name and namespace
+    tags = {}
+
+    # The words of text since the last tag, which are joined by spaces and
+    # escaped together.  After a tag the run starts with an empty word, so
+    # that the next node is separated from the tag.
+    run = []
+    add_text = run.append
+
+    # The iterator over the children being written, the joined set and end
+    # tag of their parent, and the same for each enclosing element
+    children = root.iter_children()
+    joined = root.joined
+    end = ""
+    stack = []
+
+    while True:
+
+        for node in children:
+
+            if node.__class__ is Text:
+
+                if joined and node in joined and run:
+                    run[-1] += node.value
+                else:
+                    add_text(node.value)
+
+                if len(run) < RUN_LENGTH:
+                    continue
+
+                text = escape_text(" ".join(run))
+                append(text)
+                size += len(text)
+                run.clear()
+                add_text("")
+
+                if size >= buffer_size:
+                    file.write("".join(parts))
+                    parts.clear()
+                    size = 0
+
+                continue
+
+            if node.id or node.has_classes() or node.has_attributes():
+                name, tag = start_tag(node, xml, default_name)
+                close = "</" + name + ">"
+            else:
+
+                key = (node.name, node.namespace)
+
+                try:
+                    tag, close = tags[key]
+                except KeyError:
+                    name, tag = start_tag(node, xml, default_name)
+                    tag, close = tags[key] = (tag, "</" + name + ">")
+
+            if run:
+
+                text = escape_text(" ".join(run))
+
+                if not (joined and node in joined):
+                    text += " "
+
+                tag = text + tag
+                run.clear()
+
+            if node.has_children():
+
+                tag += ">"
+
+                # An element which only has a few words of text, the most
+                # common kind, is written whole
+                if not node.joined:
+
+                    words = []
+
+                    for child in node.iter_children():
+
+                        if child.__class__ is not Text or len(words) == RUN_LENGTH:
+                            break
+
+                        words.append(child.value)
+
+                    else:
+
+                        tag += escape_text(" ".join(words)) + close
+                        append(tag)
+                        size += len(tag)
+                        add_text("")
+
+                        if size >= buffer_size:
+                            file.write("".join(parts))
+                            parts.clear()
+                            size = 0
+
+                        continue
+
+                append(tag)
+                size += len(tag)
+                stack.append((children, joined, end))
+                children = node.iter_children()
+                joined = node.joined
+                end = close
+                break
+
+            # The name is in the end tag, "</name>"
+            if xml:
+                tag += "/>"
+            elif close[2:-1] in VOID_ELEMENTS:
+                tag += ">"
+            else:
+                tag += ">" + close
+
+            append(tag)
+            size += len(tag)
+            add_text("")
+
+            if size >= buffer_size:
+                file.write("".join(parts))
+                parts.clear()
+                size = 0
+
+        else:
+
+            if run:
+                end = escape_text(" ".join(run)) + end
+                run.clear()
+
+            append(end)
+
+            if not stack:
+                break
+
+            size += len(end)
+            children, joined, end = stack.pop()
+            add_text("")
+
+            if size >= buffer_size:
+                file.write("".join(parts))
+                parts.clear()
+                size = 0
+
+    if parts:
+        file.write("".join(parts))
+
+
+def render_string(root, xml = False, default_name = "div"):
+    """Returns a document rendered as HTML, or XML if xml is True."""
+
+    out = io.StringIO()
+    render(root, out, xml, default_name)
+
+    return out.getvalue()
+
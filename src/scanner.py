@@ -1,36 +1,200 @@
 import re
+from lines import LineIndex
 
-ws_chars = re.compile(r"[\x09\x0B-\x0C\x20\xA0\u1680\u180E\u2000-\u200A\u202F\u205F\u3000\uFEFF]")
-nl_chars = re.compile(r"[\r\n\u2028\u2029]")
+WS = r"\x09\x0B-\x0C\x20\xA0\u1680\u180E\u2000-\u200A\u202F\u205F\u3000\uFEFF"
+NL = r"\r\n\u2028\u2029"
+
+ws_chars = re.compile("[" + WS + "]")
+nl_chars = re.compile("[" + NL + "]")
 backtick3 = re.compile(r"```")
+inline_raw = re.compile(r"(?:[^`]+|``)*")
+
+# Fragments of the token patterns for str input.  Identifier characters
+# are written as negated classes so that non-ASCII, non-whitespace
+# characters are included without a separate test.
+text_fragments = {
+
+    "space": "[" + WS + "]",
+    "newline": "\\r\\n?|[\\n\\u2028\\u2029]",
+    "text_char": "[^\\x00`{}" + WS + NL + "]",
+    "ident_start": "[^\\x00-\\x40\\x5B-\\x5E\\x60\\x7B-\\x7F" + WS + NL + "]",
+    "ident_char": "[^\\x00-\\x2C\\x2E\\x2F\\x3A-\\x40\\x5B-\\x5E\\x60\\x7B-\\x7F" + WS + NL + "]",
+}
+
+# The same fragments for UTF-8 encoded input.  Non-ASCII whitespace and
+# newline characters are matched as byte sequences, and any other byte at
+# or above 0x80 belongs to a text or identifier character.  Only the lead
+# bytes of those sequences need the lookahead, so runs of other non-ASCII
+# bytes, such as most accented Latin and CJK text, are matched by a class.
+MB_SPACE = "\\xC2\\xA0|\\xE1\\x9A\\x80|\\xE1\\xA0\\x8E|\\xE2\\x80[\\x80-\\x8A\\xA8\\xA9\\xAF]|\\xE2\\x81\\x9F|\\xE3\\x80\\x80|\\xEF\\xBB\\xBF"
+MB_CHAR = "[\\x80-\\xC1\\xC3-\\xE0\\xE4-\\xEE\\xF0-\\xFF]+|(?!" + MB_SPACE + ")[\\xC2\\xE1-\\xE3\\xEF]"
+
+byte_fragments = {
+
+    "space": "[\\x09\\x0B\\x0C\\x20]|\\xC2\\xA0|\\xE1\\x9A\\x80|\\xE1\\xA0\\x8E|\\xE2\\x80[\\x80-\\x8A\\xAF]|\\xE2\\x81\\x9F|\\xE3\\x80\\x80|\\xEF\\xBB\\xBF",
+    "newline": "\\r\\n?|\\n|\\xE2\\x80[\\xA8\\xA9]",
+    "text_char": "[^\\x00\\x09-\\x0D\\x20`{}\\x80-\\xFF]+|(?:" + MB_CHAR + ")+",
+    "ident_start": "[A-Za-z_]|" + MB_CHAR,
+    "ident_char": "[A-Za-z0-9_\\-]+|(?:" + MB_CHAR + ")+",
+}
+
+def compile_patterns(fragments, encode = None):
+    """Compiles the master pattern for each scanning context.
+    
+    Each pattern skips leading whitespace and matches exactly one newline or
+    token.  The name of the matching group identifies what was found.  If
+    encode is given, it converts the pattern source for bytes input."""
+    
+    f = fragments
+    text = "(?P<text>.(?:" + f["text_char"] + ")*)"
+    identifier = "(?:" + f["ident_start"] + ")(?:" + f["ident_char"] + ")*"
+
+    def token_pattern(punctuators, tokens):
+    
+        source = (
+            "(?:" + f["space"] + ")*(?:" +
+            "(?P<newline>" + f["newline"] + ")|" +
+            "(?P<raw>`+)|" +
+            "(?P<punctuator>[" + punctuators + "])|" +
+            tokens + "|" +
+            "(?P<eof>\\Z))")
+        
+        return re.compile(encode(source) if encode else source, re.DOTALL)
+    
+    return {
+    
+        None: token_pattern("{}", text),
+        
+        "head": token_pattern("{}\\[", text),
+        
+        "selector": token_pattern(
+            "{}\\[\\]=.:#", 
+            "(?P<identifier>-(?:" + identifier + ")?|" + identifier + ")|" +
+            "(?P<error>.)"),
+    }
+
+patterns = compile_patterns(text_fragments)
+byte_patterns = compile_patterns(byte_fragments, lambda source: source.encode("latin-1"))
+
+punctuator_names = { p: p for p in "{}[]=.:#" }
+punctuator_names.update({ p.encode(): p for p in "{}[]=.:#" })
+
+byte_backtick3 = re.compile(b"```")
+byte_inline_raw = re.compile(b"(?:[^`]+|``)*")
+backticks = re.compile("`*")
+byte_backticks = re.compile(b"`*")
+escaped_backtick = re.compile("``")
+byte_escaped_backtick = re.compile(b"``")
+
+def span_value(source, spans):
+    """Returns the string covered by a flat tuple of (start, end) offset pairs
+    into the source.  A source which is not a str is decoded as UTF-8."""
+
+    if len(spans) == 2:
+        value = source[spans[0]:spans[1]]
+    elif isinstance(source, str):
+        return "".join([source[spans[i]:spans[i + 1]] for i in range(0, len(spans), 2)])
+    else:
+        value = b"".join([source[spans[i]:spans[i + 1]] for i in range(0, len(spans), 2)])
+    
+    return value if isinstance(value, str) else str(value, "utf-8")
 
-def binary_search(list, value):
-    """Returns the index of a value within a sorted list.
+
+def raw_spans(source, start, end):
+    """Returns the value spans of an inline raw string body, where each pair
+    of backticks stands for a single literal backtick."""
+
+    pattern = escaped_backtick if isinstance(source, str) else byte_escaped_backtick
+    spans = []
+    
+    for match in pattern.finditer(source, start, end):
+    
+        # Keep the first backtick of the pair and skip the second
+        index = match.start()
+        spans.append(start)
+        spans.append(index + 1)
+        start = index + 2
     
-    If the value is not found within the list, then the appropriate
-    insertion position is returned."""
+    spans.append(start)
+    spans.append(end)
+    
+    return tuple(spans)
+
+
+# Character class flags for the reference scanner
+SPACE = 1
+NEWLINE = 2
+TEXT = 4
+IDENT = 8
+IDENT_START = 16
 
-    right = len(list) - 1
-    left = 0
+# Every character outside of ASCII which is not whitespace or a newline is
+# a text and identifier character, and there is no whitespace outside of
+# the BMP, so characters in the astral planes all share a single class.
+ASTRAL_CLASS = TEXT | IDENT | IDENT_START
+
+
+def build_char_classes():
+    """Returns a table of the class flags of each character in the BMP,
+    indexed by character code."""
+
+    classes = bytearray([ASTRAL_CLASS]) * 0x10000
+    
+    for c in range(128):
     
-    while left <= right:
+        flags = 0
         
-        mid = (left + right) >> 1
-        test = list[mid]
+        if c == 9 or c == 11 or c == 12 or c == 32:
+            flags = SPACE
+        elif c == 10 or c == 13:
+            flags = NEWLINE
+        elif not (c == 0 or c == 96 or c == 123 or c == 125):
+            flags = TEXT
         
-        if value == test: 
-            return mid
+        if c >= 65 and c <= 90 or c >= 97 and c <= 122 or c == 95:
+            flags |= IDENT | IDENT_START
+        elif c > 47 and c < 58 or c == 45:
+            flags |= IDENT
         
-        if value < test: right = mid - 1
-        else: left = mid + 1
+        classes[c] = flags
+    
+    # Find the non-ASCII whitespace and newlines with one pass of each
+    # pattern over a string of the whole plane.  The string is decoded from
+    # UTF-16, which is much faster than joining each character, with the
+    # surrogates replaced by null characters.
+    units = bytearray(0x20000)
+    units[0::2] = b"".join(bytes([high]) * 256 for high in range(256))
+    units[1::2] = bytes(range(256)) * 256
+    units[0xD800 * 2:0xE000 * 2] = bytes(0x1000)
+    plane = units.decode("utf-16-be")
+    
+    for pattern, flags in ((ws_chars, SPACE), (nl_chars, NEWLINE)):
+        for match in pattern.finditer(plane, 128):
+            classes[match.start()] = flags
+    
+    return classes
+
+char_classes = build_char_classes()
+
+
+def char_class(chr):
+    """Returns the class flags of a character, or 0 for the empty string."""
+
+    if chr == "":
+        return 0
     
-    return left
+    c = ord(chr)
+    
+    return char_classes[c] if c < 0x10000 else ASTRAL_CLASS
 
 
 def is_ascii_whitespace(chr):
     """Returns True if the specified character is ASCII whitespace, but
     not a newline character."""
 
+    if chr == "":
+        return False
+    
     c = ord(chr)
     return c == 9 or c == 11 or c == 12 or c == 32
     
@@ -38,63 +202,141 @@ def is_ascii_whitespace(chr):
 def is_identifier_char(chr, first = False):
     """Returns True if the specified character is an identifier character."""
 
-    c = ord(chr)
-    
-    if c >= 128:
-        return not (ws_chars.match(chr) or nl_chars.match(chr))
-    
-    return (
-        c >= 65 and c <= 90 or              # A-Z
-        c >= 97 and c <= 122 or             # a-z
-        c > 47 and c < 58 and not first or  # 0-9
-        c == 45 and not first or            # -
-        c == 95                             # _
-    )
+    return char_class(chr) & (IDENT_START if first else IDENT) != 0
 
 
 def is_text_char(chr):
     """Returns True if the specified character is a text character."""
 
-    c = ord(chr)
-    
-    if c >= 127:
-        return not (ws_chars.match(chr) or nl_chars.match(chr))
-    
-    return not (
-        c == 0 or
-        c == 32 or   # " "
-        c == 9 or    # "\t"
-        c == 11 or   # "\v"
-        c == 12 or   # "\f"
-        c == 13 or   # "\r"
-        c == 10 or   # "\n"
-        c == 96 or   # "`"
-        c == 123 or  # "{"
-        c == 124     # "}"
-    )
+    return char_class(chr) & TEXT != 0
+
+
+# The fields of a token record.  Token records are plain tuples of
+# (type, start, end, spans, newlines, error, origin, context), which are
+# immutable and much cheaper to create than instances of a class.  The
+# origin is the offset which the token was scanned from, before any
+# whitespace, and the context is the one it was scanned in.
+TYPE, START, END, SPANS, NEWLINES, ERROR, ORIGIN, CONTEXT = range(8)
 
 
 class Scanner:
+    """Splits DML input into tokens.
+    
+    The input may be a str, or a bytes-like object such as bytes, a
+    memoryview or an mmap holding UTF-8 text.  Bytes input is scanned
+    without decoding it; offsets are byte offsets, and token values are
+    decoded when they are read.  The reference scanner requires a str."""
 
-    def __init__(self, input = ""):
+    # The longest raw block, including its fences, whose end the pattern
+    # engine searches for; None means no limit
+    max_raw_block = None
+
+    def __init__(self, input = "", reference = False):
     
         self.input = input
+        self.reference = reference
+        self.binary = not isinstance(input, str)
+        self.patterns = byte_patterns if self.binary else patterns
         self.offset = 0
-        self.lines = [-1]
-        self.last_line_break = -1
+        self.line_index = None
         
         self.type = ""
         self.start = 0
         self.end = 0
-        self.value = ""
+        self.spans = ()
         self.error = ""
         self.newlines = 0
     
     
+    @property
+    def value(self):
+        """The value of the current token, built from its source spans."""
+    
+        return span_value(self.input, self.spans) if self.spans else ""
+    
+    
+    def token(self, origin = 0, context = None):
+        """Returns a token record of the current token."""
+    
+        return (self.type, self.start, self.end, self.spans, self.newlines, self.error, origin, context)
+    
+    
     def next(self, context):
-        """Reads the next token from the input stream and returns the token type."""
+        """Reads the next token from the input stream and returns the token
+        type.  The scanner's token fields are set from the record returned
+        by scan."""
+    
+        self.type, self.start, self.end, self.spans, self.newlines, self.error = self.scan(context)[:6]
+        
+        return self.type
+    
+    
+    def scan(self, context):
+        """Reads the next token and returns it as a token record.
+        
+        Records of the common token types are made directly, without
+        updating the scanner's token fields, which next then sets from the
+        record."""
     
+        origin = offset = self.offset
+        
+        if self.reference:
+            self.next_char(context)
+            return self.token(origin, context)
+        
+        input = self.input
+        pattern = self.patterns.get(context) or self.patterns[None]
+        newlines = 0
+        
+        while True:
+        
+            match = pattern.match(input, offset)
+            kind = match.lastgroup
+            offset = match.end()
+            
+            if kind != "newline":
+                break
+            
+            newlines += 1
+        
+        start = match.start(kind)
+        self.offset = offset
+        
+        if kind == "text" or kind == "identifier":
+            return (kind, start, offset, (start, offset), newlines, "", origin, context)
+        
+        if kind == "punctuator":
+            return (punctuator_names[match.group(kind)], start, offset, (start, offset), newlines, "", origin, context)
+        
         self.error = ""
+        self.spans = ()
+        self.newlines = newlines
+        
+        if kind == "raw":
+            type = self.RawToken(offset - start)
+        
+        elif kind == "error":
+            self.error = "Unrecognized token"
+            type = "illegal"
+        
+        else:
+            type = "eof"
+        
+        self.type = type
+        self.start = start
+        self.end = self.offset
+        
+        return self.token(origin, context)
+    
+    
+    def next_char(self, context):
+        """Reads the next token one character at a time.
+        
+        This is the reference implementation of the token patterns used by
+        next, and is selected by creating the scanner with reference=True."""
+    
+        self.error = ""
+        self.spans = ()
         self.newlines = 0
         
         type = None 
@@ -112,35 +354,34 @@ class Scanner:
         return type
     
     
+    def lines(self):
+        """Returns the line index for the input, creating it on first use."""
+    
+        if self.line_index is None:
+            self.line_index = LineIndex(self.input)
+        
+        return self.line_index
+    
+    
     def line_number(self, offset):
         """Returns the line number of the specified input offset."""
     
-        return binary_search(self.lines, offset)
+        return self.lines().line_number(offset)
     
     
     def position(self, offset):
         """Returns line and column data for the specifed input offset."""
     
-        line = self.line_number(offset)
-        pos = self.lines[line - 1]
-        column = offset - pos
+        line, column = self.lines().position(offset)
         
         return { 
         
             "line": line, 
             "column": column,
-            "line_offset": pos + 1
+            "line_offset": offset - column + 1
         }
     
     
-    def add_line_break(self, offset):
-        """Adds a line break at the specified offset."""
-    
-        if offset > self.last_line_break:
-            self.last_line_break = offset
-            self.lines.append(offset)
-    
-    
     def peek(self):
         """Returns the next unread character from the input string."""
     
@@ -180,58 +421,45 @@ class Scanner:
     def Start(self, context):
     
         c = self.peek()
+        flags = char_class(c)
         
-        if ord(c) < 128:
+        if flags & SPACE:
+            return self.Whitespace()
         
-            # ASCII Characters (fast path)
-            
-            if is_ascii_whitespace(c): 
-                return self.Whitespace()
-            
-            if c == "\n" or c == "\r":
-                return self.Newline(c)
-            
-            if c == "`":
-                return self.RawString()
-            
-            if c == "{" or c == "}":
+        if flags & NEWLINE:
+            return self.Newline(c)
+        
+        if c == "`":
+            return self.RawString()
+        
+        if c == "{" or c == "}":
+            return self.PunctuatorChar()
+        
+        if c == "[":
+        
+            if context == "head" or context == "selector":
                 return self.PunctuatorChar()
             
-            if c == "[":
-            
-                if context == "head" or context == "selector":
-                    return self.PunctuatorChar()
-                
-                return self.Text()
-            
-            if c == "]" or c == "=" or c == "." or c == ":" or c == "#":
-            
-                if context == "selector":
-                    return self.PunctuatorChar()
-                
-                return self.Text()
+            return self.Text()
+        
+        if c == "]" or c == "=" or c == "." or c == ":" or c == "#":
+        
+            if context == "selector":
+                return self.PunctuatorChar()
             
-            if c == "-":
-                
-                if context == "selector":
-                    return self.Identifier(True)
-                
-                return self.Text()
-                    
-        else:
+            return self.Text()
         
-            # Non-ASCII Characters (slow path)
+        if c == "-":
             
-            if nl_chars.match(c):
-                return self.Newline()
+            if context == "selector":
+                return self.Identifier(True)
             
-            if ws_chars.match(c):
-                return self.UnicodeWhitespace()
+            return self.Text()
         
         if context != "selector":
             return self.Text()
         
-        if is_identifier_char(c, True):
+        if flags & IDENT_START:
             return self.Identifier()
             
         return self.Error("Unrecognized token")
@@ -239,7 +467,7 @@ class Scanner:
     
     def Newline(self, chr):
         
-        self.add_line_break(self.advance())
+        self.advance()
         
         # Treat /r/n as a single newline
         if chr == "\r" and self.peek() == "\n":
@@ -252,35 +480,22 @@ class Scanner:
     
     def Whitespace(self):
     
-        self.advance()
-        
-        while is_ascii_whitespace(self.peek()):
-            self.advance()
-        
-        return None
-    
-    
-    def UnicodeWhitespace(self):
-    
-        self.advance()
-        
-        while ws_chars.match(self.peek()):
-            self.advance()
+        self.skip(self.offset + 1, SPACE)
         
         return None
     
     
     def PunctuatorChar(self):
     
-        self.value = self.peek()
-        self.advance()
+        start = self.advance()
+        self.spans = (start, self.offset)
         
-        return self.value
+        return self.input[start]
 
     def RawString(self):
     
         type = "raw-string"
-        val = ""
+        spans = ()
         count = 1
         
         self.advance()
@@ -294,6 +509,8 @@ class Scanner:
         
             # Inline raw string
             
+            start = self.offset
+            
             while (True):
             
                 chr = self.peek()
@@ -306,16 +523,19 @@ class Scanner:
                     if self.peek_at(1) == "`":
                     
                         # Two consecutive backticks are a literal backtick
+                        spans += (start, self.offset + 1)
                         self.advance()
+                        start = self.offset + 1
                         
                     else:
                     
                         # End of raw string
                         break
                 
-                val += chr
                 self.advance()
             
+            spans += (start, self.offset)
+            
             if chr == "":
                 return self.Error("Unterminated raw string")
             
@@ -325,7 +545,7 @@ class Scanner:
         
             # Literal backtick
             
-            val = "`"
+            spans = (self.offset - 1, self.offset)
             
         else:
         
@@ -341,7 +561,7 @@ class Scanner:
                 if not match:
                     return self.Error("Unterminated raw block")
             
-                self.offset = match.start()
+                self.offset = match.end()
                 len = 3
                 
                 while len < count and self.peek() == "`":
@@ -352,9 +572,9 @@ class Scanner:
                 if len == count:
                     break
             
-            val = self.input[start:self.offset - count]
+            spans = (start, self.offset - count)
         
-        self.value = val
+        self.spans = spans
         
         return type
         
@@ -362,16 +582,14 @@ class Scanner:
     def Identifier(self, dash = False):
     
         start = self.offset
-        first = dash
         
         self.advance()
         
-        while is_identifier_char(self.peek(), first):
-        
-            self.advance()
-            first = False
+        # A leading dash must be followed by an identifier start character
+        if not dash or char_class(self.peek()) & IDENT_START:
+            self.skip(self.offset, IDENT)
         
-        self.value = self.input[start:self.offset]
+        self.spans = (start, self.offset)
         
         return "identifier"
 
@@ -380,20 +598,230 @@ class Scanner:
     
         start = self.offset
         
-        self.advance()
+        self.skip(start + 1, TEXT)
+        self.spans = (start, self.offset)
         
-        while is_text_char(self.peek()):
-            self.advance()
+        return "text"
+
+    
+    def skip(self, offset, flags):
+        """Advances from offset past each character whose class has any of
+        the specified flags."""
+    
+        input = self.input
+        length = len(input)
+        classes = char_classes
         
-        self.value = self.input[start:self.offset]
+        while offset < length:
         
-        return "text"
+            c = ord(input[offset])
+            
+            if not (classes[c] if c < 0x10000 else ASTRAL_CLASS) & flags:
+                break
+            
+            offset += 1
+        
+        self.offset = offset
 
     
+    def RawToken(self, count):
+        """Reads the remainder of a raw string or raw block whose opening
+        run of backticks has already been consumed."""
+    
+        if count == 1:
+        
+            # Inline raw string; two consecutive backticks are a literal backtick
+            
+            start = self.offset
+            end = (byte_inline_raw if self.binary else inline_raw).match(self.input, start).end()
+            
+            if end >= len(self.input):
+                self.offset = end
+                return self.Error("Unterminated raw string")
+            
+            self.spans = raw_spans(self.input, start, end)
+            self.offset = end + 1
+            
+            return "raw-string"
+        
+        if count == 2:
+        
+            # Literal backtick
+            
+            self.spans = (self.offset - 1, self.offset)
+            return "raw-string"
+        
+        # Raw block
+        
+        start = self.offset
+        fence = byte_backtick3 if self.binary else backtick3
+        run = byte_backticks if self.binary else backticks
+        end = len(self.input)
+        
+        # The closing fence is only searched for within max_raw_block
+        if self.max_raw_block is not None:
+            end = min(end, start - count + self.max_raw_block)
+        
+        while True:
+        
+            match = fence.search(self.input, self.offset, end)
+            
+            if not match:
+            
+                if end < len(self.input):
+                    return self.raw_block_too_long(start - count)
+                
+                return self.Error("Unterminated raw block")
+            
+            # The block ends at the first run of at least count backticks
+            length = min(count, run.match(self.input, match.start(), end).end() - match.start())
+            self.offset = match.start() + length
+            
+            if length == count:
+                break
+        
+        self.spans = (start, self.offset - count)
+        
+        return "raw-block"
+    
+    
+    def raw_block_too_long(self, start):
+        """Called when the raw block at the start offset is longer than
+        max_raw_block.  Returns the token type."""
+        
+        self.offset = start + self.max_raw_block
+        return self.Error("Raw block is longer than %d" % self.max_raw_block)
+    
+    
     def Error(self, msg):
 
         self.error = msg
-        self.advance()
+        
+        if self.offset < len(self.input):
+            self.advance()
+        
+        if self.binary:
+        
+            # Skip the continuation bytes of a UTF-8 sequence
+            while self.offset < len(self.input) and self.input[self.offset] & 0xC0 == 0x80:
+                self.advance()
         
         return "illegal"
 
+
+# The contexts in which a token of each type, scanned in any context, is
+# scanned the same way.  Other tokens are only reused in their own context.
+SHARED_TOKENS = {
+
+    "{": (None, "head", "selector"),
+    "}": (None, "head", "selector"),
+    "[": ("head", "selector"),
+    "raw-string": (None, "head", "selector"),
+    "raw-block": (None, "head", "selector"),
+    "eof": (None, "head", "selector"),
+}
+
+
+class TokenBuffer:
+    """Reads token records from a scanner, with lookahead and mark/reset.
+    
+    Tokens which have been scanned but not read are kept in input order,
+    and are replayed when the scan reaches the offset they were scanned
+    from, if they were scanned in the requested context or their type is
+    scanned the same way in both.  Otherwise the input is scanned again from
+    that point, and tokens further on are kept for when the scan reaches
+    them.  Moving back to a mark with reset keeps the tokens which had been
+    looked at beyond the current one, so that only the input between the
+    mark and the first of them is scanned again.
+    
+    As with a plain scanner, a token which has been peeked is returned by
+    the next peek or read whatever the context."""
+    
+    def __init__(self, scanner, offset = 0):
+    
+        self.scanner = scanner
+        self.offset = offset
+        self.peeked = None
+        
+        # Tokens scanned beyond the peeked one
+        self.ahead = []
+    
+    
+    def peek(self, context = None, ahead = 0):
+        """Returns the token ahead tokens after the next one, without reading
+        any of them."""
+    
+        tok = self.peeked
+        
+        if tok is None:
+        
+            if self.ahead:
+                tok = self.replay(0, self.offset, context)
+            
+            else:
+                scanner = self.scanner
+                scanner.offset = self.offset
+                tok = scanner.scan(context)
+            
+            self.peeked = tok
+        
+        if ahead:
+        
+            for i in range(ahead):
+                tok = self.replay(i, tok[END], context)
+                self.ahead.insert(i, tok)
+        
+        return tok
+    
+    
+    def replay(self, i, offset, context):
+        """Removes and returns the token at position i of the tokens ahead if
+        it can be used at the offset in the context, and scans a new one if
+        not."""
+    
+        ahead = self.ahead
+        
+        # Drop tokens which the scan has passed
+        while i < len(ahead) and ahead[i][ORIGIN] < offset:
+            del ahead[i]
+        
+        if i < len(ahead) and ahead[i][ORIGIN] == offset:
+        
+            tok = ahead.pop(i)
+            
+            if tok[CONTEXT] == context or context in SHARED_TOKENS.get(tok[TYPE], ()):
+                return tok
+        
+        scanner = self.scanner
+        scanner.offset = offset
+        
+        return scanner.scan(context)
+    
+    
+    def next(self, context = None):
+        """Reads the next token."""
+    
+        tok = self.peeked or self.peek(context)
+        
+        self.peeked = None
+        self.offset = tok[END]
+        
+        return tok
+    
+    
+    def mark(self):
+        """Returns a mark for the current position, for use with reset.  A
+        mark is the input offset which the next token is scanned from."""
+    
+        return self.offset
+    
+    
+    def reset(self, mark):
+        """Moves back to a mark, or to any other offset between tokens, so
+        that the input from there is read again."""
+    
+        if self.peeked is not None:
+            self.ahead.insert(0, self.peeked)
+            self.peeked = None
+        
+        self.offset = mark
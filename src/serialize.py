@@ -0,0 +1,791 @@
+import mmap
+import re
+import struct
+import sys
+from array import array
+from sys import intern
+import document
+import syntax
+
+VERSION = 4
+
+MAGIC = b"DMLB"
+
+# Kinds of tree
+DOCUMENT = 0
+AST = 1
+
+# Node codes of document trees.  AST nodes are coded by their index in
+# syntax.KINDS.
+ELEMENT = 0
+TEXT = 1
+
+# Set in the code of a document node which is joined to its previous
+# sibling; see document.Element
+JOINED = 2
+
+# Magic, version, tree kind, width of the offsets in the indexes, string
+# count, node count, and the offsets of the string index and node index
+HEADER = struct.Struct("<4sBBBxQQQQ")
+
+# A varint of more than one byte, split out by read_varints
+MULTI_BYTE = re.compile(b"([\x80-\xFF]+[\x00-\x7F])")
+
+# Offsets in the indexes are stored as little-endian 32-bit integers, or
+# 64-bit ones if the tree is too large for those, by width in bytes
+OFFSET_TYPES = {4: "I" if array("I").itemsize == 4 else "L", 8: "Q"}
+
+# The size from which a tree uses 64-bit offsets
+LARGE = 1 << 32
+
+# The binary format.
+#
+# A serialized tree is the header, the UTF-8 data of the strings, the node
+# records, the string index and the node index.  The string index holds the
+# offset of each string and one more for the end of the last, so that any
+# string can be decoded alone.  The node records are a sequence of unsigned
+# varints, in document order, and the node index holds the offset of the
+# record of each node.
+#
+# Each record starts with the node's code and, for every node but a
+# document text node, its size: the number of nodes in its subtree,
+# including itself.  The subtree of a node is then the records of the nodes
+# from its own up to its index plus its size, so it can be read without
+# reading any other part of the tree.
+#
+# A document element's record continues with the string indexes of its
+# namespace, name and id, the class count and classes, and the attribute
+# count and key/value pairs, where a value is its string index plus one, or
+# 0 for no value.  A document text node's record is TEXT and its value.
+# The code of a document node has the JOINED bit set if the node is in its
+# parent's joined set.
+#
+# An AST node's record continues with its start offset, relative to the
+# start of its previous sibling, or of its parent if it is the first child,
+# and its length.  Both are zigzag encoded, since the root element of an
+# empty input ends before it starts.  Raw strings, raw blocks and text add
+# their newline count and value, identifiers their value and errors their
+# message.  Child fields are not stored: they are found from the children's
+# types, as by syntax.NodeView.
+
+
+def write_varint(out, value):
+    """Appends an unsigned varint to a bytearray."""
+
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+
+    out.append(value)
+
+
+def read_varint(buffer, offset):
+    """Reads an unsigned varint from a buffer, returning (value, offset of
+    the next byte)."""
+
+    value = 0
+    shift = 0
+
+    while True:
+
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+
+        if byte < 0x80:
+            return value, offset
+
+        shift += 7
+
+
+def zigzag(value):
+    """Maps a signed integer to an unsigned one, keeping small values small."""
+
+    return 2 * value if value >= 0 else -2 * value - 1
+
+
+def unzigzag(value):
+    """Reverses zigzag."""
+
+    return value >> 1 ^ -(value & 1)
+
+
+def read_varints(data):
+    """Reads all of the varints in a bytes object, returning a list.
+
+    Most values fit in one byte, so runs of those are converted at once,
+    and only the bytes of longer varints are looked at one by one."""
+
+    pieces = MULTI_BYTE.split(data)
+    out = list(pieces[0])
+    append = out.append
+    extend = out.extend
+
+    for i in range(1, len(pieces), 2):
+
+        run = pieces[i]
+
+        if len(run) == 2:
+
+            append(run[0] & 0x7F | run[1] << 7)
+
+        else:
+
+            value = 0
+            shift = 0
+
+            for byte in run:
+                value |= (byte & 0x7F) << shift
+                shift += 7
+
+            append(value)
+
+        extend(pieces[i + 1])
+
+    return out
+
+
+class Writer:
+    """Accumulates the strings and node records of a serialized tree."""
+
+    def __init__(self, kind):
+
+        self.kind = kind
+        self.strings = {}
+        self.string_data = bytearray()
+        self.string_offsets = array("q")
+        self.records = bytearray()
+        self.record_offsets = array("q")
+
+
+    def string(self, value):
+        """Returns the index of a string in the table, adding it if needed."""
+
+        index = self.strings.get(value)
+
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+            self.string_offsets.append(len(self.string_data))
+            self.string_data += value.encode("utf-8", "surrogatepass")
+
+        return index
+
+
+    def node(self):
+        """Starts the record of the next node, returning the buffer to write
+        its varints to."""
+
+        self.record_offsets.append(len(self.records))
+        return self.records
+
+
+    def getvalue(self):
+        """Returns the serialized tree as bytes."""
+
+        strings = HEADER.size
+        records = strings + len(self.string_data)
+        string_index = records + len(self.records)
+        width = 4 if string_index < LARGE else 8
+        node_index = string_index + width * (len(self.string_offsets) + 1)
+
+        offset_type = OFFSET_TYPES[width]
+        string_offsets = array(offset_type, (offset + strings for offset in self.string_offsets))
+        string_offsets.append(records)
+        record_offsets = array(offset_type, (offset + records for offset in self.record_offsets))
+
+        if sys.byteorder == "big":
+            string_offsets.byteswap()
+            record_offsets.byteswap()
+
+        return b"".join((
+            HEADER.pack(MAGIC, VERSION, self.kind, width, len(self.strings), len(self.record_offsets),
+                string_index, node_index),
+            self.string_data,
+            self.records,
+            string_offsets.tobytes(),
+            record_offsets.tobytes(),
+        ))
+
+
+def preorder(root, children):
+    """Returns the nodes of a tree in document order, the index of each
+    one's parent (-1 for the root) and the size of each one's subtree,
+    without recursion.  children returns a node's children."""
+
+    nodes = []
+    parents = []
+    stack = [(root, -1)]
+
+    while stack:
+
+        node, parent = stack.pop()
+        index = len(nodes)
+        nodes.append(node)
+        parents.append(parent)
+
+        for child in reversed(children(node)):
+            stack.append((child, index))
+
+    sizes = [1] * len(nodes)
+
+    for index in range(len(nodes) - 1, 0, -1):
+        sizes[parents[index]] += sizes[index]
+
+    return nodes, parents, sizes
+
+
+def document_children(node):
+
+    return list(node.iter_children())
+
+
+def dump_document(root):
+    """Serializes a document tree to bytes."""
+
+    Text = document.Text
+    writer = Writer(DOCUMENT)
+    string = writer.string
+    nodes, parents, sizes = preorder(root, document_children)
+
+    for node, parent, size in zip(nodes, parents, sizes):
+
+        out = writer.node()
+        joined = JOINED if parent >= 0 and node in nodes[parent].joined else 0
+
+        if isinstance(node, Text):
+            out.append(TEXT | joined)
+            write_varint(out, string(node.value))
+            continue
+
+        out.append(ELEMENT | joined)
+        write_varint(out, size)
+        write_varint(out, string(node.namespace))
+        write_varint(out, string(node.name))
+        write_varint(out, string(node.id))
+        classes = sorted(node.iter_classes())
+        write_varint(out, len(classes))
+
+        for name in classes:
+            write_varint(out, string(name))
+
+        attributes = list(node.iter_attributes())
+        write_varint(out, len(attributes))
+
+        for key, value in attributes:
+            write_varint(out, string(key))
+            write_varint(out, 0 if value is None else string(value) + 1)
+
+    return writer.getvalue()
+
+
+def dump_ast(root):
+    """Serializes an AST, including the source spans of its nodes, to bytes.
+    Nodes made from source spans are stored with their values, so the
+    source is not needed to load them."""
+
+    writer = Writer(AST)
+    string = writer.string
+    nodes, parents, sizes = preorder(root, syntax.children)
+
+    # The start of the last child written of each node, by node index
+    last_start = {}
+
+    for node, parent, size in zip(nodes, parents, sizes):
+
+        out = writer.node()
+
+        if parent < 0:
+            base = 0
+        else:
+            base = last_start.get(parent, nodes[parent].start)
+            last_start[parent] = node.start
+
+        write_varint(out, syntax.KIND_INDEX[node.__class__])
+        write_varint(out, size)
+        write_varint(out, zigzag(node.start - base))
+        write_varint(out, zigzag(node.end - node.start))
+
+        if isinstance(node, syntax.TextNode):
+            write_varint(out, node.newlines)
+            write_varint(out, string(node.value))
+        elif isinstance(node, syntax.Identifier):
+            write_varint(out, string(node.value))
+        elif isinstance(node, syntax.Error):
+            write_varint(out, string(node.message))
+
+    return writer.getvalue()
+
+
+def build_document(codes, strings):
+    """Builds a document tree from the varints of its node records."""
+
+    Element = document.Element
+    Text = document.Text
+    root = None
+
+    # The innermost open element, its child list, the index of the end of
+    # its subtree, and the same for the elements outside it
+    parent = None
+    children = None
+    end = -1
+    stack = []
+
+    index = 0
+    count = len(codes)
+    i = 0
+
+    while i < count:
+
+        while index == end:
+            parent, children, end = stack.pop()
+
+        code = codes[i]
+
+        if code & TEXT:
+
+            node = Text(strings[codes[i + 1]])
+            size = 1
+            i += 2
+
+        else:
+
+            node = Element()
+            size = codes[i + 1]
+            node.namespace = intern(strings[codes[i + 2]])
+            node.name = intern(strings[codes[i + 3]])
+            node.id = intern(strings[codes[i + 4]])
+            n = codes[i + 5]
+            i += 6
+
+            if n > 0:
+                node.classes = { intern(strings[j]) for j in codes[i:i + n] }
+                i += n
+
+            n = codes[i]
+            i += 1
+
+            if n > 0:
+
+                node.attributes = attributes = {}
+
+                for j in range(i, i + 2 * n, 2):
+                    value = codes[j + 1]
+                    attributes[intern(strings[codes[j]])] = None if value == 0 else strings[value - 1]
+
+                i += 2 * n
+
+        if children is None:
+            root = node
+        else:
+
+            children.append(node)
+
+            if code & JOINED:
+
+                if parent.joined is document.EMPTY_JOINED:
+                    parent.joined = {node}
+                else:
+                    parent.joined.add(node)
+
+        if size > 1:
+            stack.append((parent, children, end))
+            parent = node
+            children = node.children = []
+            end = index + size
+
+        index += 1
+
+    return root
+
+
+def make_ElementBody(children, start, end):
+
+    attributes = [child for child in children if isinstance(child, syntax.Attribute)]
+    others = [child for child in children if not isinstance(child, syntax.Attribute)]
+
+    return syntax.ElementBody(attributes, others, start, end)
+
+
+# Rebuilds each kind of AST node with children from its start and end
+# offsets and its list of children
+AST_FACTORIES = {
+    syntax.Element: lambda children, start, end: syntax.Element(children[:-1], children[-1], start, end),
+    syntax.ElementBody: make_ElementBody,
+    syntax.NameSelector: lambda children, start, end: syntax.NameSelector(children[0] if len(children) > 1 else None, children[-1], start, end),
+    syntax.IdSelector: lambda children, start, end: syntax.IdSelector(children[0], start, end),
+    syntax.ClassSelector: lambda children, start, end: syntax.ClassSelector(children[0], start, end),
+    syntax.Attribute: lambda children, start, end: syntax.Attribute(children[0], children[1] if len(children) > 1 else None, start, end),
+}
+
+
+def build_ast(codes, strings, base = 0):
+    """Builds an AST from the varints of its node records.  base is the
+    offset which the start of the first node is relative to."""
+
+    KINDS = syntax.KINDS
+    Identifier = syntax.Identifier
+    Error = syntax.Error
+    factories = AST_FACTORIES
+
+    # Each open node is [kind, start, end, index of the end of its subtree,
+    # children, start of its last child]
+    stack = []
+    root = None
+    index = 0
+    count = len(codes)
+    i = 0
+
+    while i < count:
+
+        kind = KINDS[codes[i]]
+        size = codes[i + 1]
+        delta = codes[i + 2]
+        length = codes[i + 3]
+        i += 4
+        index += 1
+
+        if stack:
+            parent = stack[-1]
+            start = parent[5] = parent[5] + (delta >> 1 ^ -(delta & 1))
+        else:
+            start = base + (delta >> 1 ^ -(delta & 1))
+
+        end = start + (length >> 1 ^ -(length & 1))
+
+        if kind is Identifier:
+
+            node = Identifier(intern(strings[codes[i]]), start, end)
+            i += 1
+
+        elif kind in factories:
+
+            if size > 1:
+                stack.append([kind, start, end, index - 1 + size, [], start])
+                continue
+
+            node = factories[kind]([], start, end)
+
+        elif kind is Error:
+
+            node = Error(strings[codes[i]], start, end)
+            i += 1
+
+        else:
+
+            node = kind(strings[codes[i + 1]], codes[i], start, end)
+            i += 2
+
+        # Add the node to its parent, and make the parents which it ends
+        while stack:
+
+            parent = stack[-1]
+            parent[4].append(node)
+
+            if parent[3] != index:
+                break
+
+            stack.pop()
+            node = factories[parent[0]](parent[4], parent[1], parent[2])
+
+        else:
+
+            root = node
+
+    return root
+
+
+class Reader:
+    """Reads a serialized tree from bytes or another buffer, such as an mmap.
+
+    The header is checked when the reader is made, but nothing else is
+    read until it is needed: each string and node record is found through
+    its index, so a subtree can be loaded, or the structure of the tree
+    walked, without reading the rest of the buffer.  Nodes are identified
+    by their index in document order, and the root is node 0."""
+
+    def __init__(self, buffer):
+
+        if len(buffer) < HEADER.size or buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a serialized tree")
+
+        _, version, kind, width, string_count, node_count, string_index, node_index = HEADER.unpack_from(buffer)
+
+        if version != VERSION:
+            raise ValueError("Unsupported serialization format version %d" % version)
+
+        if (kind not in (DOCUMENT, AST) or width not in OFFSET_TYPES or node_count == 0 or
+                not HEADER.size <= string_index <= node_index - width * (string_count + 1) or
+                node_index + width * node_count > len(buffer)):
+            raise ValueError("Corrupt serialized tree")
+
+        self.buffer = buffer
+        self.kind = kind
+        self.width = width
+        self.string_offsets = self.offsets(string_index, string_count + 1)
+        self.node_offsets = self.offsets(node_index, node_count)
+        self.records_end = string_index
+        self.strings = {}
+        self.mapping = None
+
+
+    def offsets(self, offset, count):
+        """Returns a sequence of the integers of an index, read in place if
+        the byte order allows."""
+
+        offset_type = OFFSET_TYPES[self.width]
+        view = memoryview(self.buffer)[offset:offset + self.width * count]
+
+        if sys.byteorder == "little":
+            return view.cast(offset_type)
+
+        offsets = array(offset_type, view.tobytes())
+        offsets.byteswap()
+
+        return offsets
+
+
+    def __len__(self):
+
+        return len(self.node_offsets)
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+
+    def close(self):
+        """Releases the buffer, closing it if it was mapped by open_file."""
+
+        for offsets in (self.string_offsets, self.node_offsets):
+            if isinstance(offsets, memoryview):
+                offsets.release()
+
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+
+    def string(self, index):
+        """Returns a string from the table."""
+
+        value = self.strings.get(index)
+
+        if value is None:
+
+            if not 0 <= index < len(self.string_offsets) - 1:
+                raise ValueError("Corrupt serialized tree: no string %d" % index)
+
+            start, end = self.string_offsets[index], self.string_offsets[index + 1]
+            value = self.strings[index] = bytes(self.buffer[start:end]).decode("utf-8", "surrogatepass")
+
+        return value
+
+
+    def all_strings(self):
+        """Returns a list of every string in the table."""
+
+        offsets = self.string_offsets
+        data = bytes(self.buffer[offsets[0]:offsets[-1]])
+        base = offsets[0]
+
+        return [
+            data[start - base:end - base].decode("utf-8", "surrogatepass")
+            for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+    def fields(self, index, count):
+        """Returns the first count varints of a node's record."""
+
+        buffer = self.buffer
+        offset = self.node_offsets[index]
+        out = []
+
+        for _ in range(count):
+            value, offset = read_varint(buffer, offset)
+            out.append(value)
+
+        return out
+
+
+    def header(self, index):
+        """Returns the (code, size) of a node."""
+
+        code = self.fields(index, 1)[0]
+
+        if self.kind == DOCUMENT and code & TEXT:
+            return code, 1
+
+        return tuple(self.fields(index, 2))
+
+
+    def type(self, index):
+        """Returns the type name of a node."""
+
+        code = self.header(index)[0]
+
+        if self.kind == AST:
+            return syntax.KINDS[code].type
+
+        return "Text" if code & TEXT else "Element"
+
+
+    def size(self, index):
+        """Returns the number of nodes in the subtree of a node."""
+
+        return self.header(index)[1]
+
+
+    def children(self, index):
+        """Returns the indexes of the children of a node."""
+
+        out = []
+        child = index + 1
+        end = index + self.size(index)
+
+        while child < end:
+            out.append(child)
+            child += self.size(child)
+
+        return out
+
+
+    def base(self, index):
+        """Returns the offset which the start of an AST node is stored
+        relative to, found by walking down to the node from the root."""
+
+        base = 0
+        node = 0
+
+        while node != index:
+
+            # The start of the node is the base of its first child
+            base += unzigzag(self.fields(node, 3)[2])
+            child = node + 1
+
+            while True:
+
+                _, size, delta = self.fields(child, 3)
+
+                if index < child + size:
+                    break
+
+                base += unzigzag(delta)
+                child += size
+
+            node = child
+
+        return base
+
+
+    def span(self, index):
+        """Returns the (start, end) source offsets of an AST node."""
+
+        if self.kind != AST:
+            raise ValueError("Document nodes have no spans")
+
+        _, _, delta, length = self.fields(index, 4)
+        start = self.base(index) + unzigzag(delta)
+
+        return start, start + unzigzag(length)
+
+
+    def load(self, index = 0):
+        """Builds the subtree of a node, returning a document.Element or
+        Text, or an AST node.  A record which refers to a string or node
+        which does not exist raises ValueError."""
+
+        try:
+            return self.build(index)
+        except IndexError as error:
+            raise ValueError("Corrupt serialized tree") from error
+
+
+    def build(self, index):
+
+        end = index + self.size(index)
+        start = self.node_offsets[index]
+        stop = self.node_offsets[end] if end < len(self) else self.records_end
+        codes = read_varints(bytes(self.buffer[start:stop]))
+
+        if index == 0 and end == len(self):
+            strings = self.all_strings()
+        else:
+            strings = StringTable(self)
+
+        if self.kind == AST:
+            return build_ast(codes, strings, self.base(index))
+
+        return build_document(codes, strings)
+
+
+class StringTable:
+    """Looks up strings by index in a Reader's table, for loading part of a
+    tree."""
+
+    __slots__ = ("reader",)
+
+    def __init__(self, reader):
+
+        self.reader = reader
+
+
+    def __getitem__(self, index):
+
+        return self.reader.string(index)
+
+
+def open_file(path):
+    """Returns a Reader for a file holding a serialized tree.  The file is
+    memory-mapped, so only the parts which are read are loaded, and the
+    mapping is closed by the reader's close method."""
+
+    with open(path, "rb") as file:
+        mapping = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+    try:
+        reader = Reader(mapping)
+    except ValueError:
+        mapping.close()
+        raise
+
+    reader.mapping = mapping
+
+    return reader
+
+
+def load_document(data):
+    """Rebuilds a document tree from the output of dump_document."""
+
+    reader = Reader(data)
+
+    try:
+
+        if reader.kind != DOCUMENT:
+            raise ValueError("Not a serialized document")
+
+        return reader.load()
+
+    finally:
+        reader.close()
+
+
+def load_ast(data):
+    """Rebuilds an AST from the output of dump_ast."""
+
+    reader = Reader(data)
+
+    try:
+
+        if reader.kind != AST:
+            raise ValueError("Not a serialized AST")
+
+        return reader.load()
+
+    finally:
+        reader.close()
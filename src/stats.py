@@ -0,0 +1,248 @@
+import time
+import document
+from parser import LimitScanner, Limits, Parser, TreeBuilder
+from scanner import TYPE, START, END
+
+# The bytes which do not start a non-ASCII UTF-8 character
+NOT_LEAD_BYTES = bytes(range(0xC0))
+
+# The node factories of a builder
+FACTORIES = (
+    "Identifier",
+    "NameSelector",
+    "IdSelector",
+    "ClassSelector",
+    "Attribute",
+    "RawString",
+    "RawBlock",
+    "Text",
+    "Error",
+)
+
+
+class ParseStats:
+    """Counters and timers collected while parsing.
+
+    tokens counts tokens by type.  non_ascii_chars counts the characters
+    of text and identifier tokens which are outside ASCII, and so are
+    classified by the slower Unicode rules.  rewinds counts calls to
+    Parser.rewind, and rescanned counts the input units (characters, or
+    bytes for bytes input) which were scanned again because tokens could not
+    be replayed.  nodes counts the nodes made by each builder factory and
+    the elements started, and max_depth is the deepest element nesting.
+    timings holds the wall time in seconds of each phase: scan, build,
+    parse (the total, including scan and build) and, for documents built
+    from an AST, from_ast."""
+
+    __slots__ = ("tokens", "non_ascii_chars", "rewinds", "rescanned", "nodes", "max_depth", "timings")
+
+    def __init__(self):
+
+        self.tokens = {}
+        self.non_ascii_chars = 0
+        self.rewinds = 0
+        self.rescanned = 0
+        self.nodes = {}
+        self.max_depth = 0
+        self.timings = { "scan": 0.0, "build": 0.0, "parse": 0.0 }
+
+
+    def as_dict(self):
+        """Returns the stats as a dict of plain values, for exporting."""
+
+        return { name: getattr(self, name) for name in self.__slots__ }
+
+
+    def __repr__(self):
+
+        return "ParseStats(%s)" % ", ".join("%s=%r" % item for item in self.as_dict().items())
+
+
+class StatsScanner(LimitScanner):
+    """A scanner which counts and times the tokens it reads, and enforces
+    the limits of a parse if any are given."""
+
+    def __init__(self, input, stats, limits = None):
+
+        super().__init__(input, Limits() if limits is None else limits)
+        self.stats = stats
+        self.scanned = 0
+
+
+    def scan(self, context):
+
+        offset = self.offset
+        start = time.perf_counter()
+        tok = LimitScanner.scan(self, context)
+        stats = self.stats
+        stats.timings["scan"] += time.perf_counter() - start
+        stats.tokens[tok[TYPE]] = stats.tokens.get(tok[TYPE], 0) + 1
+
+        if offset < self.scanned:
+            stats.rescanned += min(self.scanned, tok[END]) - offset
+
+        self.scanned = max(self.scanned, tok[END])
+
+        if tok[TYPE] == "text" or tok[TYPE] == "identifier":
+            stats.non_ascii_chars += count_non_ascii(self.input, tok[START], tok[END])
+
+        return tok
+
+
+class StatsBuilder:
+    """Wraps a builder, counting and timing the nodes it makes and tracking
+    the depth of open elements."""
+
+    def __init__(self, builder, stats):
+
+        self.builder = builder
+        self.stats = stats
+        self.depth = 0
+
+        # Error is only needed by builders used in recovering mode
+        for name in FACTORIES:
+            if hasattr(builder, name):
+                setattr(self, name, self.counter(name, getattr(builder, name)))
+
+
+    def counter(self, name, factory):
+
+        stats = self.stats
+
+        def create(*args):
+
+            start = time.perf_counter()
+            node = factory(*args)
+            stats.timings["build"] += time.perf_counter() - start
+            stats.nodes[name] = stats.nodes.get(name, 0) + 1
+
+            return node
+
+        return create
+
+
+    def start_element(self, *args):
+
+        self.depth += 1
+        self.stats.max_depth = max(self.stats.max_depth, self.depth)
+        self.stats.nodes["Element"] = self.stats.nodes.get("Element", 0) + 1
+        self.timed(self.builder.start_element, *args)
+
+
+    def end_element(self, end):
+
+        self.depth -= 1
+        self.timed(self.builder.end_element, end)
+
+
+    def add(self, node):
+
+        self.timed(self.builder.add, node)
+
+
+    def close(self):
+
+        return self.timed(self.builder.close)
+
+
+    def timed(self, method, *args):
+
+        start = time.perf_counter()
+        result = method(*args)
+        self.stats.timings["build"] += time.perf_counter() - start
+
+        return result
+
+
+class StatsParser(Parser):
+    """A parser which collects ParseStats.  The plain Parser has no
+    instrumentation, so it pays nothing for this one.  The options are as
+    for Parser."""
+
+    def __init__(self, stats = None, recover = False, coalesce = False, limits = None):
+
+        super().__init__(recover, coalesce, limits)
+        self.stats = ParseStats() if stats is None else stats
+
+
+    def reset(self, input, builder, offset = 0):
+
+        if not isinstance(builder, StatsBuilder):
+            builder = StatsBuilder(builder, self.stats)
+
+        super().reset(input, builder, offset)
+
+
+    def make_scanner(self, input):
+
+        return StatsScanner(input, self.stats, self.limits)
+
+
+    def rewind(self, offset):
+
+        self.stats.rewinds += 1
+        super().rewind(offset)
+
+
+def count_non_ascii(input, start, end):
+    """Returns the number of non-ASCII characters in part of the input."""
+
+    part = input[start:end]
+
+    if part.isascii():
+        return 0
+
+    if isinstance(part, str):
+        return len(part) - len(part.encode("ascii", "ignore"))
+
+    # Count UTF-8 lead bytes, dropping the ASCII and continuation bytes
+    return len(part.translate(None, NOT_LEAD_BYTES))
+
+
+def parse(input, builder = None, hook = None, limits = None):
+    """Parses the input like Parser.parse, and returns a (result, ParseStats)
+    tuple.
+
+    If hook is given, it is called with the stats when parsing ends, even if
+    it fails, so that they can be passed to a metrics exporter.  If limits
+    is given, the parse is bounded as by Parser."""
+
+    parser = StatsParser(limits = limits)
+    start = time.perf_counter()
+
+    try:
+        result = parser.parse(input, TreeBuilder() if builder is None else builder)
+    finally:
+
+        parser.stats.timings["parse"] = time.perf_counter() - start
+
+        if hook is not None:
+            hook(parser.stats)
+
+    return result, parser.stats
+
+
+def parse_document(input, hook = None, limits = None):
+    """Parses the input into an AST, converts it with document.from_ast, and
+    returns a (document, ParseStats) tuple.  The hook and limits are as for
+    parse."""
+
+    parser = StatsParser(limits = limits)
+    start = time.perf_counter()
+    parsed = None
+
+    try:
+
+        tree = parser.parse(input)
+        parsed = time.perf_counter()
+        doc = document.from_ast(tree)
+        parser.stats.timings["from_ast"] = time.perf_counter() - parsed
+
+    finally:
+
+        parser.stats.timings["parse"] = (parsed or time.perf_counter()) - start
+
+        if hook is not None:
+            hook(parser.stats)
+
+    return doc, parser.stats
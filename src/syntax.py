@@ -0,0 +1,870 @@
+from array import array
+from scanner import span_value
+
+def node_type(c):
+    """Assigns a node type name based on the class name"""
+    
+    c.type = c.__name__
+    return c
+
+@node_type
+class Element:
+    """An element.  After Parser.reparse has shifted an element, the
+    selectors and body are shifted as well the first time they are read;
+    see defer_shift."""
+
+    __slots__ = ("selectors", "body", "start", "end", "pending")
+    
+    def __init__(self, selectors, body, start, end):
+        
+        self.selectors = selectors
+        self.body = body
+        self.start = start
+        self.end = end
+        self.pending = None
+    
+    def __getattr__(self, name):
+    
+        # Only called while a shift is pending, when the selectors and body
+        # are held in pending instead
+        if name != "selectors" and name != "body" or self.pending is None:
+            raise AttributeError(name)
+        
+        delta, source, self.selectors, self.body = self.pending
+        self.pending = None
+        
+        for selector in self.selectors:
+            defer_shift(selector, delta, source)
+        
+        body = self.body
+        body.start += delta
+        body.end += delta
+        
+        for attribute in body.attributes:
+            defer_shift(attribute, delta, source)
+        
+        for node in body.children:
+            defer_shift(node, delta, source)
+        
+        return self.selectors if name == "selectors" else self.body
+    
+    def __iter__(self):
+        yield from self.selectors
+        yield self.body
+        
+
+@node_type
+class ElementBody:
+
+    __slots__ = ("attributes", "children", "start", "end")
+
+    def __init__(self, attributes, children, start, end):
+    
+        self.attributes = attributes
+        self.children = children
+        self.start = start
+        self.end = end
+    
+    def __iter__(self):
+        yield from self.attributes
+        yield from self.children
+        
+
+@node_type
+class NameSelector:
+
+    __slots__ = ("namespace", "name", "start", "end")
+
+    def __init__(self, namespace, name, start, end):
+    
+        self.namespace = namespace
+        self.name = name
+        self.start = start
+        self.end = end
+    
+    def __iter__(self):
+        if self.namespace != None: yield self.namespace
+        yield self.name
+
+
+@node_type
+class IdSelector:
+
+    __slots__ = ("id", "start", "end")
+
+    def __init__(self, id, start, end):
+    
+        self.id = id
+        self.start = start
+        self.end = end
+    
+    def __iter__(self):
+        yield self.id
+
+
+@node_type
+class ClassSelector:
+
+    __slots__ = ("name", "start", "end")
+
+    def __init__(self, name, start, end):
+    
+        self.name = name
+        self.start = start
+        self.end = end
+    
+    def __iter__(self):
+        yield self.name
+        
+
+@node_type
+class Attribute:
+
+    __slots__ = ("key", "value", "start", "end")
+
+    def __init__(self, key, value, start, end):
+    
+        self.key = key
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        yield self.key
+        yield self.value
+        
+
+@node_type
+class Identifier:
+
+    __slots__ = ("value", "start", "end")
+
+    def __init__(self, value, start, end):
+    
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        yield from []
+    
+
+class Source:
+    """Holds the text which the spans of text nodes index.  The parser gives
+    the text nodes of a tree the same Source, so that Parser.reparse can
+    replace the text of all of them at once."""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+    
+        self.text = text
+
+
+class TextNode:
+
+    __slots__ = ("_value", "_source", "spans", "newlines", "start", "end")
+
+    def __init__(self, value, newlines, start, end, source = None, spans = None):
+    
+        self._value = value
+        self._source = source
+        self.spans = spans
+        self.newlines = newlines
+        self.start = start
+        self.end = end
+    
+    @property
+    def source(self):
+        """The text which the spans index, which may be held in a Source."""
+        
+        source = self._source
+        return source.text if source.__class__ is Source else source
+    
+    @source.setter
+    def source(self, source):
+    
+        self._source = source
+    
+    @property
+    def value(self):
+        """The text of the node.  Nodes created from source spans build the
+        string the first time it is read."""
+        
+        if self._value is None:
+            self._value = span_value(self.source, self.spans)
+        
+        return self._value
+    
+    @value.setter
+    def value(self, value):
+    
+        self._value = value
+        self._source = None
+        self.spans = None
+
+    def __iter__(self):
+        yield from []
+
+
+@node_type
+class RawString(TextNode): __slots__ = ()
+
+
+@node_type
+class RawBlock(TextNode): __slots__ = ()
+
+
+@node_type
+class Text(TextNode): __slots__ = ()
+
+
+@node_type
+class Error:
+    """Input which could not be parsed, made by the parser in recovering
+    mode in place of the nodes it would have held."""
+
+    __slots__ = ("message", "start", "end")
+
+    def __init__(self, message, start, end):
+    
+        self.message = message
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        yield from []
+
+
+def shift(node, delta):
+    """Adds delta to the start and end offsets of a node and all of its
+    descendants.  The values of text nodes are not affected."""
+
+    stack = [node]
+    
+    while stack:
+    
+        node = stack.pop()
+        
+        if node is not None:
+            node.start += delta
+            node.end += delta
+            stack.extend(node)
+
+
+def defer_shift(node, delta, source = None):
+    """Adds delta to the start and end offsets of a node now, and to those of
+    its descendants when they are first read, by way of its parent element.
+    Text nodes whose spans index the text of the Source are moved with
+    their offsets."""
+
+    node.start += delta
+    node.end += delta
+    
+    if node.__class__ is Element:
+    
+        pending = node.pending
+        
+        if pending is not None and pending[1] is source:
+            node.pending = (pending[0] + delta,) + pending[1:]
+        else:
+        
+            # A shift for another source is applied first
+            if pending is not None:
+                node.body
+            
+            node.pending = (delta, source, node.selectors, node.body)
+            del node.selectors, node.body
+    
+    elif isinstance(node, TextNode):
+    
+        if node.spans is not None and node._source is source:
+            node.spans = tuple(offset + delta for offset in node.spans)
+    
+    else:
+    
+        for child in node:
+        
+            if child is not None:
+                defer_shift(child, delta, source)
+
+
+def find_source(root):
+    """Returns the Source of the first text node below a node which has one,
+    or None."""
+
+    stack = [root]
+    
+    while stack:
+    
+        node = stack.pop()
+        
+        if isinstance(node, TextNode):
+        
+            if node._source.__class__ is Source:
+                return node._source
+        
+        elif node is not None:
+            stack.extend(reversed(children(node)))
+    
+    return None
+
+
+def text_source(root):
+    """Returns the source of the first text node below a node whose source
+    is a str or bytes, or None."""
+
+    stack = [root]
+    
+    while stack:
+    
+        node = stack.pop()
+        
+        if isinstance(node, TextNode):
+        
+            if isinstance(node.source, (str, bytes)):
+                return node.source
+        
+        elif node is not None:
+            stack.extend(reversed(children(node)))
+    
+    return None
+
+
+KINDS = (
+    Element, 
+    ElementBody, 
+    NameSelector, 
+    IdSelector, 
+    ClassSelector, 
+    Attribute, 
+    Identifier, 
+    RawString, 
+    RawBlock, 
+    Text,
+    Error,
+)
+
+KIND_INDEX = { c: i for i, c in enumerate(KINDS) }
+
+# The fields of each node class which hold child nodes, in order, and
+# whether each one is a list
+CHILD_FIELDS = {
+    Element: (("selectors", True), ("body", False)),
+    ElementBody: (("attributes", True), ("children", True)),
+    NameSelector: (("namespace", False), ("name", False)),
+    IdSelector: (("id", False),),
+    ClassSelector: (("name", False),),
+    Attribute: (("key", False), ("value", False)),
+    Identifier: (),
+    RawString: (),
+    RawBlock: (),
+    Text: (),
+    Error: (),
+}
+
+
+def children(node):
+    """Returns a list of the child nodes of a node, in order."""
+
+    fields = CHILD_FIELDS.get(node.__class__)
+
+    if fields is None:
+        return list(node)
+
+    out = []
+
+    for name, many in fields:
+
+        value = getattr(node, name)
+
+        if many:
+            out.extend(value)
+        elif value is not None:
+            out.append(value)
+
+    return out
+
+
+class Visitor:
+    """Walks an AST in document order without recursion.
+
+    Subclasses define visit_<type> methods, which are called before the
+    children of a node of that type, and leave_<type> methods, which are
+    called after them; generic_visit is called for types without a visit
+    method.  If a visit method returns SKIP, the children of the node and
+    its leave method are skipped.  The methods for each node class are
+    looked up once, when the subclass is created."""
+
+    SKIP = object()
+
+    def __init_subclass__(cls, **kwargs):
+
+        super().__init_subclass__(**kwargs)
+
+        cls.dispatch = {}
+
+        for kind in KINDS:
+
+            cls.dispatch[kind] = (
+                getattr(cls, "visit_" + kind.type, cls.generic_visit),
+                getattr(cls, "leave_" + kind.type, None),
+                tuple(reversed(CHILD_FIELDS[kind])))
+
+
+    def generic_visit(self, node):
+
+        pass
+
+
+    def visit(self, node):
+        """Visits a node and all of its descendants."""
+
+        dispatch = self.dispatch
+        skip = Visitor.SKIP
+
+        # Nodes waiting to be visited, and (leave method, node) pairs
+        stack = [node]
+
+        while stack:
+
+            node = stack.pop()
+
+            if node.__class__ is tuple:
+                node[0](self, node[1])
+                continue
+
+            entry = dispatch.get(node.__class__)
+
+            if entry is None:
+                entry = self.lookup(node)
+
+            visit, leave, fields = entry
+
+            if visit(self, node) is skip:
+                continue
+
+            if leave is not None:
+                stack.append((leave, node))
+
+            if fields is None:
+                stack.extend(reversed(list(node)))
+                continue
+
+            for name, many in fields:
+
+                value = getattr(node, name)
+
+                if many:
+                    stack.extend(reversed(value))
+                elif value is not None:
+                    stack.append(value)
+
+
+    def lookup(self, node):
+        """Returns the dispatch entry for a node whose class is not an AST
+        class, such as a NodeView, using its type name."""
+
+        cls = self.__class__
+
+        return (
+            getattr(cls, "visit_" + node.type, cls.generic_visit),
+            getattr(cls, "leave_" + node.type, None),
+            None)
+
+
+Visitor.__init_subclass__()
+
+
+class Transformer:
+    """Rebuilds an AST from the bottom up without recursion.
+
+    Subclasses define transform_<type> methods, which are called after the
+    children of a node of that type have been transformed and stored back
+    into its fields.  A method returns the node to use in its place: the
+    same node, a new one, None to remove it, or for nodes in a list field,
+    a list of nodes to insert instead.  Types without a method are kept.
+    The methods for each node class are looked up once, when the subclass
+    is created."""
+
+    def __init_subclass__(cls, **kwargs):
+
+        super().__init_subclass__(**kwargs)
+
+        cls.dispatch = {}
+
+        for kind in KINDS:
+            cls.dispatch[kind] = getattr(cls, "transform_" + kind.type, None)
+
+
+    def transform(self, node):
+        """Transforms a node and all of its descendants, and returns the
+        result for the node."""
+
+        dispatch = self.dispatch
+
+        # (node, child count) pairs waiting to be visited or, once their
+        # children are done, transformed; results wait on their own stack
+        stack = [(node, -1)]
+        results = []
+
+        while stack:
+
+            node, count = stack.pop()
+            fields = CHILD_FIELDS[node.__class__]
+
+            if count < 0:
+
+                nodes = children(node)
+                stack.append((node, len(nodes)))
+                stack.extend((child, -1) for child in reversed(nodes))
+                continue
+
+            if count > 0:
+
+                done = results[len(results) - count:]
+                del results[len(results) - count:]
+                i = 0
+
+                for name, many in fields:
+
+                    value = getattr(node, name)
+
+                    if many:
+
+                        new = []
+
+                        for result in done[i:i + len(value)]:
+
+                            if result.__class__ is list:
+                                new.extend(result)
+                            elif result is not None:
+                                new.append(result)
+
+                        i += len(value)
+                        setattr(node, name, new)
+
+                    elif value is not None:
+
+                        setattr(node, name, done[i])
+                        i += 1
+
+            method = dispatch[node.__class__]
+            results.append(node if method is None else method(self, node))
+
+        return results[0]
+
+
+Transformer.__init_subclass__()
+
+
+class NodeStore:
+    """Stores an AST in flat typed arrays.
+    
+    Each node is an index into parallel arrays holding its kind, source
+    span, parent, first child and next sibling.  Text and identifier values
+    are kept as spans into the source where possible, which must then be a
+    str or bytes; a bytes source is decoded as UTF-8 when a value is read.
+    Values from other sources, such as an mmap which may since have been
+    closed, are copied out as strings.  Nodes are
+    accessed through lightweight NodeView objects, which support the same
+    traversal and field names as the node classes.  The views of a node's
+    children are made when first read and kept as tuples."""
+
+    def __init__(self, source = None):
+    
+        self.source = source
+        self.kind = array("B")
+        self.start = array("q")
+        self.end = array("q")
+        self.parent = array("i")
+        self.first_child = array("i")
+        self.next_sibling = array("i")
+        self.newlines = array("i")
+        self.value_start = array("q")
+        self.value_end = array("q")
+        
+        # Values which cannot be stored as a single source span, by node index
+        self.values = {}
+        
+        # Views of the children of nodes, and of the attributes and other
+        # children of element bodies, by node index
+        self.views = {}
+        self.body_views = {}
+    
+    
+    def __len__(self):
+    
+        return len(self.kind)
+    
+    
+    @property
+    def root(self):
+        """A view of the root node."""
+    
+        return NodeView(self, 0)
+    
+    
+    def node(self, index):
+        """Returns a view of the node at the specified index."""
+    
+        return NodeView(self, index)
+    
+    
+    def add(self, kind, start, end, parent, previous = -1):
+        """Appends a node and links it into its parent's child list after the
+        previous sibling.  Returns the index of the new node."""
+    
+        index = len(self.kind)
+        
+        self.kind.append(kind)
+        self.start.append(start)
+        self.end.append(end)
+        self.parent.append(parent)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self.newlines.append(0)
+        self.value_start.append(0)
+        self.value_end.append(0)
+        
+        if previous >= 0:
+            self.next_sibling[previous] = index
+        elif parent >= 0:
+            self.first_child[parent] = index
+        
+        if self.views:
+            self.views.pop(parent, None)
+            self.body_views.pop(parent, None)
+        
+        return index
+    
+    
+    def set_value(self, index, value, source = None, spans = None):
+        """Sets the value of a text or identifier node.  A value given as a
+        single span into the store's source is kept as offsets only."""
+    
+        if source is self.source and isinstance(source, (str, bytes)) and len(spans) == 2:
+            self.value_start[index] = spans[0]
+            self.value_end[index] = spans[1]
+        
+        elif value is None:
+            self.values[index] = span_value(source, spans)
+        
+        else:
+            self.values[index] = value
+    
+    
+    def get_value(self, index):
+        """Returns the value of a text or identifier node."""
+    
+        value = self.values.get(index)
+        
+        if value is None:
+            value = span_value(self.source, (self.value_start[index], self.value_end[index]))
+        
+        return value
+    
+    
+    def child_indexes(self, index):
+        """Returns the indexes of the children of a node."""
+    
+        list = []
+        child = self.first_child[index]
+        next_sibling = self.next_sibling
+        
+        while child >= 0:
+            list.append(child)
+            child = next_sibling[child]
+        
+        return list
+    
+    
+    def child_views(self, index):
+        """Returns a tuple of views of the children of a node."""
+    
+        views = self.views.get(index)
+        
+        if views is None:
+            views = self.views[index] = tuple(NodeView(self, child) for child in self.child_indexes(index))
+        
+        return views
+    
+    
+    def split_body(self, index):
+        """Returns tuples of views of the attributes and the other children
+        of an element body."""
+    
+        views = self.body_views.get(index)
+        
+        if views is None:
+        
+            children = self.child_views(index)
+            kind = self.kind
+            attribute = KIND_INDEX[Attribute]
+            
+            views = self.body_views[index] = (
+                tuple(view for view in children if kind[view.index] == attribute),
+                tuple(view for view in children if kind[view.index] != attribute))
+        
+        return views
+    
+    
+    @classmethod
+    def from_tree(cls, root, source = None):
+        """Copies a tree of node objects into a new store.
+        
+        If source is not given, the source of the first text node is used if
+        it is a str or bytes.  Values of text nodes which share that source
+        are stored as spans; other values are stored as strings."""
+    
+        # The source is found first, so that identifiers before the first
+        # text node are stored as spans too
+        if source is None:
+            source = text_source(root)
+        
+        store = cls(source)
+        last_child = {}
+        stack = [(root, -1)]
+        
+        while stack:
+        
+            node, parent = stack.pop()
+            
+            index = store.add(
+                KIND_INDEX[node.__class__], 
+                node.start, 
+                node.end, 
+                parent, 
+                last_child.pop(parent, -1))
+            
+            if parent >= 0:
+                last_child[parent] = index
+            
+            if isinstance(node, TextNode):
+            
+                store.newlines[index] = node.newlines
+                
+                if node.spans is not None:
+                    store.set_value(index, node._value, node.source, node.spans)
+                else:
+                    store.set_value(index, node.value)
+            
+            elif isinstance(node, Identifier):
+            
+                source = store.source
+                
+                if isinstance(source, str) and source[node.start:node.end] == node.value:
+                    store.set_value(index, None, source, (node.start, node.end))
+                else:
+                    store.set_value(index, node.value)
+            
+            elif isinstance(node, Error):
+            
+                store.set_value(index, node.message)
+            
+            else:
+            
+                children = [child for child in node if child is not None]
+                
+                for child in reversed(children):
+                    stack.append((child, index))
+        
+        return store
+
+
+class NodeView:
+    """A lightweight view of a node in a NodeStore."""
+
+    __slots__ = ("store", "index")
+    
+    def __init__(self, store, index):
+    
+        self.store = store
+        self.index = index
+    
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and other.store is self.store and other.index == self.index
+    
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+    
+    def __iter__(self):
+    
+        store = self.store
+        
+        for index in store.child_indexes(self.index):
+            yield NodeView(store, index)
+    
+    def child_list(self):
+        return list(self.store.child_views(self.index))
+    
+    @property
+    def type(self):
+        return KINDS[self.store.kind[self.index]].type
+    
+    @property
+    def start(self):
+        return self.store.start[self.index]
+    
+    @property
+    def end(self):
+        return self.store.end[self.index]
+    
+    @property
+    def newlines(self):
+        return self.store.newlines[self.index]
+    
+    @property
+    def parent(self):
+    
+        index = self.store.parent[self.index]
+        return None if index < 0 else NodeView(self.store, index)
+    
+    @property
+    def value(self):
+    
+        t = self.type
+        
+        if t == "Attribute":
+            children = self.store.child_views(self.index)
+            return children[1] if len(children) > 1 else None
+        
+        return self.store.get_value(self.index)
+    
+    @property
+    def message(self):
+        return self.store.get_value(self.index)
+    
+    @property
+    def selectors(self):
+        return self.store.child_views(self.index)[:-1]
+    
+    @property
+    def body(self):
+        return self.store.child_views(self.index)[-1]
+    
+    @property
+    def attributes(self):
+        return self.store.split_body(self.index)[0]
+    
+    @property
+    def children(self):
+        return self.store.split_body(self.index)[1]
+    
+    @property
+    def namespace(self):
+    
+        children = self.store.child_views(self.index)
+        return children[0] if len(children) > 1 else None
+    
+    @property
+    def name(self):
+        return self.store.child_views(self.index)[-1]
+    
+    @property
+    def id(self):
+        return self.store.child_views(self.index)[0]
+    
+    @property
+    def key(self):
+        return self.store.child_views(self.index)[0]
@@ -1,21 +1,26 @@
 from parser import Parser
 
-def print_tree(node, depth = 0):
+def print_tree(root):
 
-    line = "";
+    stack = [(root, 0)]
     
-    for i in range(depth):
-        line += "   "
+    while stack:
     
-    line += "<" + node.type + ">"
-    
-    if hasattr(node, "value") and type(node.value) is str:
-        line += " " + node.value
-    
-    print(line)
-    
-    for child in node:
-        print_tree(child, depth + 1)
+        node, depth = stack.pop()
+        line = "";
+        
+        for i in range(depth):
+            line += "   "
+        
+        line += "<" + node.type + ">"
+        
+        if hasattr(node, "value") and type(node.value) is str:
+            line += " " + node.value
+        
+        print(line)
+        
+        for child in reversed(list(node)):
+            stack.append((child, depth + 1))
 
 
 tree = Parser().parse("""
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules under test are in the parent directory, which is only on the
+# path when pytest is run from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,46 @@
+import random
+
+# Node types whose value is compared
+VALUE_TYPES = ("Identifier", "Text", "RawString", "RawBlock")
+
+def dump(node, out = None):
+    """Returns the nodes below and including an AST node in preorder, as
+    (depth, type, start, end, value, newlines) tuples."""
+
+    if out is None:
+        out = []
+
+    stack = [(node, 0)]
+
+    while stack:
+
+        node, depth = stack.pop()
+
+        if node is None:
+            out.append(None)
+            continue
+
+        value = node.value if node.type in VALUE_TYPES else None
+        out.append((depth, node.type, node.start, node.end, value, getattr(node, "newlines", None)))
+        stack.extend((child, depth + 1) for child in reversed(list(node)))
+
+    return out
+
+
+def random_document(rng, depth = 0):
+    """Returns a random document of nested elements, words, raw strings and
+    raw blocks."""
+
+    out = []
+
+    for _ in range(rng.randint(0, 6)):
+
+        if rng.random() < 0.25 and depth < 5:
+            out.append(rng.choice(["p", "div#a", "x.y", "", "n:m"]) + " { " +
+                rng.choice(["", "[a=b] ", "[c=`d`]\n"]) + random_document(rng, depth + 1) + " }")
+        else:
+            out.append(rng.choice(["word", "two words", "`raw`", "```\nblock\n```", "é", "x-y"]))
+
+        out.append(rng.choice([" ", "\n", "\n\n  ", " \r\n"]))
+
+    return "".join(out)
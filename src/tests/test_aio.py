@@ -0,0 +1,136 @@
+import asyncio
+import random
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import aio
+from parser import Parser, ParseError, TreeBuilder
+from support import dump, random_document
+
+async def parse(source):
+    """Returns the dumped tree for a source, or the error it raises."""
+
+    try:
+        return dump(await aio.parse(source, interval = 5))
+    except ParseError as e:
+        return ("error", e.message, e.line, e.column)
+
+
+class Source:
+    """A stream which returns chunks of random sizes."""
+
+    def __init__(self, data, rng):
+
+        self.data = data
+        self.offset = 0
+        self.rng = rng
+
+    async def read(self, size):
+
+        await asyncio.sleep(0)
+        chunk = self.data[self.offset:self.offset + self.rng.randint(1, 20)]
+        self.offset += len(chunk)
+
+        return chunk
+
+
+class CountingBuilder(TreeBuilder):
+    """A TreeBuilder which counts the nodes added to it, and can be made to
+    wait in the middle of a parse."""
+
+    def __init__(self, started, release):
+
+        super().__init__()
+        self.count = 0
+        self.started = started
+        self.release = release
+
+    def add(self, node):
+
+        self.count += 1
+
+        if self.count == 1000:
+            self.started.set()
+            self.release.wait()
+
+        super().add(node)
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_stream(self):
+
+        rng = random.Random(0)
+
+        async def check(input):
+
+            try:
+                expected = dump(Parser().parse(input))
+            except ParseError as e:
+                expected = ("error", e.message, e.line, e.column)
+
+            self.assertEqual(await parse(Source(input, rng)), expected, input)
+
+            # Offsets of the stream path are in characters for bytes too
+            self.assertEqual(await parse(Source(input.encode(), rng)), expected, input)
+
+        async def main():
+
+            for _ in range(200):
+                await check(("[x=y] " if rng.random() < 0.2 else "") + random_document(rng))
+
+            await check(" é { ü } 日本 ")
+
+        asyncio.run(main())
+
+    def test_stream_error(self):
+
+        async def main():
+
+            with self.assertRaises(ParseError) as context:
+                await aio.parse(Source("a { b } c {", random.Random(0)))
+
+            return context.exception
+
+        error = asyncio.run(main())
+        self.assertEqual((error.message, error.line), ("Unexpected end of input", 1))
+
+    def test_async_iterable(self):
+
+        async def chunks():
+
+            for chunk in (b"a { \xc3", b"\xa9 } ", b"b"):
+                yield chunk
+
+        self.assertEqual(dump(asyncio.run(aio.parse(chunks()))), dump(Parser().parse("a { é } b")))
+
+    def test_offload_cancel(self):
+
+        input = "p { word } " * 20000
+        started = threading.Event()
+        release = threading.Event()
+        builder = CountingBuilder(started, release)
+        executor = ThreadPoolExecutor(1)
+
+        async def main():
+
+            task = asyncio.create_task(aio.parse(input, builder, interval = 10,
+                offload = True, executor = executor))
+
+            await asyncio.get_running_loop().run_in_executor(None, started.wait)
+            task.cancel()
+
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(main())
+
+        # The worker stops at its next interval once it is let go
+        release.set()
+        executor.shutdown(wait = True)
+        self.assertLess(builder.count, 1100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import pathlib
+import tempfile
+import unittest
+
+import render
+from batch import parse_many
+from parser import LimitError, Limits, ParseError
+
+class ParseManyTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = pathlib.Path(self.directory.name)
+
+        (self.path / "good.dml").write_bytes("p { é }".encode())
+        (self.path / "bad.dml").write_bytes(b"p { x")
+        (self.path / "binary.dml").write_bytes(b"p { \xff\xfe }")
+
+    def check(self, workers):
+
+        names = ["good.dml", "missing.dml", "bad.dml", "binary.dml"]
+        inputs = [self.path / name for name in names] + ["q { y }"]
+        good, missing, bad, binary, text = parse_many(inputs, workers = workers, chunksize = 2)
+
+        self.assertEqual(render.render_string(good), "<p>é</p>")
+        self.assertEqual(render.render_string(text), "<q>y</q>")
+
+        # Every failure is a ParseError, with a position where there is one
+        self.assertEqual((missing.message, missing.line, missing.column), ("No such file or directory", 0, 0))
+        self.assertEqual((bad.line, bad.column), (1, 6))
+        self.assertEqual((binary.message, binary.line), ("Input is not valid UTF-8: invalid start byte", 0))
+
+        for error, name in zip((missing, bad, binary), names[1:]):
+            self.assertIs(type(error), ParseError)
+            self.assertEqual(error.filename, os.fspath(self.path / name))
+
+    def check_limits(self, workers):
+
+        deep = self.path / "deep.dml"
+        deep.write_text("a { b { c { d } } }\n")
+
+        results = list(parse_many([deep, "x\n\ny { z { w } }", "p { }"], workers = workers,
+            limits = Limits(max_depth = 1)))
+
+        for error, position in zip(results, [(1, 5), (3, 5)]):
+            self.assertIsInstance(error, LimitError)
+            self.assertEqual((error.message, error.line, error.column), ("Elements are nested deeper than 1", *position))
+
+        self.assertEqual(results[0].filename, os.fspath(deep))
+        self.assertEqual(render.render_string(results[2]), "<p></p>")
+
+    def test_one_worker(self):
+
+        self.check(1)
+
+    def test_two_workers(self):
+
+        self.check(2)
+
+    def test_limits(self):
+
+        self.check_limits(1)
+
+    def test_limits_across_pool(self):
+
+        # A LimitError keeps its class and position when pickled back
+        self.check_limits(2)
+
+
+if __name__ == "__main__":
+    unittest.main()
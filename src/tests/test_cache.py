@@ -0,0 +1,165 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import cache
+import document
+import render
+import serialize
+
+INPUTS = ["a { b }", "c { d e }", "f#g { h }", "i.j { k l m }"]
+
+class MemoryTest(unittest.TestCase):
+
+    def test_hits(self):
+
+        parse_cache = cache.ParseCache()
+        first = parse_cache.parse(INPUTS[0])
+        first.children[0].children.clear()
+        second = parse_cache.parse(INPUTS[0])
+
+        # Each lookup returns a new tree
+        self.assertEqual(render.render_string(second), "<a>b</a>")
+        self.assertEqual((parse_cache.stats.hits, parse_cache.stats.misses), (1, 1))
+
+        # Coalesced runs are cached apart from single words
+        runs = parse_cache.parse("x y", coalesce = True)
+        words = parse_cache.parse("x y")
+
+        self.assertEqual((len(runs.children), len(words.children)), (1, 2))
+        self.assertEqual(parse_cache.stats.misses, 3)
+
+    def test_evict_by_count(self):
+
+        parse_cache = cache.ParseCache(max_entries = 2)
+
+        for input in [INPUTS[0], INPUTS[1], INPUTS[0], INPUTS[2]]:
+            parse_cache.parse(input)
+
+        # The least recently used entry is evicted
+        self.assertEqual(len(parse_cache), 2)
+        self.assertEqual(parse_cache.stats.evictions, 1)
+        self.assertEqual(set(parse_cache.entries), {parse_cache.key(INPUTS[0]), parse_cache.key(INPUTS[2])})
+
+        parse_cache.parse(INPUTS[1])
+        self.assertEqual(parse_cache.stats.misses, 4)
+
+    def test_evict_by_size(self):
+
+        sizes = [len(serialize.dump_document(document.parse(input))) for input in INPUTS]
+        parse_cache = cache.ParseCache(max_bytes = sizes[0] + sizes[1])
+
+        parse_cache.parse(INPUTS[0])
+        parse_cache.parse(INPUTS[1])
+        self.assertEqual((len(parse_cache), parse_cache.size), (2, sizes[0] + sizes[1]))
+
+        # The oldest entries are evicted until the new one fits
+        parse_cache.parse(INPUTS[3])
+        self.assertNotIn(parse_cache.key(INPUTS[0]), parse_cache.entries)
+        self.assertIn(parse_cache.key(INPUTS[3]), parse_cache.entries)
+        self.assertLessEqual(parse_cache.size, parse_cache.max_bytes)
+
+        # An entry larger than the whole cache is not kept
+        large = "p { %s }" % " ".join(["word"] * 100)
+        parse_cache.parse(large)
+        self.assertNotIn(parse_cache.key(large), parse_cache.entries)
+        self.assertEqual(parse_cache.size, sum(len(data) for data in parse_cache.entries.values()))
+        self.assertLessEqual(parse_cache.size, parse_cache.max_bytes)
+
+
+class DiskTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def entry(self, input):
+
+        parse_cache = cache.ParseCache(directory = self.directory.name)
+        return parse_cache.path(parse_cache.key(input))
+
+    def test_shared_directory(self):
+
+        cache.ParseCache(directory = self.directory.name).parse(INPUTS[1])
+        parse_cache = cache.ParseCache(directory = self.directory.name)
+        root = parse_cache.parse(INPUTS[1])
+
+        self.assertEqual(render.render_string(root), "<c>d e</c>")
+        self.assertEqual((parse_cache.stats.disk_hits, parse_cache.stats.misses), (1, 0))
+
+        # The entry read from disk is kept in memory
+        parse_cache.parse(INPUTS[1])
+        self.assertEqual(parse_cache.stats.hits, 1)
+
+    def check_rejected(self, change):
+
+        cache.ParseCache(directory = self.directory.name).parse(INPUTS[2])
+        path = self.entry(INPUTS[2])
+
+        with open(path, "rb") as file:
+            data = bytearray(file.read())
+
+        change(data)
+
+        with open(path, "wb") as file:
+            file.write(data)
+
+        parse_cache = cache.ParseCache(directory = self.directory.name)
+        root = parse_cache.parse(INPUTS[2])
+
+        # The entry is parsed again and replaced
+        self.assertEqual(render.render_string(root), '<f id="g">h</f>')
+        self.assertEqual((parse_cache.stats.disk_errors, parse_cache.stats.misses, parse_cache.stats.disk_writes), (1, 1, 1))
+
+        parse_cache = cache.ParseCache(directory = self.directory.name)
+        parse_cache.parse(INPUTS[2])
+        self.assertEqual(parse_cache.stats.disk_hits, 1)
+
+    def test_reject_checksum(self):
+
+        def change(data):
+            data[-1] ^= 1
+
+        self.check_rejected(change)
+
+    def test_reject_version(self):
+
+        def change(data):
+            data[len(cache.MAGIC)] = serialize.VERSION - 1
+
+        self.check_rejected(change)
+
+    def test_reject_key(self):
+
+        def change(data):
+            data[len(cache.MAGIC) + 1] ^= 1
+
+        self.check_rejected(change)
+
+    def test_reject_truncated(self):
+
+        def change(data):
+            del data[10:]
+
+        self.check_rejected(change)
+
+    def test_atomic_write(self):
+
+        parse_cache = cache.ParseCache(directory = self.directory.name)
+        parse_cache.parse(INPUTS[0])
+
+        # Entries are written to a temporary file which is renamed
+        self.assertEqual(os.listdir(self.directory.name), [os.path.basename(self.entry(INPUTS[0]))])
+
+        # A failed rename leaves neither the temporary file nor an entry
+        with mock.patch("os.replace", side_effect = OSError):
+            parse_cache.parse(INPUTS[3])
+
+        self.assertEqual(parse_cache.stats.disk_errors, 1)
+        self.assertEqual(os.listdir(self.directory.name), [os.path.basename(self.entry(INPUTS[0]))])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import pickle
+import random
+import unittest
+
+import document
+import render
+import serialize
+from parser import Parser, ParseError
+from support import random_document
+
+def flatten(root):
+    """Returns the attributes of a document element and the nodes below it
+    in preorder, as tuples.  A node joined to its previous sibling is
+    preceded by "+"."""
+
+    out = [sorted(root.attributes.items(), key = str)]
+    stack = [(node, node in root.joined) for node in reversed(root.children)]
+
+    while stack:
+
+        node, joined = stack.pop()
+
+        if joined:
+            out.append("+")
+
+        if node.__class__ is document.Text:
+            out.append(node.value)
+            continue
+
+        out.append((node.namespace, node.name, node.id, sorted(node.classes),
+            sorted(node.attributes.items(), key = str), len(node.children)))
+        stack.extend((child, child in node.joined) for child in reversed(node.children))
+
+    return out
+
+
+def build(input, fused):
+
+    try:
+
+        if fused:
+            return flatten(document.parse(input))
+
+        return flatten(document.from_ast(Parser().parse(input)))
+
+    except ParseError as e:
+        return ("error", e.message, e.line, e.column)
+
+
+class DocumentBuilderTest(unittest.TestCase):
+
+    def test_same_as_from_ast(self):
+
+        rng = random.Random(7)
+
+        for _ in range(2000):
+
+            input = ("[x=y] " if rng.random() < 0.2 else "") + random_document(rng)
+            self.assertEqual(build(input, True), build(input, False), input)
+
+
+class ElementTest(unittest.TestCase):
+
+    def test_mutate_empty_containers(self):
+
+        root = document.parse("p { } div#a.b { [c=d] e }")
+        p = root.children[0]
+
+        p.children.append(document.Text("x"))
+        p.attributes["k"] = "v"
+        p.classes.add("c")
+
+        self.assertEqual([node.value for node in p.children], ["x"])
+        self.assertEqual(p.attributes, {"k": "v"})
+        self.assertEqual(p.classes, {"c"})
+        self.assertEqual(render.render_string(root),
+            '<p class="c" k="v">x</p> <div id="a" class="b" c="d">e</div>')
+
+    def test_accessors(self):
+
+        root = document.parse("p { } div#a.b { [c=d] e }")
+        p, div = root.children
+
+        self.assertFalse(p.has_attributes() or p.has_classes() or p.has_children())
+        self.assertEqual((list(p.iter_attributes()), list(p.iter_classes()), list(p.iter_children())),
+            ([], [], []))
+        self.assertEqual((list(div.iter_attributes()), list(div.iter_classes())), ([("c", "d")], ["b"]))
+        self.assertEqual([node.value for node in div.iter_children()], ["e"])
+
+        # Reading a document does not create empty containers
+        render.render_string(root)
+        serialize.dump_document(root)
+        root.query("p.x")
+
+        self.assertIs(p._children, document.EMPTY_CHILDREN)
+        self.assertIs(p._classes, document.EMPTY_CLASSES)
+        self.assertIs(p._attributes, document.EMPTY_ATTRIBUTES)
+
+    def test_pickle(self):
+
+        root = document.parse("[x=y] p { } div#a.b { [c] e `f` }")
+        self.assertEqual(flatten(pickle.loads(pickle.dumps(root))), flatten(root))
+
+
+class QueryTest(unittest.TestCase):
+
+    def test_repeated_id(self):
+
+        root = document.parse("div#main { } p#main { x } p.c { }")
+        div, p, other = root.children
+
+        self.assertEqual(root.query("p#main"), [p])
+        self.assertEqual(root.query("#main"), [div, p])
+        self.assertEqual(root.query("p"), [p, other])
+        self.assertEqual(root.query("#none"), [])
+
+    def test_invalid_selector(self):
+
+        root = document.parse("p { }")
+
+        for selector in ["", "  ", "#", "p q", "p {"]:
+
+            with self.assertRaises(ParseError, msg = selector):
+                root.query(selector)
+
+
+if __name__ == "__main__":
+    unittest.main()
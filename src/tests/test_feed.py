@@ -0,0 +1,66 @@
+import random
+import unittest
+
+from parser import FeedParser, Parser, ParseError
+from support import dump, random_document
+
+PIECES = ["a", "b1", " ", "\n", "\r\n", "\r", "{", "}", "[k=v]", "`r`", "`a``b`", "``",
+    "```\nq\n```", "````x```y````", "é", "div#i.c {", "}", " ", "`", "```"]
+
+def parse(input):
+    """Returns the dumped top-level elements and attributes of an input, or
+    the error it raises."""
+
+    try:
+        root = Parser().parse(input)
+    except ParseError as e:
+        return ("error", e.message, e.line, e.column)
+
+    return ([dump(node) for node in root.body.children],
+        [dump(attribute) for attribute in root.body.attributes])
+
+
+def feed(input, rng):
+    """As parse, but feeds the input to a FeedParser in random chunks."""
+
+    feeder = FeedParser()
+    nodes = []
+
+    try:
+
+        offset = 0
+
+        while offset < len(input):
+            size = rng.randint(1, 5)
+            nodes.extend(feeder.feed(input[offset:offset + size]))
+            offset += size
+
+        nodes.extend(feeder.close())
+
+    except ParseError as e:
+        return ("error", e.message, e.line, e.column)
+
+    return ([dump(node) for node in nodes],
+        [dump(attribute) for attribute in feeder.attributes])
+
+
+class FeedParserTest(unittest.TestCase):
+
+    def test_random_chunks(self):
+
+        rng = random.Random(0)
+
+        for _ in range(2000):
+
+            prefix = "[x=y] " if rng.random() < 0.2 else ""
+
+            if rng.random() < 0.5:
+                input = prefix + "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 20)))
+            else:
+                input = prefix + random_document(rng)
+
+            self.assertEqual(feed(input, rng), parse(input), input)
+
+
+if __name__ == "__main__":
+    unittest.main()
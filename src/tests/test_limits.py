@@ -0,0 +1,103 @@
+import time
+import unittest
+
+import document
+import stats
+from parser import Limits, LimitError, Parser, ParseError
+
+def limit_error(input, **limits):
+    """Returns the LimitError raised by parsing the input with limits."""
+
+    try:
+        Parser(limits = Limits(**limits)).parse(input)
+    except LimitError as error:
+        return error
+
+    raise AssertionError("no LimitError for %r" % input[:40])
+
+
+class LimitsTest(unittest.TestCase):
+
+    def test_max_size(self):
+
+        error = limit_error("a\nbb\nccc", max_size = 4)
+        self.assertEqual((error.message, error.line, error.column), ("Input is longer than 4", 2, 3))
+
+        Parser(limits = Limits(max_size = 8)).parse("a\nbb\nccc")
+
+    def test_max_size_large_input(self):
+
+        input = "word " * 2000000
+        start = time.perf_counter()
+
+        limit_error(input, max_size = 1000)
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_max_depth(self):
+
+        error = limit_error("a { b { c { } } }", max_depth = 2)
+        self.assertEqual((error.message, error.line, error.column), ("Elements are nested deeper than 2", 1, 9))
+
+        Parser(limits = Limits(max_depth = 3)).parse("a { b { c { } } }")
+
+    def test_max_nodes(self):
+
+        self.assertEqual(limit_error("a b c d", max_nodes = 3).message, "More than 3 nodes")
+        Parser(limits = Limits(max_nodes = 4)).parse("a b c d")
+
+    def test_max_nodes_counts_attributes_and_selectors(self):
+
+        attributes = "p { " + "[k=v] " * 10 + "}"
+        selectors = "p" + ".c" * 10 + " { }"
+
+        self.assertEqual(limit_error(attributes, max_nodes = 5).message, "More than 5 nodes")
+        self.assertEqual(limit_error(selectors, max_nodes = 5).message, "More than 5 nodes")
+
+    def test_max_raw_block(self):
+
+        input = "a\n```\n" + "x" * 100 + "\n```"
+        error = limit_error(input, max_raw_block = 50)
+        self.assertEqual((error.message, error.line, error.column), ("Raw block is longer than 50", 2, 1))
+
+        Parser(limits = Limits(max_raw_block = 120)).parse(input)
+
+    def test_max_tokens(self):
+
+        input = "word " * 5000
+
+        self.assertEqual(limit_error(input, max_tokens = 100).message, "More than 100 tokens")
+        Parser(limits = Limits(max_tokens = 5001)).parse(input)
+
+    def test_timeout(self):
+
+        error = limit_error("word " * 5000, timeout = 0)
+        self.assertEqual(error.message, "Parse took longer than 0 seconds")
+
+    def test_limit_error_is_parse_error(self):
+
+        self.assertIsInstance(limit_error("a b", max_size = 1), ParseError)
+
+    def test_not_recovered(self):
+
+        with self.assertRaises(LimitError):
+            Parser(recover = True, limits = Limits(max_depth = 0)).parse("a { } }")
+
+    def test_document_parse(self):
+
+        with self.assertRaises(LimitError):
+            document.parse("a { b { } }", limits = Limits(max_depth = 1))
+
+        root = document.parse("a { b { } }", limits = Limits(max_depth = 2))
+        self.assertEqual(root.children[0].name, "a")
+
+    def test_stats_parse(self):
+
+        with self.assertRaises(LimitError):
+            stats.parse("a b c d", limits = Limits(max_nodes = 3))
+
+        _, parse_stats = stats.parse("a b c d", limits = Limits(max_nodes = 4))
+        self.assertEqual(parse_stats.nodes["Text"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
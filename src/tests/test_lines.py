@@ -0,0 +1,118 @@
+import random
+import unittest
+
+from lines import LineIndex
+from parser import Parser, ParseError
+
+def positions(input):
+    """Returns the (line, column) of every offset of an input, found one
+    character at a time."""
+
+    out = []
+    line = 1
+    column = 1
+    offset = 0
+
+    while offset <= len(input):
+
+        out.append((line, column))
+
+        if offset == len(input):
+            break
+
+        if input.startswith("\r\n", offset):
+            out.append((line, column + 1))
+            offset += 2
+            line += 1
+            column = 1
+        elif input[offset] in "\r\n  ":
+            offset += 1
+            line += 1
+            column = 1
+        else:
+            offset += 1
+            column += 1
+
+    return out
+
+
+class LineIndexTest(unittest.TestCase):
+
+    def test_positions(self):
+
+        rng = random.Random(0)
+
+        for _ in range(500):
+
+            input = "".join(rng.choice(["a", "b", "\n", "\r", "\r\n", " "]) for _ in range(rng.randint(0, 20)))
+            expected = positions(input)
+
+            # Positions are asked for in random order, so that line breaks
+            # are found in several steps, which may end inside a CRLF pair
+            index = LineIndex(input)
+            offsets = list(range(len(input) + 1))
+            rng.shuffle(offsets)
+
+            for offset in offsets:
+                self.assertEqual(index.position(offset), expected[offset], (input, offset))
+
+            self.assertEqual(index.line_count(), expected[-1][0])
+
+    def test_bytes(self):
+
+        index = LineIndex("a\r\né b".encode())
+
+        self.assertEqual(index.position(3), (2, 1))
+        self.assertEqual(index.position(8), (3, 1))
+        self.assertEqual(index.line_offset(3), 8)
+
+    def test_lines(self):
+
+        # Each kind of line break, in str and UTF-8 input
+        input = "a\nb\r\nc\rd\u2028e\u2029f"
+
+        for data in (input, input.encode()):
+
+            index = LineIndex(data)
+            starts = [data.index(letter if isinstance(data, str) else letter.encode()) for letter in "abcdef"]
+
+            self.assertEqual(index.line_count(), 6)
+            self.assertEqual([index.line_offset(line) for line in range(1, 7)], starts)
+            self.assertEqual([index.line_number(start) for start in starts], [1, 2, 3, 4, 5, 6])
+            self.assertEqual([index.position(start) for start in starts], [(line, 1) for line in range(1, 7)])
+
+            # A line break belongs to the line it ends
+            self.assertEqual(index.line_number(starts[2] - 1), 2)
+            self.assertEqual(index.position(len(data)), (6, 2))
+
+            for line in (0, 7):
+                self.assertRaises(IndexError, index.line_offset, line)
+
+    def test_empty(self):
+
+        index = LineIndex("")
+
+        self.assertEqual((index.line_count(), index.position(0), index.line_offset(1)), (1, (1, 1), 0))
+
+    def test_error_position(self):
+
+        # Parse errors are located with the index, counting every kind of
+        # line break; an unexpected token is reported at its end
+        for input in ["a\r\nb\u2028c }", "a\rb\n\nc d }", "```\nx\r\n``` }"]:
+
+            with self.assertRaises(ParseError) as context:
+                Parser().parse(input)
+
+            self.assertEqual((context.exception.line, context.exception.column),
+                positions(input)[input.index("}") + 1], input)
+
+    def test_finds_breaks_up_to_offset(self):
+
+        index = LineIndex("a\n" * 1000)
+        index.position(10)
+
+        self.assertLess(len(index.breaks), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,220 @@
+import random
+import unittest
+
+import document
+import render
+from parser import EventBuilder, Parser, ParseError, TreeBuilder, iterparse, parse_tolerant
+from support import random_document
+
+# An input with a stray "}", an invalid attribute and an unterminated raw
+# string, each of which the parser recovers from
+INPUT = "a { b } }\nc { [=x] d } e `f"
+
+MESSAGES = ["Unexpected token }", "Unexpected token =", "Unterminated raw string"]
+
+class RecoverTest(unittest.TestCase):
+
+    def test_tree_builder(self):
+
+        root, errors = parse_tolerant(INPUT, TreeBuilder())
+
+        self.assertEqual([error.message for error in errors], MESSAGES)
+        self.assertEqual([node.type for node in root.body.children],
+            ["Element", "Error", "Element", "Text", "Error"])
+        self.assertEqual([node.message for node in root.body.children if node.type == "Error"],
+            ["Unexpected token }", "Unterminated raw string"])
+
+    def test_event_builder(self):
+
+        builder = EventBuilder()
+        parser = Parser(recover = True)
+        parser.parse(INPUT, builder)
+
+        self.assertEqual([error.message for error in parser.errors], MESSAGES)
+        self.assertEqual([data.message for event, data in builder.events if event == "error"], MESSAGES)
+
+    def test_document_builder(self):
+
+        parser = Parser(recover = True)
+        root = parser.parse(INPUT, document.DocumentBuilder())
+
+        self.assertEqual([error.message for error in parser.errors], MESSAGES)
+        self.assertEqual(render.render_string(root), "<a>b</a> <c>d</c> e")
+
+    def test_scanner_message(self):
+
+        for input, message in [("p { `abc", "Unterminated raw string"),
+                ("p { ```\nabc", "Unterminated raw block")]:
+
+            with self.assertRaises(ParseError) as context:
+                Parser().parse(input)
+
+            self.assertEqual(context.exception.message, message)
+
+
+def texts(node, out):
+    """Appends the types and words of the text nodes below an AST node, and
+    the selectors of its elements, to a list in preorder."""
+
+    stack = [node]
+
+    while stack:
+
+        node = stack.pop()
+
+        if node is None:
+            continue
+
+        if node.type == "Text":
+            out.extend(("Text", word) for word in node.value.split())
+        elif node.type in ("RawString", "RawBlock"):
+            out.append((node.type, node.value))
+        elif node.type == "Element":
+            out.append(("Element", node.start))
+
+        stack.extend(reversed(list(node)))
+
+    return out
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def parse(self, input):
+
+        root = Parser(coalesce = True).parse(input)
+        return [(node.type, node.value) if node.type != "Element" else
+            ("Element", [(child.type, child.value) for child in node.body.children])
+            for node in root.body.children]
+
+    def test_runs(self):
+
+        self.assertEqual(self.parse("p { one two\n  three } x  y"),
+            [("Element", [("Text", "one two\n  three")]), ("Text", "x  y")])
+
+        # Raw strings and blocks end a run
+        self.assertEqual(self.parse("a `r` b c ```\nd\n``` e"),
+            [("Text", "a"), ("RawString", "r"), ("Text", "b c"), ("RawBlock", "\nd\n"), ("Text", "e")])
+
+    def test_inline_element(self):
+
+        # Text before a "{" on the same line is the selector of an element,
+        # and text on an earlier line is not
+        self.assertEqual(self.parse("a b c { d } e"),
+            [("Text", "a b"), ("Element", [("Text", "d")]), ("Text", "e")])
+        self.assertEqual(self.parse("a b\nc { d }"),
+            [("Text", "a b"), ("Element", [("Text", "d")])])
+        self.assertEqual(self.parse("a b\n{ d }"),
+            [("Text", "a b"), ("Element", [("Text", "d")])])
+        self.assertEqual(Parser(coalesce = True).parse("a b c { d }").body.children[1].selectors[0].name.value, "c")
+
+    def test_same_words(self):
+
+        rng = random.Random(22)
+
+        for _ in range(500):
+
+            input = random_document(rng)
+
+            try:
+                words = Parser().parse(input)
+            except ParseError:
+                continue
+
+            runs = Parser(coalesce = True).parse(input)
+
+            self.assertEqual(texts(runs, []), texts(words, []), input)
+            self.assertEqual(render.render_string(document.parse(input, coalesce = True)),
+                render.render_string(document.from_ast(runs)), input)
+
+
+def tree_events(root):
+    """Returns the events iterparse makes for an AST, as tuples."""
+
+    out = []
+    stack = [(root, False)]
+
+    while stack:
+
+        node, closing = stack.pop()
+
+        if closing:
+            out.append(("end_element", node.start, node.end))
+            continue
+
+        if node.type != "Element":
+            out.append((EventBuilder.names[node.type], node.start, node.end, node.value))
+            continue
+
+        out.append(("start_element", node.start, node.body.start,
+            [selector.type for selector in node.selectors], len(node.body.attributes)))
+        stack.append((node, True))
+        stack.extend((child, False) for child in reversed(node.body.children))
+
+    return out
+
+
+def events(input):
+    """Returns the events of iterparse for an input, as tuples."""
+
+    out = []
+
+    for event, data in iterparse(input):
+
+        if event == "start_element":
+            out.append((event, data.start, data.body_start,
+                [selector.type for selector in data.selectors], len(data.attributes)))
+        elif event == "end_element":
+            out.append((event, data.start, data.end))
+        else:
+            out.append((event, data.start, data.end, data.value))
+
+    return out
+
+
+class IterparseTest(unittest.TestCase):
+
+    def test_events(self):
+
+        self.assertEqual(events("p.c { [k=v] a `b` }\n```\nc\n```"), [
+            ("start_element", 0, 0, [], 0),
+            ("start_element", 0, 4, ["NameSelector", "ClassSelector"], 1),
+            ("text", 12, 13, "a"),
+            ("raw_string", 14, 17, "b"),
+            ("end_element", 0, 19),
+            ("raw_block", 20, 29, "\nc\n"),
+            ("end_element", 0, 29),
+        ])
+
+    def test_same_as_tree(self):
+
+        rng = random.Random(6)
+
+        for _ in range(500):
+
+            input = random_document(rng)
+
+            try:
+                tree = Parser().parse(input)
+            except ParseError:
+                self.assertRaises(ParseError, events, input)
+                continue
+
+            self.assertEqual(events(input), tree_events(tree), input)
+
+    def test_incremental(self):
+
+        # Events are produced as the input is read, before the error at its
+        # end is found
+        parts = iterparse("p { a } " * 1000 + "}")
+
+        self.assertEqual(next(parts)[0], "start_element")
+        self.assertEqual(next(parts)[0], "start_element")
+        self.assertEqual(next(parts)[0], "text")
+
+        with self.assertRaises(ParseError):
+            for _ in parts:
+                pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import io
+import random
+import unittest
+
+import document
+import render
+from bench import naive_html
+from support import random_document
+
+class Chunks:
+    """A file which keeps each string written to it."""
+
+    def __init__(self):
+
+        self.chunks = []
+
+    def write(self, data):
+
+        self.chunks.append(data)
+
+
+class RenderTest(unittest.TestCase):
+
+    def test_markup(self):
+
+        root = document.parse("n:p#i.b.a { [k=v] [flag] x } br { } div { } { y }")
+
+        self.assertEqual(render.render_string(root),
+            '<n:p id="i" class="a b" k="v" flag>x</n:p> <br> <div></div> <div>y</div>')
+        self.assertEqual(render.render_string(root, xml = True, default_name = "g"),
+            '<n:p id="i" class="a b" k="v" flag="flag">x</n:p> <br/> <div/> <g>y</g>')
+
+    def test_escape(self):
+
+        root = document.parse('p { [k=`a"<&>`] `x < y && z` }')
+        e = root.children[0]
+        e.id = 'i"'
+        e.add_class("<c>")
+
+        self.assertEqual(render.render_string(root),
+            '<p id="i&quot;" class="&lt;c&gt;" k="a&quot;&lt;&amp;&gt;">x &lt; y &amp;&amp; z</p>')
+
+    def test_whitespace(self):
+
+        # Siblings are only separated where the source has whitespace
+        for input, html in [
+            ("a {b},c", "<a>b</a>,c"),
+            ("x{y}z { w }", "<x>y</x><z>w</z>"),
+            ("p{a`b`c} q", "<p>abc</p> q"),
+            ("p { a\n\n b } q{}r{} s", "<p>a b</p> <q></q><r></r> s"),
+        ]:
+
+            self.assertEqual(render.render_string(document.parse(input)), html, input)
+
+    def test_same_as_naive(self):
+
+        rng = random.Random(13)
+
+        for _ in range(500):
+
+            # Dropping some spaces joins some of the siblings
+            input = "".join(c for c in random_document(rng) if c != " " or rng.random() < 0.7)
+
+            try:
+                root = document.parse(input)
+            except Exception:
+                continue
+
+            self.assertEqual(render.render_string(root), naive_html(root), input)
+
+    def test_chunks(self):
+
+        words = ["w%d" % i for i in range(10000)]
+        root = document.parse("p { %s } div { %s }" % (" ".join(words), " & ".join(words[:300])))
+        out = Chunks()
+
+        render.render(root, out, buffer_size = 1000)
+
+        self.assertEqual("".join(out.chunks), "<p>%s</p> <div>%s</div>" %
+            (" ".join(words), " &amp; ".join(words[:300])))
+
+        # Long runs of text are written in parts of RUN_LENGTH words
+        self.assertGreaterEqual(len(out.chunks), 3)
+        self.assertLess(max(len(chunk) for chunk in out.chunks), 30000)
+
+        # Siblings of many elements are written in several chunks too
+        root = document.parse("list { %s }" % " ".join("item { %s }" % word for word in words))
+        out = Chunks()
+
+        render.render(root, out, buffer_size = 1000)
+
+        self.assertGreater(len(out.chunks), 10)
+        self.assertEqual("".join(out.chunks), render.render_string(root))
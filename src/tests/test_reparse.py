@@ -0,0 +1,134 @@
+import pickle
+import random
+import unittest
+
+import syntax
+from parser import Parser, ParseError
+from support import dump, random_document
+
+# Pieces of text inserted by the random edits
+INSERTS = ["a", "bb", "c-d", "é", "`r`", "``", "```x```", "[k=v]", "{", "}", " ", "\n",
+    "div {", "x#y.z {", "ns:n {", "}", "\r\n", "\t"]
+
+def parse(input, old_tree = None, old_text = None, edit = None):
+    """Returns the dumped tree for an input, or the error it raises."""
+
+    try:
+
+        if old_tree is None:
+            return dump(Parser().parse(input))
+
+        return dump(Parser().reparse(old_tree, old_text, edit))
+
+    except ParseError as e:
+        return ("error", e.message, e.line, e.column)
+
+
+class ReparseTest(unittest.TestCase):
+
+    def test_random_edits(self):
+
+        rng = random.Random(0)
+        parsed = 0
+
+        for _ in range(1500):
+
+            text = random_document(rng)
+
+            try:
+                tree = Parser().parse(text)
+            except ParseError:
+                continue
+
+            offset = rng.randint(0, len(text))
+            removed = rng.randint(0, min(4, len(text) - offset))
+            inserted = "".join(rng.choice(INSERTS) for _ in range(rng.randint(0, 2)))
+            new_text = text[:offset] + inserted + text[offset + removed:]
+
+            expected = parse(new_text)
+            parsed += expected[0] != "error"
+
+            self.assertEqual(parse(new_text, tree, text, (offset, removed, inserted)), expected,
+                (text, offset, removed, inserted))
+
+        self.assertGreater(parsed, 0)
+
+    def test_successive_edits(self):
+
+        rng = random.Random(1)
+        checked = 0
+
+        for _ in range(300):
+
+            text = random_document(rng)
+
+            try:
+                tree = Parser().parse(text)
+            except ParseError:
+                continue
+
+            for _ in range(5):
+
+                offset = rng.randint(0, len(text))
+                removed = rng.randint(0, min(4, len(text) - offset))
+                inserted = "".join(rng.choice(INSERTS) for _ in range(rng.randint(0, 2)))
+                new_text = text[:offset] + inserted + text[offset + removed:]
+
+                try:
+                    new_tree = Parser().reparse(tree, text, (offset, removed, inserted))
+                except ParseError:
+                    continue
+
+                # Nodes read after several edits have all of them applied,
+                # and a pickled tree has the shifts applied too
+                if rng.random() < 0.5:
+                    self.assertEqual(dump(pickle.loads(pickle.dumps(new_tree))), parse(new_text))
+
+                if rng.random() < 0.5:
+                    self.assertEqual(dump(new_tree), parse(new_text), (text, offset, removed, inserted))
+
+                tree = new_tree
+                text = new_text
+                checked += 1
+
+            self.assertEqual(dump(tree), parse(text))
+
+            # The text nodes share the new text, and none holds an old one
+            sources = set()
+            stack = [tree]
+
+            while stack:
+
+                node = stack.pop()
+
+                if isinstance(node, syntax.TextNode) and node.spans is not None:
+                    self.assertEqual(node.source, text)
+                    sources.add(id(node.source))
+                elif node is not None and not isinstance(node, syntax.TextNode):
+                    stack.extend(syntax.children(node))
+
+            self.assertLessEqual(len(sources), 1)
+
+        self.assertGreater(checked, 100)
+
+    def test_later_siblings_shifted_when_read(self):
+
+        text = "a { b } c { d { `e` } f { [g=`h`] } } i"
+        tree = Parser().parse(text)
+        c = tree.body.children[1]
+
+        tree = Parser().reparse(tree, text, (4, 1, "bb"))
+        new_text = text[:4] + "bb" + text[5:]
+
+        # The element is shifted at once and its contents when first read
+        self.assertEqual((c.start, c.end), (9, 38))
+        self.assertIsNotNone(c.pending)
+        self.assertEqual(dump(tree), parse(new_text))
+        self.assertIsNone(c.pending)
+        self.assertEqual(c.body.children[1].body.attributes[0].value.value, "h")
+        self.assertEqual(c.body.children[0].body.children[0].source, new_text)
+        self.assertIs(c.body.children[0].body.children[0].source, tree.body.children[0].body.children[0].source)
+
+
+if __name__ == "__main__":
+    unittest.main()
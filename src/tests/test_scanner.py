@@ -0,0 +1,114 @@
+import random
+import time
+import unittest
+
+import scanner
+from scanner import Scanner
+
+ALPHABET = list("ab9_-Zx") + list(" \t\n\r{}[]=.:#`|\x00\x7f") + [
+    "é", "　", " ", "\xa0", "中", "\r\n", "```", "``", "````"]
+
+def tokens(input, contexts, reference):
+
+    scanner = Scanner(input, reference = reference)
+    out = []
+
+    for i in range(10000):
+
+        token = scanner.next(contexts[i % len(contexts)])
+        out.append((token, scanner.start, scanner.end, scanner.value, scanner.spans,
+            scanner.newlines, scanner.error))
+
+        if token == "eof":
+            break
+
+    return out
+
+
+class ScannerTest(unittest.TestCase):
+
+    def test_pattern_matches_reference(self):
+
+        rng = random.Random(1)
+
+        for _ in range(3000):
+
+            input = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 30)))
+            contexts = [rng.choice([None, "head", "selector"]) for _ in range(7)]
+
+            self.assertEqual(tokens(input, contexts, False), tokens(input, contexts, True),
+                (input, contexts))
+
+    def test_many_escaped_backticks(self):
+
+        # Each pair of backticks adds a span, which took quadratic time when
+        # the spans were collected by concatenating tuples
+        count = 100000
+        scanner = Scanner("`" + "a``" * count + "`")
+        start = time.perf_counter()
+
+        self.assertEqual(scanner.next(None), "raw-string")
+        self.assertEqual(scanner.value, "a`" * count)
+        self.assertEqual(len(scanner.spans), 2 * count + 2)
+        self.assertLess(time.perf_counter() - start, 2)
+
+
+def expected_class(chr):
+    """Returns the class flags of a character by the rules of the DML
+    grammar, matching the whitespace and newline patterns one character at a
+    time."""
+
+    c = ord(chr)
+
+    if scanner.nl_chars.match(chr):
+        return scanner.NEWLINE
+
+    if scanner.ws_chars.match(chr):
+        return scanner.SPACE
+
+    if c >= 128:
+        return scanner.ASTRAL_CLASS
+
+    flags = 0 if chr in "\x00`{}" else scanner.TEXT
+
+    if chr.isalpha() or chr == "_":
+        flags |= scanner.IDENT | scanner.IDENT_START
+    elif chr.isdigit() or chr == "-":
+        flags |= scanner.IDENT
+
+    return flags
+
+
+class CharClassTest(unittest.TestCase):
+
+    def test_table(self):
+
+        classes = scanner.char_classes
+
+        self.assertEqual(len(classes), 0x10000)
+
+        for c in range(0x10000):
+
+            # Surrogates are not characters of any input, and are left as text
+            if 0xD800 <= c < 0xE000:
+                self.assertEqual(classes[c], scanner.ASTRAL_CLASS)
+            else:
+                self.assertEqual(classes[c], expected_class(chr(c)), hex(c))
+
+    def test_lookups(self):
+
+        self.assertEqual(scanner.char_class(""), 0)
+        self.assertEqual(scanner.char_class("\U0001F600"), scanner.ASTRAL_CLASS)
+
+        for chr, identifier, first, text in [
+                ("a", True, True, True), ("9", True, False, True), ("-", True, False, True),
+                ("é", True, True, True), ("中", True, True, True), ("\U00020000", True, True, True),
+                (".", False, False, True), ("{", False, False, False), ("`", False, False, False),
+                ("\u3000", False, False, False), ("\u2028", False, False, False), ("", False, False, False)]:
+
+            self.assertEqual((scanner.is_identifier_char(chr), scanner.is_identifier_char(chr, True),
+                scanner.is_text_char(chr)), (identifier, first, text), repr(chr))
+
+
+if __name__ == "__main__":
+    unittest.main()
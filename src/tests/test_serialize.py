@@ -0,0 +1,149 @@
+import os
+import random
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import document
+import render
+import serialize
+import syntax
+from parser import Parser, ParseError
+from support import dump, random_document
+
+def trees(seed, count):
+    """Yields (input, AST) pairs for random documents which parse."""
+
+    rng = random.Random(seed)
+
+    for _ in range(count):
+
+        input = random_document(rng)
+
+        try:
+            yield input, Parser().parse(input)
+        except ParseError:
+            continue
+
+
+class ASTTest(unittest.TestCase):
+
+    def test_round_trip(self):
+
+        for input, tree in trees(25, 300):
+            self.assertEqual(dump(serialize.load_ast(serialize.dump_ast(tree))), dump(tree), input)
+
+    def test_spans_and_subtrees(self):
+
+        for input, tree in trees(26, 100):
+
+            nodes = serialize.preorder(tree, syntax.children)[0]
+
+            with serialize.Reader(serialize.dump_ast(tree)) as reader:
+
+                self.assertEqual(len(reader), len(nodes))
+
+                for index, node in enumerate(nodes):
+
+                    self.assertEqual(reader.type(index), node.type)
+                    self.assertEqual(reader.span(index), (node.start, node.end), input)
+
+                    # A subtree is loaded with the offsets it has in the tree
+                    if index % 3 == 0:
+                        self.assertEqual(dump(reader.load(index)), dump(node), input)
+
+    def test_wrong_kind(self):
+
+        data = serialize.dump_document(document.parse("p { }"))
+
+        with self.assertRaises(ValueError):
+            serialize.load_ast(data)
+
+        with self.assertRaises(ValueError):
+            serialize.Reader(data).span(0)
+
+
+class DocumentTest(unittest.TestCase):
+
+    def test_round_trip(self):
+
+        for input, _ in trees(27, 300):
+
+            root = document.parse(input)
+            loaded = serialize.load_document(serialize.dump_document(root))
+
+            self.assertEqual(render.render_string(loaded), render.render_string(root), input)
+
+    def test_open_file(self):
+
+        root = document.parse("a { b } c { [k=v] d#i.j { e } }")
+
+        with tempfile.TemporaryDirectory() as directory:
+
+            path = os.path.join(directory, "tree.dmlb")
+
+            with open(path, "wb") as file:
+                file.write(serialize.dump_document(root))
+
+            with serialize.open_file(path) as reader:
+
+                self.assertEqual(reader.type(0), "Element")
+                self.assertEqual(reader.children(0), [1, 3])
+                self.assertEqual(render.render_string(reader.load(3)), '<d id="i" class="j">e</d>')
+                self.assertEqual(render.render_string(reader.load()), render.render_string(root))
+
+            self.assertIsNone(reader.mapping)
+
+            # A file which is not a serialized tree is closed again
+            with open(path, "wb") as file:
+                file.write(b"not a tree")
+
+            with self.assertRaises(ValueError):
+                serialize.open_file(path)
+
+
+class FormatTest(unittest.TestCase):
+
+    def test_64_bit_offsets(self):
+
+        root = document.parse("a { b } c { [k=v] d#i.j { e } }")
+
+        with mock.patch.object(serialize, "LARGE", 0):
+            data = serialize.dump_document(root)
+
+        with serialize.Reader(data) as reader:
+
+            # Each entry of the indexes takes four more bytes
+            self.assertEqual(reader.width, 8)
+            self.assertEqual(len(data) - len(serialize.dump_document(root)),
+                4 * (len(reader) + len(reader.string_offsets)))
+
+        self.assertEqual(render.render_string(serialize.load_document(data)), render.render_string(root))
+
+    def test_corrupt(self):
+
+        data = bytearray(serialize.dump_document(document.parse("p#a { b }")))
+
+        # The text node refers to a string past the end of the table
+        with serialize.Reader(data) as reader:
+            text = reader.node_offsets[2]
+            string_count = struct.unpack_from("<Q", data, 8)[0]
+
+        data[text + 1] = string_count
+
+        with self.assertRaises(ValueError):
+            serialize.load_document(bytes(data))
+
+        with serialize.Reader(bytes(data)) as reader:
+
+            with self.assertRaises(ValueError):
+                reader.load(2)
+
+        # An index which does not fit in the buffer
+        with self.assertRaises(ValueError):
+            serialize.load_document(bytes(data[:-1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
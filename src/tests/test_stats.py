@@ -0,0 +1,91 @@
+import random
+import unittest
+
+import document
+import render
+import stats
+from parser import Parser, ParseError
+from support import dump, random_document
+
+class StatsTest(unittest.TestCase):
+
+    def test_counts(self):
+
+        tree, parse_stats = stats.parse("p { [k=v] a `b` c { d } }")
+
+        self.assertEqual(dump(tree), dump(Parser().parse("p { [k=v] a `b` c { d } }")))
+
+        # The root is counted as an element
+        self.assertEqual(parse_stats.nodes, {"Element": 3, "Identifier": 4, "NameSelector": 2,
+            "Attribute": 1, "Text": 2, "RawString": 1})
+        self.assertEqual(parse_stats.max_depth, 3)
+        self.assertEqual(parse_stats.tokens["{"], 2)
+        self.assertEqual(parse_stats.tokens["}"], 2)
+        self.assertEqual(parse_stats.tokens["raw-string"], 1)
+        self.assertEqual(parse_stats.tokens["eof"], 1)
+
+        # The text before each "{" is scanned again as the selector
+        self.assertEqual(parse_stats.rewinds, 2)
+        self.assertGreaterEqual(parse_stats.rescanned, len("pc"))
+
+        self.assertEqual(set(parse_stats.timings), {"scan", "build", "parse"})
+        self.assertGreaterEqual(parse_stats.timings["parse"], parse_stats.timings["scan"])
+        self.assertEqual(set(parse_stats.as_dict()), set(stats.ParseStats.__slots__))
+
+    def test_non_ascii(self):
+
+        # Raw strings are not counted
+        input = "p { naïve 日本語 `ü` } é x"
+
+        for data in (input, input.encode(), bytearray(input.encode())):
+            self.assertEqual(stats.parse(data)[1].non_ascii_chars, 5)
+
+        for s in ["", "abc", "é日\ud800x"]:
+            self.assertEqual(stats.count_non_ascii(s, 0, len(s)), sum(1 for c in s if c >= "\x80"))
+            self.assertEqual(stats.count_non_ascii(s.encode("utf-8", "surrogatepass"), 0, 99),
+                sum(1 for c in s if c >= "\x80"))
+
+    def test_same_result(self):
+
+        rng = random.Random(17)
+
+        for _ in range(200):
+
+            input = random_document(rng)
+
+            try:
+                expected = dump(Parser().parse(input))
+            except ParseError:
+                self.assertRaises(ParseError, stats.parse, input)
+                continue
+
+            self.assertEqual(dump(stats.parse(input)[0]), expected, input)
+
+    def test_builder(self):
+
+        root, parse_stats = stats.parse("a { b } c", document.DocumentBuilder())
+
+        self.assertEqual(render.render_string(root), "<a>b</a> c")
+        self.assertEqual(parse_stats.nodes, {"Element": 2, "Identifier": 1, "NameSelector": 1, "Text": 2})
+
+    def test_hook(self):
+
+        seen = []
+
+        with self.assertRaises(ParseError):
+            stats.parse("a { b", hook = seen.append)
+
+        # The hook gets the stats of a failed parse too
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(seen[0].nodes["Element"], 2)
+        self.assertGreater(seen[0].timings["parse"], 0)
+
+        root, parse_stats = stats.parse_document("a { b } c", hook = seen.append)
+
+        self.assertIs(seen[1], parse_stats)
+        self.assertEqual(render.render_string(root), "<a>b</a> c")
+        self.assertIn("from_ast", parse_stats.timings)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import mmap
+import tempfile
+import unittest
+
+import syntax
+from parser import Parser
+from syntax import NodeStore, Transformer, Visitor
+
+# Node types which have a string value
+VALUE_TYPES = ("Identifier", "Text", "RawString", "RawBlock")
+
+INPUT = "p#a.b { [k=`v`] the é ``raw`` `x``y` ```\nblock\n``` }"
+
+def values(root):
+    """Returns the types and values of the nodes of a tree in preorder."""
+
+    out = []
+    stack = [root]
+
+    while stack:
+        node = stack.pop()
+        out.append((node.type, node.value if node.type in VALUE_TYPES else None))
+        stack.extend(reversed([child for child in node if child is not None]))
+
+    return out
+
+
+class NodeStoreTest(unittest.TestCase):
+
+    def test_bytes_source(self):
+
+        expected = values(NodeStore.from_tree(Parser().parse(INPUT)).root)
+        store = NodeStore.from_tree(Parser().parse(INPUT.encode()))
+
+        self.assertEqual(values(store.root), expected)
+
+    def test_closed_mmap_source(self):
+
+        expected = values(NodeStore.from_tree(Parser().parse(INPUT)).root)
+
+        with tempfile.TemporaryFile() as file:
+
+            file.write(INPUT.encode())
+            file.flush()
+
+            with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as buffer:
+                store = NodeStore.from_tree(Parser().parse(buffer))
+
+        self.assertEqual(values(store.root), expected)
+
+    def test_identifier_spans(self):
+
+        store = NodeStore.from_tree(Parser().parse(INPUT))
+
+        # The selectors come before the first text node, but their values
+        # are kept as spans too; only the raw string with an escape is not
+        self.assertEqual(list(store.values.values()), ["x`y"])
+        self.assertEqual(values(store.root), values(Parser().parse(INPUT)))
+
+    def test_cached_views(self):
+
+        tree = Parser().parse(INPUT)
+        store = NodeStore.from_tree(tree)
+        body = store.root.body.children[0].body
+
+        self.assertIs(body.children, body.children)
+        self.assertIs(body.attributes, store.root.body.children[0].body.attributes)
+        self.assertEqual([node.type for node in body.attributes], ["Attribute"])
+        self.assertEqual([node.value for node in body.children],
+            [node.value for node in tree.body.children[0].body.children])
+
+        # Adding a child discards the views of its parent
+        store.add(store.kind[body.children[0].index], 0, 0, body.index, body.children[-1].index)
+        self.assertEqual(len(body.children), len(tree.body.children[0].body.children) + 1)
+
+
+class Recorder(Visitor):
+    """Records the nodes it visits and leaves, skipping elements whose
+    first selector is "skip"."""
+
+    def __init__(self):
+
+        self.events = []
+
+    def generic_visit(self, node):
+
+        self.events.append(node.type)
+
+    def visit_Element(self, node):
+
+        self.events.append("Element")
+
+        if node.selectors and node.selectors[0].type == "NameSelector" and node.selectors[0].name.value == "skip":
+            return Visitor.SKIP
+
+    def leave_Element(self, node):
+
+        self.events.append("/Element")
+
+    def visit_Text(self, node):
+
+        self.events.append(node.value)
+
+
+class VisitorTest(unittest.TestCase):
+
+    def test_order(self):
+
+        recorder = Recorder()
+        recorder.visit(Parser().parse("a { [k=v] b `c` } skip { d } e"))
+
+        self.assertEqual(recorder.events, [
+            "Element", "ElementBody",
+            "Element", "NameSelector", "Identifier", "ElementBody",
+            "Attribute", "Identifier", "Identifier", "b", "RawString", "/Element",
+            "Element", "e", "/Element"])
+
+    def test_node_views(self):
+
+        # Views are dispatched on their type names
+        tree = Parser().parse(INPUT)
+        expected = Recorder()
+        expected.visit(tree)
+        recorder = Recorder()
+        recorder.visit(NodeStore.from_tree(tree).root)
+
+        self.assertEqual(recorder.events, expected.events)
+
+    def test_deep(self):
+
+        recorder = Recorder()
+        recorder.visit(Parser().parse("a { " * 5000 + "x" + " }" * 5000))
+
+        self.assertEqual(recorder.events.count("/Element"), 5001)
+
+
+class Rewriter(Transformer):
+    """Removes text "x", splits raw strings into words and renames elements
+    to upper case."""
+
+    def transform_Text(self, node):
+
+        return None if node.value == "x" else node
+
+    def transform_RawString(self, node):
+
+        return [syntax.Text(word, 0, node.start, node.end) for word in node.value.split()]
+
+    def transform_Identifier(self, node):
+
+        return syntax.Identifier(node.value.upper(), node.start, node.end)
+
+
+class TransformerTest(unittest.TestCase):
+
+    def test_rewrite(self):
+
+        root = Rewriter().transform(Parser().parse("p { x y `u v` } x q { [k=w] }"))
+        p, q = root.body.children
+
+        self.assertEqual([node.value for node in p.body.children], ["y", "u", "v"])
+        self.assertEqual((p.selectors[0].name.value, q.selectors[0].name.value), ("P", "Q"))
+
+        self.assertEqual((q.body.attributes[0].key.value, q.body.attributes[0].value.value), ("K", "W"))
+
+    def test_deep(self):
+
+        root = Rewriter().transform(Parser().parse("a { " * 5000 + "x y" + " }" * 5000))
+
+        for _ in range(5000):
+            root = root.body.children[0]
+
+        self.assertEqual([node.value for node in root.body.children], ["y"])
+
+
+if __name__ == "__main__":
+    unittest.main()